@@ -0,0 +1,6 @@
+# exit script on any error
+trap 'exit' ERR
+
+cd test/benchmark
+
+python3 benchmark.py "$@"
@@ -12,25 +12,53 @@
 # INIT          : ./backup.py config/example.json init
 # LIST SNAPSHOTS: ./backup.py config/example.json snapshots
 # BACKUP        : ./backup.py config/example.json backup
+# PLAN BACKUP   : ./backup.py config/example.json plan
 # LIST FILES    : ./backup.py config/example.json ls <snapshot|latest>
 # CHECK         : ./backup.py config/example.json check
 # STATS         : ./backup.py config/example.json stats
 # PRUNE         : ./backup.py config/example.json prune
-# RESTORE       : ./backup.py config/example.json restore <snapshot|latest> /etc /tmp/restored/etc
+# RESTORE       : ./backup.py config/example.json restore <snapshot|latest|auto> /etc /tmp/restored/etc
+# RESTORE (FAST): ./backup.py config/example.json restore-parallel <snapshot|latest|auto> /etc /tmp/restored
+# INDEX FILES   : ./backup.py config/example.json index
+# FIND FILES    : ./backup.py config/example.json find '*.conf'
 # UNLOCK        : ./backup.py config/example.json unlock
+# FLEET         : ./backup.py --fleet config/ backup-prune
+# DAEMON        : ./backup.py config/example.json daemon
 #
 # DOCS:
 #
 # https://restic.readthedocs.io/en/latest/
 # ==============================================================================
 import argparse
+import asyncio
+import datetime
+import glob
 import os
-import random
-import subprocess
+import re
+import socket
 import sys
 import time
-from restic.config import read_config, print_config, print_env
-from restic.logging import banner, redirect_stdout, format_command
+from restic.cache import cache_usage, cleanup_due
+from restic.catalog import Catalog
+from restic.changes import ChangeEntry, ChangeIndex, is_unchanged, scan, target_key
+from restic.check import bytes_read_estimate, next_slice
+from restic.config import default_cache_dir, read_config, print_config, print_env, policy_tag, retired_policy_tags
+from restic.daemon import Daemon, parse_address
+from restic.excludes import exclude_file_args
+from restic.governor import BandwidthGovernor, limit_args, priority_prefix
+from restic.journal import Journal
+from restic.logging import banner, close_context_stdout, redirect_context_stdout, redirect_stdout, format_command
+from restic.metrics import current_run, parse_json_line, phase, start_run, write_run_record, write_textfile
+from restic.parents import ParentCache, is_parent_error
+from restic.plan import ExcludeMatcher, History, WalkResult, overlaps, read_excludes_file, walk
+from restic.process import run_streaming
+from restic.prune import prune_wanted
+from restic.restore import RestoreProgress, include_pattern, plan_restore
+from restic.retry import run_with_retries
+from restic.scheduler import Job, first_time, repository_lock, run_jobs, start_shared_operations
+from restic.ssh import sftp_master
+from restic.state import read_state, state_file, update_state, write_state
+from restic.stream import CommandStream
 from restic.version import read_version
 
 
@@ -40,40 +68,212 @@ from restic.version import read_version
 #
 # --------------------------------------------------------------------
 
-
-def execute_restic(config, args, additional_args, stdin=None):
-    password_command = f"{sys.argv[0]} {args.config_file} password"
-    subprocess_args = [
+# restic commands that need the repository to themselves; others share it (see RepositoryLock)
+EXCLUSIVE_COMMANDS = ['check', 'forget', 'init', 'prune', 'tag', 'unlock']
+
+
+def password_pipe(config):
+    """
+    Hand the password to restic through an inherited pipe, read via --password-file /dev/fd/N.  The
+    password never appears in argv or the environment and no extra interpreter is started.  Returns
+    the read end of the pipe, or None where fd passing is not supported (Windows).
+    """
+    if os.name == 'nt':
+        return None
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, config.password.encode('utf-8'))
+    finally:
+        os.close(write_fd)
+    return read_fd
+
+
+def execute_restic(config, args, additional_args, stdin=None, target=None, line_handler=None, on_start=None,
+                   prefix=(), governor=None):
+    """
+    Run a restic command.  An attempt that failed on a lock, the network or a timeout is retried with backoff
+    (unless restic reads stdin, which can not be read again); every attempt is recorded in the run.  prefix is
+    put in front of the restic command line (e.g. nice).  With a governor the command is stopped when its
+    bandwidth window ends and started again with the new limits.
+    """
+    return run_with_retries(config.retry, additional_args[0],
+                            lambda: execute_restic_once(config, args, additional_args, stdin, line_handler,
+                                                        watched(on_start, governor), prefix),
+                            target, stdin is None, governor)
+
+
+def watched(on_start, governor):
+    if governor is None:
+        return on_start
+
+    def start(p):
+        governor.watch(p)
+        if on_start is not None:
+            on_start(p)
+    return start
+
+
+def execute_restic_once(config, args, additional_args, stdin, line_handler, on_start, prefix=()):
+    password_fd = password_pipe(config)
+    if password_fd is not None:
+        password_args = ["--password-file", f"/dev/fd/{password_fd}"]
+    else:
+        password_args = ["--password-command", f"{sys.argv[0]} {config.config_file} password"]
+    retry_lock_args = ["--retry-lock", config.retry_lock] if config.retry_lock is not None else []
+    cache_args = ["--cache-dir", config.cache_dir_abs()] if config.cache_dir is not None else []
+    bandwidth_args = limit_args(config.bandwidth_schedule, time.time())
+    subprocess_args = list(prefix) + [
                           config.restic_path_abs(),
-                          "--repo", config.repository,
-                          "--password-command", password_command
-                      ] + additional_args
+                          "--repo", config.repository
+                      ] + password_args + retry_lock_args + cache_args + bandwidth_args
+    subprocess_args = subprocess_args + sftp_command_args(config) + additional_args
     banner(f"{additional_args[0]}\n\n{format_command(subprocess_args)}\n")
-    t = subprocess.run(subprocess_args,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.STDOUT,
-                       text=True,
-                       env=config.environment,
-                       stdin=stdin
-                       )
-    print(t.stdout)
-
-
-def command_check(config, args): execute_restic(config, args, ['check'])
-
-
-def command_stats(config, args):  execute_restic(config, args, ['stats', '--mode', 'raw-data'])
-
-
-def command_prune(config, args): execute_restic(config, args, ['prune'])
+    lock = repository_lock(config.repository)
+    try:
+        pass_fds = (password_fd,) if password_fd is not None else ()
+        with lock.exclusive() if additional_args[0] in EXCLUSIVE_COMMANDS else lock.shared():
+            return run_streaming(subprocess_args, env=config.environment, stdin=stdin, pass_fds=pass_fds,
+                                 line_handler=line_handler, on_start=on_start,
+                                 timeout=config.timeout_for(additional_args[0]))
+    finally:
+        if password_fd is not None:
+            os.close(password_fd)
+
+
+def sftp_command_args(config):
+    """Options pointing restic's sftp connections at the ssh master connection to the repository host, if any."""
+    if not config.ssh_multiplexing:
+        return []
+    master, message = sftp_master(config.repository, config.environment)
+    if message is not None:
+        banner(message)
+    return ["-o", f"sftp.command={master.sftp_command()}"] if master is not None else []
+
+
+def backup_json_handler(target):
+    def handle(line):
+        message = parse_json_line(line)
+        if not isinstance(message, dict):
+            return True
+        if message.get('message_type') == 'status':
+            return False
+        if message.get('message_type') == 'summary':
+            current_run().add_backup_summary(target, message)
+        return True
+    return handle
+
+
+def forget_json_handler(line):
+    groups = parse_json_line(line)
+    if isinstance(groups, list):
+        for g in groups:
+            if isinstance(g, dict):
+                current_run().add_forget_summary({'paths': g.get('paths'), 'tags': g.get('tags'),
+                                                  'keep': len(g.get('keep') or []),
+                                                  'remove': len(g.get('remove') or [])})
+    return True
+
+
+def stats_json_handler(line):
+    stats = parse_json_line(line)
+    if isinstance(stats, dict):
+        current_run().set_stats(stats)
+    return True
+
+
+def command_check(config, args):
+    if not first_time(config.repository, 'check'):
+        banner("check skipped: repository already checked in this run")
+        return True
+    if config.check_read_data_cycle is None:
+        return execute_restic(config, args, ['check']).ok()
+    # verify the next 1/N of the pack data, so the whole repository is read once per cycle
+    slices = config.check_read_data_cycle
+    state = read_state(config, 'check')
+    n = next_slice(state, slices)
+    start = time.perf_counter()
+    result = execute_restic(config, args, ['check', '--read-data-subset', f'{n}/{slices}'])
+    seconds = time.perf_counter() - start
+    bytes_read = bytes_read_estimate(read_state(config, 'prune').get('last_total_size', 0), slices)
+    current_run().add_check({'slice': n, 'slices': slices, 'seconds': seconds, 'ok': result.ok(),
+                             'bytes_read_estimate': bytes_read})
+    banner(f"check slice {n}/{slices}: {seconds:,.0f} seconds, ~{bytes_read:,} bytes read")
+    if result.ok():
+        write_state(config, 'check', {'last_slice': n, 'slices': slices, 'last_check_time': time.time()})
+    return result.ok()
+
+
+def command_stats(config, args):
+    result = execute_restic(config, args, ['stats', '--json', '--mode', 'raw-data'], line_handler=stats_json_handler)
+    stats = current_run().stats
+    if stats is not None and 'total_size' in stats:
+        update_state(config, 'prune', lambda x: x.update({'last_total_size': stats['total_size']}))
+    return result.ok()
+
+
+def command_prune(config, args):
+    if not first_time(config.repository, 'prune'):
+        banner("prune skipped: repository already pruned in this run")
+        return True
+    return execute_restic(config, args, ['prune']).ok()
 
 
 def command_forget(config, args):
+    results = []
+    if config.forget_grouping == 'policy':
+        if not retag_retired_policies(config, args):
+            return False
+        # one call per distinct policy: snapshots are selected by the policy tag added at backup time,
+        # and '--group-by host,paths' applies the policy to each backup target separately.
+        for policy in config.distinct_forget_policies():
+            a = ['forget', '--json', '--tag', policy_tag(policy), '--group-by', 'host,paths'] + policy
+            results.append(execute_restic(config, args, a, line_handler=forget_json_handler))
+        return all(map(lambda x: x.ok(), results))
     for backup_command in config.backup_commands:
-        execute_restic(config, args, ['forget', '--path', backup_command.repo_path] + config.forget_policy)
-    for backup_path in config.backup_paths:
-        policy = config.forget_policy if not backup_path.has_forgets() else backup_path.forget_policy
-        execute_restic(config, args, ['forget', '--path', backup_path.path] + policy)
+        a = ['forget', '--json', '--path', backup_command.repo_path] + config.forget_policy
+        results.append(execute_restic(config, args, a, target=backup_command.repo_path,
+                                      line_handler=forget_json_handler))
+    for group in config.backup_groups:
+        policy = config.forget_policy_for(group.backup_paths[0])
+        path_args = []
+        for path in group.paths():
+            path_args = path_args + ['--path', path]
+        results.append(execute_restic(config, args, ['forget', '--json'] + path_args + policy,
+                                      target=','.join(group.paths()), line_handler=forget_json_handler))
+    return all(map(lambda x: x.ok(), results))
+
+
+def retag_retired_policies(config, args):
+    """
+    Move this host's snapshots that no current policy tag selects (the forget-policy of their paths was edited,
+    or they were taken before forget-grouping 'policy') to the current tag of their paths, so the current policy
+    forgets them instead of keeping them forever.
+    """
+    snapshots = []
+    host = socket.gethostname()
+
+    def snapshots_handler(line):
+        listed = parse_json_line(line)
+        if isinstance(listed, list):
+            snapshots.extend(filter(lambda x: isinstance(x, dict), listed))
+            return False
+        return True
+
+    if not execute_restic(config, args, ['snapshots', '--json', '--host', host], line_handler=snapshots_handler).ok():
+        return False
+    targets = list(map(lambda x: ([x.repo_path], policy_tag(config.forget_policy)),
+                       filter(lambda x: config.forget_policy is not None, config.backup_commands)))
+    for group in config.backup_groups:
+        policy = config.forget_policy_for(group.backup_paths[0])
+        if policy is not None:
+            targets.append((group.paths(), policy_tag(policy)))
+    ok = True
+    for paths, tag, retired, ids in retired_policy_tags(snapshots, targets, host):
+        banner(f"{', '.join(paths)}: moving {len(ids)} snapshots without a current forget-policy tag "
+               f"(retired: {', '.join(retired) or 'none'}) to {tag}")
+        a = ['tag', '--host', host] + sum(map(lambda x: ['--remove', x], retired), []) + ['--add', tag] + ids
+        ok = execute_restic(config, args, a, target=','.join(paths)).ok() and ok
+    return ok
 
 
 def command_ls(config, args):
@@ -81,41 +281,338 @@ def command_ls(config, args):
     if len(command) != 2:
         print(f"usage: {command[0]} [snapshot|'latest']")
         exit(-1)
-    execute_restic(config, args, ['ls', '--long', command[1]])
+    return execute_restic(config, args, ['ls', '--long', command[1]]).ok()
 
 
 def command_restore(config, args):
     command = args.sub_command
     if len(command) != 4:
-        print(f"usage: {command[0]} [snapshot|'latest'] [restore-path] [extract-to-path]")
+        print(f"usage: {command[0]} [snapshot|'latest'|'auto'] [restore-path] [extract-to-path]")
         exit(-1)
-    execute_restic(config, args, ['restore', command[1], '--path', command[2], '--target', command[3]])
-
-
-def command_backup(config, args):
+    snapshot = command[1]
+    if snapshot == 'auto':
+        # the newest snapshot that contains restore-path, from the local catalog
+        catalog = Catalog(state_file(config, 'catalog', 'sqlite'))
+        try:
+            snapshot = catalog.newest_containing(command[2], socket.gethostname())
+        finally:
+            catalog.close()
+        if snapshot is None:
+            banner(f"no indexed snapshot contains '{command[2]}' (run the index sub-command first)")
+            return False
+        banner(f"newest snapshot containing '{command[2]}': {snapshot}")
+        # restic applies --path only when it picks 'latest' itself; for an ID the path is selected with --include
+        path = command[2].rstrip('/') or '/'
+        return execute_restic(config, args, ['restore', snapshot, '--include', include_pattern(path),
+                                             '--target', command[3]]).ok()
+    return execute_restic(config, args, ['restore', snapshot, '--path', command[2], '--target', command[3]]).ok()
+
+
+def command_restore_parallel(config, args):
+    """
+    Restore a subtree with several restic processes at once, each restoring a shard of it (--include), planned
+    from the local catalog.  Files already restored with the same size and mtime are skipped, so running the
+    same command again resumes an interrupted restore.
+    """
+    command = args.sub_command
+    if len(command) != 4:
+        print(f"usage: {command[0]} [snapshot|'latest'|'auto'] [restore-path] [extract-to-path]")
+        exit(-1)
+    catalog = Catalog(state_file(config, 'catalog', 'sqlite'))
+    try:
+        if command[1] == 'auto':
+            snapshot = catalog.newest_containing(command[2], socket.gethostname())
+        else:
+            snapshot = catalog.resolve_snapshot(command[1], socket.gethostname(), command[2])
+        entries = catalog.entries_under(snapshot, command[2]) if snapshot is not None else []
+    finally:
+        catalog.close()
+    if snapshot is None or len(entries) == 0:
+        banner(f"no indexed snapshot '{command[1]}' containing '{command[2]}' (run the index sub-command first)")
+        return False
+    plan = plan_restore(entries, command[2], command[3], config.max_parallel_restores)
+    banner(f"restore {snapshot[:8]} {command[2]}: {plan.files:,} files, {plan.bytes:,} bytes in "
+           f"{len(plan.shards)} shards; {plan.skipped_files:,} files, {plan.skipped_bytes:,} bytes already restored")
+    progress = RestoreProgress(plan)
+
+    def restore_shard(n, shard):
+        includes = exclude_file_args(list(map(include_pattern, shard.includes)), 'include')
+        ok = execute_restic(config, args, ['restore', snapshot, '--target', command[3]] + includes,
+                            target=f"shard-{n}").ok()
+        if ok:
+            banner(f"restored shard {n}: {progress.shard_done(shard)}")
+        return ok
+
+    jobs = []
+    for n, shard in enumerate(plan.shards, 1):
+        jobs.append(Job(f"shard-{n}", lambda n=n, shard=shard: restore_shard(n, shard)))
+    results = run_jobs(jobs, config.max_parallel_restores)
+    return all(map(lambda x: x.ok, results))
+
+
+def command_index(config, args):
+    """
+    Add snapshots of this host that are not in the local catalog yet (restic ls --json), and remove forgotten
+    ones.  Like restic's own snapshot selection, other hosts' snapshots are left out.
+    """
+    snapshots = []
+
+    def snapshots_handler(line):
+        listed = parse_json_line(line)
+        if isinstance(listed, list):
+            snapshots.extend(filter(lambda x: isinstance(x, dict) and 'id' in x, listed))
+            return False
+        return True
+
+    a = ['snapshots', '--json', '--host', socket.gethostname()]
+    if not execute_restic(config, args, a, line_handler=snapshots_handler).ok():
+        return False
+    catalog = Catalog(state_file(config, 'catalog', 'sqlite'))
+    try:
+        indexed = catalog.snapshot_ids()
+        removed = catalog.remove_snapshots(indexed - set(map(lambda x: x['id'], snapshots)))
+        new = sorted(filter(lambda x: x['id'] not in indexed, snapshots), key=lambda x: x.get('time', ''))
+        ok = True
+        entries = 0
+        for snapshot in new:
+            loader = catalog.loader(snapshot)
+            result = execute_restic(config, args, ['ls', '--json', snapshot['id']], target=snapshot.get('short_id'),
+                                    line_handler=loader.handle)
+            if result.ok():
+                entries = entries + loader.finish()
+            else:
+                loader.abort()
+                ok = False
+        banner(f"index: {len(new)} snapshots added ({entries:,} entries), {removed} removed")
+    finally:
+        catalog.close()
+    return ok
+
+
+def command_find(config, args):
+    command = args.sub_command
+    if len(command) != 2:
+        print(f"usage: {command[0]} [file-name-or-path-pattern]")
+        exit(-1)
+    catalog = Catalog(state_file(config, 'catalog', 'sqlite'))
+    try:
+        start = time.perf_counter()
+        entries = catalog.find(command[1])
+        seconds = time.perf_counter() - start
+    finally:
+        catalog.close()
+    banner(f"find '{command[1]}': {len(entries):,} entries in {seconds * 1000:,.0f} ms")
+    for e in entries:
+        print(f"{e.snapshot_id}  {format_time(e.snapshot_time)}  {e.type or '':7} {e.size or 0:>14,}  "
+              f"{format_time(e.mtime)}  {e.path}")
+    return True
+
+
+def group_matcher(config, group):
+    """The excludes of a backup group, including its excludes files, for walking it like restic does."""
+    excludes = group.exclude_patterns()
+    for f in group.excludes_files():
+        excludes = excludes + read_excludes_file(config.excludes_file_abs(f))
+    return ExcludeMatcher(excludes, group.iexclude_patterns())
+
+
+def command_plan(config, args):
+    """Walk the backup paths with their excludes and estimate what a backup would read, upload and take."""
+    history = History(config.log_directory_abs())
+    targets = []
+    total = WalkResult()
+    total_upload = 0
+    total_seconds = 0 if history.throughput() is not None else None
+    banner("backup plan")
+    for group in config.backup_groups:
+        target = ','.join(group.paths())
+        matcher = group_matcher(config, group)
+        targets.append((target, group.paths(), matcher))
+        start = time.perf_counter()
+        result = walk(group.paths(), matcher)
+        upload, seconds = history.estimate(target, result.bytes)
+        total.add(result)
+        total_upload = total_upload + upload
+        total_seconds = total_seconds + seconds if seconds is not None and total_seconds is not None else None
+        errors = f", {result.errors:,} errors" if result.errors > 0 else ''
+        print(f"\t{result.files:>12,} files  {result.bytes:>18,} bytes  {result.excluded:>10,} excluded  "
+              f"upload ~{upload:>16,.0f} bytes  {format_duration(seconds):>9}  {target}  "
+              f"(walked in {time.perf_counter() - start:,.1f}s{errors})")
+    print(f"\t{total.files:>12,} files  {total.bytes:>18,} bytes  {total.excluded:>10,} excluded  "
+          f"upload ~{total_upload:>16,.0f} bytes  {format_duration(total_seconds):>9}  total")
+    if history.throughput() is None:
+        print("\tno previous backups in the run records, durations are unknown")
+    for outer_name, inner_name, outer, inner in overlaps(targets):
+        banner(f"WARNING: '{inner}' ({inner_name}) is also below '{outer}' ({outer_name}) and is read twice; "
+               f"exclude it from '{outer}' or remove it")
+    return True
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def format_time(t):
+    return datetime.datetime.fromtimestamp(t).isoformat(' ', 'seconds') if t is not None else ' ' * 19
+
+
+def backup_tag_args(config, policy):
+    """The forget-policy tag, only used (and added) with forget-grouping 'policy'."""
+    return ['--tag', policy_tag(policy)] if config.forget_grouping == 'policy' and policy is not None else []
+
+
+def run_backup(config, args, a, target, excludes, parents, stdin=None, on_start=None, prefix=(), governor=None):
+    """
+    Run restic backup, pinning the parent to the snapshot of the previous run of the same target.
+    If restic rejects the parent (e.g. it was pruned) the entry is dropped and, unless the data comes from
+    stdin and can not be re-read, the backup is repeated without it.
+    """
+    parent = parents.get(target, excludes) if parents is not None else None
+    parent_args = ['--parent', parent] if parent is not None else []
+    result = execute_restic(config, args, a + parent_args, stdin, target=target,
+                            line_handler=backup_json_handler(target), on_start=on_start, prefix=prefix,
+                            governor=governor)
+    if not result.ok() and parent is not None and is_parent_error(result.tail):
+        banner(f"parent snapshot {parent} rejected, dropping it")
+        parents.remove(target)
+        if stdin is None:
+            result = execute_restic(config, args, a, target=target, line_handler=backup_json_handler(target),
+                                    prefix=prefix, governor=governor)
+    summary = current_run().backup_summaries.get(target)
+    if result.ok() and parents is not None and summary is not None and summary.get('snapshot_id'):
+        parents.put(target, excludes, summary['snapshot_id'])
+    return result
+
+
+def backup_command(config, args, bc, parents=None):
+    banner(f"backing up COMMAND result '{bc.command}'")
+    # the command only starts once restic can: waiting for another configuration's prune with the command
+    # running would fill its buffer and stall it for as long as the prune takes
+    with repository_lock(config.repository).shared():
+        stream = CommandStream(bc)
+        stdin = stream.start()
+        try:
+            a = ["backup", "--json", "--stdin", "--stdin-filename", bc.repo_path]
+            a = a + backup_tag_args(config, config.forget_policy)
+            result = run_backup(config, args, a, bc.repo_path, [], parents, stdin, on_start=stream.attach)
+        finally:
+            stream_ok = stream.finish()
+    return result.ok() and stream_ok
+
+
+def backup_group(config, args, group, change_index=None, parents=None):
+    banner(f"backing up PATH {', '.join(map(lambda x: repr(x), group.paths()))}")
+    target = ','.join(group.paths())
+    excludes = group.exclude_patterns() + group.iexclude_patterns() + group.excludes_files()
+    a = ["backup", "--json", "--one-file-system"] + group.paths()
+    a = a + backup_tag_args(config, config.forget_policy_for(group.backup_paths[0]))
+    a = a + exclude_file_args(group.exclude_patterns(), 'exclude')
+    a = a + exclude_file_args(group.iexclude_patterns(), 'iexclude')
+    for f in group.excludes_files():
+        a = a + ['--exclude-file', config.excludes_file_abs(f)]
+    prefix = priority_prefix(group.nice(), group.ionice())
+    # restarting needs the data to be read again, so backups of command output (stdin) run with fixed limits
+    governor = BandwidthGovernor(config.bandwidth_schedule) if len(config.bandwidth_schedule) > 0 else None
+    if len(group.exclude_patterns()) + len(group.iexclude_patterns()) > 0:
+        banner(f"excludes: {len(group.exclude_patterns())} patterns, {len(group.iexclude_patterns())} "
+               f"case-insensitive patterns, {len(group.excludes_files())} excludes files")
+    if change_index is not None and group.change_detection(config):
+        try:
+            matcher = group_matcher(config, group)
+        except OSError as e:
+            banner(f"change detection skipped, can not read excludes file: {e}")
+            return run_backup(config, args, a, target, excludes, parents, prefix=prefix, governor=governor).ok()
+        key = target_key(group.paths(), excludes)
+        start = time.perf_counter()
+        digest, files, size = scan(group.paths(), matcher, group.change_detection(config) == 'directories')
+        entry = change_index.get(key)
+        if is_unchanged(entry, digest, config.change_detection_max_staleness_days):
+            banner(f"SKIPPED, unchanged since {datetime.datetime.fromtimestamp(entry.backup_time).isoformat()}: "
+                   f"{files:,} files, {size:,} bytes scanned in {time.perf_counter() - start:,.1f} seconds")
+            return True
+        ok = run_backup(config, args, a, target, excludes, parents, prefix=prefix, governor=governor).ok()
+        if ok:
+            change_index.put(key, ChangeEntry(digest, files, size, time.time()))
+        return ok
+    return run_backup(config, args, a, target, excludes, parents, prefix=prefix, governor=governor).ok()
+
+
+def warm_cache(config, args):
+    """
+    Fill the shared cache with the repository's snapshots and index before the backups start, so parallel backups
+    do not each download them, and let restic remove the caches of unused repositories every cache-cleanup-days.
+    """
+    state = read_state(config, 'cache')
+    now = time.time()
+    cleanup = cleanup_due(state, now, config.cache_cleanup_days)
+    start = time.perf_counter()
+    snapshots = []
+
+    def snapshots_handler(line):
+        listed = parse_json_line(line)
+        if isinstance(listed, list):
+            snapshots.extend(filter(lambda x: isinstance(x, dict) and 'id' in x, listed))
+            return False
+        return True
+
+    ok = execute_restic(config, args, ['snapshots', '--json'] + (['--cleanup-cache'] if cleanup else []),
+                        line_handler=snapshots_handler).ok()
+    if ok and cleanup:
+        update_state(config, 'cache', lambda x: x.update({'last_cleanup_time': now}))
+    if ok and len(snapshots) > 0:
+        # listing the top directory of a snapshot loads the whole index, which is what a cold backup waits for
+        newest = max(snapshots, key=lambda x: x.get('time', ''))
+        ok = execute_restic(config, args, ['ls', '--json', newest['id'], '/'],
+                            line_handler=lambda x: parse_json_line(x) is None).ok()
+    usage = cache_usage(config.cache_dir_abs())
+    current_run().set_cache_bytes(usage.bytes)
+    banner(f"cache {'warmed' if ok else 'warm-up FAILED'} in {time.perf_counter() - start:,.1f} seconds: "
+           f"{usage.bytes:,} bytes, {usage.files:,} files, {len(usage.repositories)} repositories in "
+           f"{config.cache_dir_abs()}{' (cleaned up)' if ok and cleanup else ''}")
+    return ok
+
+
+def command_backup(config, args, journal=None):
+    journal = journal if journal is not None else Journal()
+    if config.cache_dir is not None and first_time(config.repository, 'cache'):
+        with phase('cache') as p:
+            # a cold cache only makes the backups slower, it is not a reason to fail them
+            p.ok = warm_cache(config, args)
+    jobs = []
+    parents = ParentCache(config) if config.pin_parent_snapshots else None
     for bc in config.backup_commands:
-        banner(f"backing up COMMAND result '{bc.command}'")
-        with subprocess.Popen(bc.command, stdout=subprocess.PIPE) as ps:
-            a = ["backup", "--stdin", "--stdin-filename", bc.repo_path]
-            execute_restic(config, args, a, ps.stdout)
-            ps.wait()
-
-    for bp in config.backup_paths:
-        banner(f"backing up PATH '{bp.path}'")
-        a = ["backup", "--one-file-system", bp.path]
-        if bp.has_excludes():
-            for e in bp.excludes:
-                a = a + ['--exclude', e.pattern]
-        execute_restic(config, args, a)
+        jobs.append(Job(bc.repo_path, lambda bc=bc: backup_command(config, args, bc, parents), bc.priority))
+    change_index = None
+    if any(map(lambda x: x.change_detection(config), config.backup_groups)):
+        change_index = ChangeIndex(state_file(config, 'changes', 'bin'))
+    for group in config.backup_groups:
+        jobs.append(Job(','.join(group.paths()), lambda g=group: backup_group(config, args, g, change_index, parents),
+                        group.priority()))
+    for job in list(filter(lambda x: journal.done(f"backup:{x.label}"), jobs)):
+        banner(f"backup of {job.label} completed in the resumed run, skipped")
+        jobs.remove(job)
+    results = run_jobs(list(map(lambda x: journaled(journal, f"backup:{x.label}", x), jobs)),
+                       config.max_parallel_backups)
+    if change_index is not None:
+        change_index.save()
+    if parents is not None:
+        parents.save()
+    banner("backup summary")
+    for r in results:
+        status = 'OK' if r.ok else f'FAILED {r.error if r.error is not None else ""}'.strip()
+        print(f"\t{r.seconds:8,.0f}s  {status:8}  {r.label}")
+    return all(map(lambda x: x.ok, results))
 
 
-def command_snapshots(config, args): execute_restic(config, args, ['snapshots'])
+def command_snapshots(config, args): return execute_restic(config, args, ['snapshots']).ok()
 
 
-def command_unlock(config, args): execute_restic(config, args, ['unlock'])
+def command_unlock(config, args): return execute_restic(config, args, ['unlock']).ok()
 
 
-def command_init(config, args): execute_restic(config, args, ['init'])
+def command_init(config, args): return execute_restic(config, args, ['init']).ok()
 
 
 # noinspection PyUnusedLocal
@@ -125,13 +622,72 @@ def command_password(config, args):
 
 
 def command_backup_prune(config, args):
-    command_backup(config, args)
-    p_random = random.random()
-    if config.prune_policy != 0 and p_random <= config.prune_policy:
-        command_forget(config, args)
-        command_prune(config, args)
-        command_check(config, args)
-    command_stats(config, args)
+    """
+    backup, then forget/prune/check/stats.  Each completed step is recorded in a journal, and a run started within
+    resume-window-hours of a failed one continues with the steps that did not complete.
+    """
+    file = state_file(config, f"journal-{os.path.splitext(os.path.basename(config.config_file))[0]}")
+    journal = Journal(file if config.resume_window_hours > 0 else None, 'backup-prune', config.resume_window_hours)
+    if journal.resumed:
+        banner(f"resuming the run started at {format_time(journal.start_time())}, completed: "
+               f"{', '.join(journal.completed().keys()) or 'nothing'}")
+    with phase('backup') as p:
+        ok = p.ok = command_backup(config, args, journal)
+    ok = command_forget_prune(config, args, journal) and ok
+    if ok:
+        journal.finish()
+    return ok
+
+
+def command_forget_prune(config, args, journal=None, interval=False):
+    """
+    forget and prune when due, check, then record the repository size.  Returns False if any phase failed.
+    With interval (the daemon's prune job, already run on its own interval) only a prune-schedule can skip them.
+    """
+    journal = journal if journal is not None else Journal()
+    phases = []
+    should_prune = journal.decision('prune', lambda: prune_decision(config, interval))
+    if should_prune:
+        run_step(journal, 'forget', lambda: command_forget(config, args), phases)
+        pruned = run_step(journal, 'prune', lambda: command_prune(config, args), phases)
+    if should_prune or config.check_read_data_cycle is not None:
+        run_step(journal, 'check', lambda: command_check(config, args), phases)
+    run_step(journal, 'stats', lambda: command_stats(config, args), phases)
+    if should_prune and pruned and config.prune_schedule is not None and not journal.done('prune-recorded'):
+        update_state(config, 'prune', lambda x: x.update({'last_prune_time': time.time(),
+                                                          'size_at_last_prune': x.get('last_total_size', 0)}))
+        journal.complete('prune-recorded')
+    return all(map(lambda x: x.ok, phases))
+
+
+def run_step(journal, name, command, phases):
+    """Run a step as a phase unless it completed in the resumed run; returns True if it is complete."""
+    if journal.done(name):
+        banner(f"{name} completed in the resumed run, skipped")
+        return True
+    with phase(name) as p:
+        p.ok = command()
+    phases.append(p)
+    if p.ok:
+        journal.complete(name)
+    return p.ok
+
+
+def journaled(journal, step, job):
+    """The job, recording step in the journal when it succeeds."""
+    def run():
+        ok = job.run()
+        if ok:
+            journal.complete(step)
+        return ok
+    return Job(job.label, run, job.priority)
+
+
+def prune_decision(config, interval=False):
+    due, reason = prune_wanted(config, read_state(config, 'prune'), time.time(), socket.gethostname(), interval)
+    if reason is not None:
+        banner(f"prune {'scheduled' if due else 'skipped'}: {reason}")
+    return due
 
 
 # --------------------------------------------------------------------
@@ -141,57 +697,194 @@ def command_backup_prune(config, args):
 # --------------------------------------------------------------------
 
 
+VALID_COMMANDS = {
+    'backup': command_backup,
+    'backup-prune': command_backup_prune,
+    'check': command_check,
+    'find': command_find,
+    'forget': command_forget,
+    'index': command_index,
+    'init': command_init,
+    'ls': command_ls,
+    'password': command_password,
+    'plan': command_plan,
+    'prune': command_prune,
+    'restore': command_restore,
+    'restore-parallel': command_restore_parallel,
+    'stats': command_stats,
+    'snapshots': command_snapshots,
+    'unlock': command_unlock,
+}
+
+
+# daemon job -> command
+DAEMON_JOBS = {
+    'backup': command_backup,
+    'check': command_check,
+    'prune': lambda config, args: command_forget_prune(config, args, interval=True),
+}
+
+
+def config_cache_dir(args):
+    return default_cache_dir() if args.config_cache else None
+
+
+def run_config(config_file, args, src_dir, start_time, fleet=False):
+    """Run args.sub_command for one configuration; returns False if it failed."""
+    start_run()
+    with phase('config'):
+        config = read_config(config_file, src_dir, config_cache_dir(args))
+    log_name = os.path.splitext(os.path.basename(config_file))[0] if fleet else None
+    return run_command(config, args, args.sub_command[0], VALID_COMMANDS[args.sub_command[0]], start_time, log_name)
+
+
+def run_command(config, args, name, command, start_time, log_name=None):
+    """
+    Run command for config, recorded as the current run.  With a log_name the log goes to a file of its own
+    (fleet and daemon mode) instead of replacing stdout.
+    """
+    run = current_run()
+    run.command = name
+    run.repository = config.repository
+
+    log_file = None
+    if args.log and log_name is not None:
+        log_file = redirect_context_stdout(config, log_name)
+    elif args.log:
+        log_file = redirect_stdout(config)
+
+    if name == 'password':
+        command_password(config, args)
+
+    try:
+        banner("env")
+        print_env()
+        banner("config")
+        print_config(config)
+        banner("starting")
+
+        ok = False
+        try:
+            ok = command(config, args)
+        finally:
+            run.finish(ok is not False)
+            if log_file is not None:
+                write_run_record(re.sub(r'\.log$', '.run.json', log_file), run)
+            if config.metrics_textfile is not None:
+                write_textfile(config.metrics_textfile_abs(), run)
+
+        banner(f"{'COMPLETE' if ok is not False else 'FAILED'} in {time.perf_counter() - start_time:,.0f} seconds.")
+    finally:
+        if log_name is not None:
+            close_context_stdout()
+    return ok is not False
+
+
+def fleet_config_files(fleet, src_dir):
+    """Configuration files of a fleet: every *.json in a directory, or the files matching a glob."""
+    pattern = fleet if os.path.isabs(fleet) else f"{src_dir}/{fleet}"
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.json')
+    return sorted(set(map(os.path.abspath, filter(os.path.isfile, glob.glob(pattern)))))
+
+
+def run_fleet(args, src_dir):
+    """
+    Run args.sub_command for every configuration of the fleet, up to args.fleet_parallel at once.  Exclusive
+    operations on a repository are serialized across configurations and prune and check run once per
+    repository.  Returns False if any configuration failed.
+    """
+    config_files = fleet_config_files(args.fleet, src_dir)
+    if len(config_files) == 0:
+        print(f"no configuration files found: '{args.fleet}'")
+        sys.exit(-1)
+    repositories = {}
+    for f in config_files:
+        repositories.setdefault(read_config(f, src_dir, config_cache_dir(args)).repository, []).append(f)
+    banner(f"fleet: {len(config_files)} configurations, {len(repositories)} repositories, "
+           f"{args.fleet_parallel} at once")
+
+    start_shared_operations()
+    jobs = []
+    for f in config_files:
+        label = os.path.splitext(os.path.basename(f))[0]
+        jobs.append(Job(label, lambda f=f: run_config(f, args, src_dir, time.perf_counter(), fleet=True)))
+    results = run_jobs(jobs, args.fleet_parallel)
+
+    banner("fleet summary")
+    by_label = dict(map(lambda x: (x.label, x), results))
+    for repository, files in sorted(repositories.items()):
+        print(f"\t{repository}")
+        for f in files:
+            r = by_label[os.path.splitext(os.path.basename(f))[0]]
+            status = 'OK' if r.ok else f'FAILED {r.error if r.error is not None else ""}'.strip()
+            print(f"\t\t{r.seconds:8,.0f}s  {status:8}  {f}")
+    return all(map(lambda x: x.ok, results))
+
+
+def run_daemon(args, src_dir):
+    """Run as a daemon for one configuration, or for every configuration of a fleet."""
+    if args.fleet is not None:
+        config_files = fleet_config_files(args.fleet, src_dir)
+    else:
+        config_files = [args.config_file if os.path.isabs(args.config_file) else f"{src_dir}/{args.config_file}"]
+
+    def run_job(config_file, config, kind):
+        start_run()
+        name = f"{os.path.splitext(os.path.basename(config_file))[0]}-{kind}"
+        return run_command(config, args, kind, DAEMON_JOBS[kind], time.perf_counter(), log_name=name)
+
+    banner(f"daemon: {len(config_files)} configurations, {args.fleet_parallel} jobs at once")
+    cache_dir = config_cache_dir(args)
+    daemon = Daemon(config_files, lambda f: read_config(f, src_dir, cache_dir), run_job, args.fleet_parallel,
+                    parse_address(args.status_address))
+    asyncio.run(daemon.run())
+    return True
+
+
 def main():
     start_time = time.perf_counter()
 
     version_string = read_version()
 
     parser = argparse.ArgumentParser(description='Restic backup tool.', add_help=True, allow_abbrev=False)
-    parser.add_argument("config_file", help="Configuration file.")
+    parser.add_argument("config_file", help="Configuration file (omitted with --fleet).")
     parser.add_argument("sub_command", help="Sub command.", nargs='*')
     parser.add_argument('-l', '--log', action='store_true')
+    parser.add_argument('--fleet', help="Run for every configuration in a directory, or matching a glob.")
+    parser.add_argument('--fleet-parallel', help="Configurations to run at once (default: 4).", type=int, default=4)
+    parser.add_argument('--status-address', help="Daemon status endpoint, host:port (default: 127.0.0.1:8385).",
+                        default='127.0.0.1:8385')
+    parser.add_argument('--config-cache', help="Load validated configurations from a per-user cache.",
+                        action='store_true')
     parser.add_argument('-v', '--version', action='version', version=f'%(prog)s {version_string}')
     args = parser.parse_args()
-
-    valid_commands = {
-        'backup': command_backup,
-        'backup-prune': command_backup_prune,
-        'check': command_check,
-        'forget': command_forget,
-        'init': command_init,
-        'ls': command_ls,
-        'password': command_password,
-        'prune': command_prune,
-        'restore': command_restore,
-        'stats': command_stats,
-        'snapshots': command_snapshots,
-        'unlock': command_unlock,
-    }
+    if args.fleet is not None:
+        # there is no configuration file argument, the first positional argument is the sub command
+        args.sub_command = [args.config_file] + args.sub_command
+        args.config_file = None
 
     if len(args.sub_command) < 1:
-        print(f"missing sub-command: {list(valid_commands.keys())}")
+        print(f"missing sub-command: {list(VALID_COMMANDS.keys()) + ['daemon']}")
         sys.exit(-1)
 
-    if args.sub_command[0] not in valid_commands:
+    if args.sub_command[0] not in VALID_COMMANDS and args.sub_command[0] != 'daemon':
         print(f"BAD sub-command: '{args.sub_command[0]}'")
         sys.exit(-1)
 
     src_dir = os.path.dirname(os.path.abspath(__file__))
-    config = read_config(args.config_file, src_dir)
-
-    if args.log:
-        redirect_stdout(config)
-
-    if args.sub_command[0] != 'password':
-        banner("env")
-        print_env()
-        banner("config")
-        print_config(config)
-        banner("starting")
-
-    valid_commands[args.sub_command[0]](config, args)
-
-    banner(f"COMPLETE in {time.perf_counter() - start_time:,.0f} seconds.")
+    if args.sub_command[0] == 'daemon':
+        ok = run_daemon(args, src_dir)
+    elif args.fleet is not None:
+        if args.sub_command[0] == 'password':
+            print("the password sub-command needs a configuration file")
+            sys.exit(-1)
+        ok = run_fleet(args, src_dir)
+        banner(f"FLEET {'COMPLETE' if ok else 'FAILED'} in {time.perf_counter() - start_time:,.0f} seconds.")
+    else:
+        ok = run_config(args.config_file, args, src_dir, start_time)
+    if not ok:
+        sys.exit(1)
 
 
 main()
@@ -0,0 +1,40 @@
+import os
+
+SECS_PER_DAY = 60 * 60 * 24
+
+
+class CacheUsage:
+
+    def __init__(self):
+        self.bytes = 0
+        self.files = 0
+        # repository cache sub-directory -> bytes
+        self.repositories = {}
+
+
+def cache_usage(cache_dir):
+    """Bytes and files in a restic cache directory, in total and per repository sub-directory."""
+    usage = CacheUsage()
+    if not os.path.isdir(cache_dir):
+        return usage
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isdir(path) or os.path.islink(path):
+            continue
+        size = 0
+        for directory, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    size = size + os.lstat(os.path.join(directory, f)).st_size
+                except OSError:
+                    continue
+                usage.files = usage.files + 1
+        usage.repositories[name] = size
+        usage.bytes = usage.bytes + size
+    return usage
+
+
+def cleanup_due(state, now, interval_days):
+    """True if restic --cleanup-cache has not run for interval_days (state: 'last_cleanup_time')."""
+    last = state.get('last_cleanup_time')
+    return last is None or now - last >= interval_days * SECS_PER_DAY
@@ -0,0 +1,181 @@
+import datetime
+import os
+import re
+import sqlite3
+from restic.metrics import parse_json_line
+
+# Rows inserted per statement batch while loading a snapshot listing.
+BATCH_SIZE = 10000
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS snapshots (rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, short_id TEXT, "
+    "time REAL, hostname TEXT, paths TEXT, complete INTEGER)",
+    "CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT)",
+    "CREATE INDEX IF NOT EXISTS paths_name ON paths (name)",
+    "CREATE TABLE IF NOT EXISTS entries (path_id INTEGER, snapshot INTEGER, type TEXT, size INTEGER, mtime REAL, "
+    "PRIMARY KEY (path_id, snapshot)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS entries_snapshot ON entries (snapshot)",
+]
+
+_TIME = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)?$')
+
+
+class CatalogEntry:
+
+    def __init__(self, snapshot_id, snapshot_time, entry_type, size, mtime, path):
+        self.snapshot_id = snapshot_id
+        self.snapshot_time = snapshot_time
+        self.type = entry_type
+        self.size = size
+        self.mtime = mtime
+        self.path = path
+
+
+class Catalog:
+    """
+    Local SQLite index of the files in each snapshot, filled from restic ls --json, so files can be found
+    without listing the repository.  Path strings are stored once and shared between snapshots.
+    """
+
+    def __init__(self, file):
+        directory = os.path.dirname(file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def snapshot_ids(self):
+        """Snapshots that are completely indexed."""
+        return set(map(lambda x: x[0], self.db.execute("SELECT id FROM snapshots WHERE complete = 1")))
+
+    def remove_snapshots(self, ids):
+        """Remove snapshots (e.g. forgotten ones) and paths no longer in any snapshot; returns the number removed."""
+        removed = 0
+        for snapshot_id in ids:
+            row = self.db.execute("SELECT rowid FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            if row is not None:
+                self.db.execute("DELETE FROM entries WHERE snapshot = ?", row)
+                self.db.execute("DELETE FROM snapshots WHERE rowid = ?", row)
+                removed = removed + 1
+        if removed > 0:
+            self.db.execute("DELETE FROM paths WHERE id NOT IN (SELECT path_id FROM entries)")
+        self.db.commit()
+        return removed
+
+    def loader(self, snapshot):
+        """Loader for the restic ls --json output of a snapshot (a dict from restic snapshots --json)."""
+        self.remove_snapshots([snapshot['id']])
+        cursor = self.db.execute("INSERT INTO snapshots (id, short_id, time, hostname, paths, complete) "
+                                 "VALUES (?, ?, ?, ?, ?, 0)",
+                                 (snapshot['id'], snapshot.get('short_id', snapshot['id'][:8]),
+                                  parse_time(snapshot.get('time')), snapshot.get('hostname'),
+                                  '\n'.join(snapshot.get('paths') or [])))
+        return SnapshotLoader(self.db, cursor.lastrowid)
+
+    def find(self, pattern, limit=1000):
+        """
+        Entries matching a glob pattern, newest snapshot first per path.  A pattern without '/' is matched
+        against file names, otherwise against full paths.
+        """
+        column = 'p.path' if '/' in pattern else 'p.name'
+        rows = self.db.execute("SELECT s.short_id, s.time, e.type, e.size, e.mtime, p.path FROM paths p "
+                               "JOIN entries e ON e.path_id = p.id JOIN snapshots s ON s.rowid = e.snapshot "
+                               f"WHERE s.complete = 1 AND {column} GLOB ? ORDER BY p.path, s.time DESC LIMIT ?",
+                               (pattern, limit))
+        return list(map(lambda x: CatalogEntry(*x), rows))
+
+    def resolve_snapshot(self, ref, host=None, root=None):
+        """
+        ID of an indexed snapshot from its (short) ID, or None.  'latest' is the newest snapshot (of host, if
+        given) with entries at or below root, like restic's latest with --host and --path.
+        """
+        if ref == 'latest':
+            root = root.rstrip('/') if root not in [None, '/'] else ''
+            row = self.db.execute("SELECT s.id FROM snapshots s WHERE s.complete = 1 AND (? IS NULL OR s.hostname = ?) "
+                                  "AND EXISTS (SELECT 1 FROM paths p JOIN entries e ON e.path_id = p.id "
+                                  "WHERE e.snapshot = s.rowid AND (p.path = ? OR (p.path >= ? AND p.path < ?))) "
+                                  "ORDER BY s.time DESC LIMIT 1", (host, host, root, root + '/', root + '0')).fetchone()
+        else:
+            row = self.db.execute("SELECT id FROM snapshots WHERE complete = 1 AND substr(id, 1, ?) = ?",
+                                  (len(ref), ref)).fetchone()
+        return row[0] if row is not None else None
+
+    def entries_under(self, snapshot_id, root):
+        """Entries of a snapshot at or below root, as CatalogEntry."""
+        root = root.rstrip('/') if root != '/' else ''
+        rows = self.db.execute("SELECT s.short_id, s.time, e.type, e.size, e.mtime, p.path FROM snapshots s "
+                               "JOIN entries e ON e.snapshot = s.rowid JOIN paths p ON p.id = e.path_id "
+                               "WHERE s.id = ? AND (p.path = ? OR (p.path >= ? AND p.path < ?))",
+                               (snapshot_id, root, root + '/', root + '0'))
+        return list(map(lambda x: CatalogEntry(*x), rows))
+
+    def newest_containing(self, path, host=None):
+        """ID of the newest indexed snapshot (of host, if given) that contains path, or None."""
+        path = path.rstrip('/') if path != '/' else path
+        row = self.db.execute("SELECT s.id FROM paths p JOIN entries e ON e.path_id = p.id "
+                              "JOIN snapshots s ON s.rowid = e.snapshot WHERE s.complete = 1 AND p.path = ? "
+                              "AND (? IS NULL OR s.hostname = ?) ORDER BY s.time DESC LIMIT 1",
+                              (path, host, host)).fetchone()
+        return row[0] if row is not None else None
+
+
+class SnapshotLoader:
+    """Line handler storing the nodes of restic ls --json output; finish() marks the snapshot complete."""
+
+    def __init__(self, db, snapshot):
+        self.db = db
+        self.snapshot = snapshot
+        self.count = 0
+        self._batch = []
+
+    def handle(self, line):
+        node = parse_json_line(line)
+        if isinstance(node, dict) and 'path' in node and node.get('struct_type', 'node') == 'node':
+            self._batch.append((node['path'], node.get('name', os.path.basename(node['path'])), node.get('type'),
+                                node.get('size', 0), parse_time(node.get('mtime'))))
+            if len(self._batch) >= BATCH_SIZE:
+                self._flush()
+            return False
+        return node is None
+
+    def finish(self):
+        self._flush()
+        self.db.execute("UPDATE snapshots SET complete = 1 WHERE rowid = ?", (self.snapshot,))
+        self.db.commit()
+        return self.count
+
+    def abort(self):
+        self.db.rollback()
+        self.db.execute("DELETE FROM entries WHERE snapshot = ?", (self.snapshot,))
+        self.db.execute("DELETE FROM snapshots WHERE rowid = ?", (self.snapshot,))
+        self.db.commit()
+
+    def _flush(self):
+        if len(self._batch) == 0:
+            return
+        self.db.executemany("INSERT OR IGNORE INTO paths (path, name) VALUES (?, ?)",
+                            map(lambda x: (x[0], x[1]), self._batch))
+        self.db.executemany("INSERT OR REPLACE INTO entries (path_id, snapshot, type, size, mtime) "
+                            "SELECT id, ?, ?, ?, ? FROM paths WHERE path = ?",
+                            map(lambda x: (self.snapshot, x[2], x[3], x[4], x[0]), self._batch))
+        self.count = self.count + len(self._batch)
+        self._batch = []
+
+
+def parse_time(value):
+    """restic timestamp (RFC 3339, nanoseconds) -> seconds since the epoch, or None."""
+    if not isinstance(value, str):
+        return None
+    m = _TIME.match(value)
+    if m is None:
+        return None
+    fraction = (m.group(2) or '.0')[:7]
+    zone = m.group(3) if m.group(3) not in [None, 'Z'] else '+00:00'
+    return datetime.datetime.fromisoformat(f"{m.group(1)}{fraction.ljust(7, '0')}{zone}").timestamp()
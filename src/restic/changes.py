@@ -0,0 +1,155 @@
+import hashlib
+import os
+import stat
+import struct
+import threading
+import time
+from restic.state import state_lock
+
+# On-disk record: key length, key (utf-8), digest, file count, total bytes, time of last successful backup.
+_HEADER = b'RCCHG1\n'
+_RECORD = struct.Struct('<H32sQQd')
+
+
+class ChangeEntry:
+
+    def __init__(self, digest, files, size, backup_time):
+        self.digest = digest
+        self.files = files
+        self.size = size
+        self.backup_time = backup_time
+
+
+class ChangeIndex:
+    """
+    Compact binary index of the tree digest of each backup target at its last successful backup.  Saving
+    merges the entries put in this run into the file, which other configurations of the same repository may
+    have saved meanwhile.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self._changed = set()
+        self._lock = threading.Lock()
+        self.entries = _load(file)
+
+    def get(self, key):
+        with self._lock:
+            return self.entries.get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self._changed.add(key)
+
+    def save(self):
+        with self._lock, state_lock(self.file):
+            entries = _load(self.file)
+            for key in self._changed:
+                entries[key] = self.entries[key]
+            directory = os.path.dirname(self.file)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = f"{self.file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(_HEADER)
+                for key, e in entries.items():
+                    k = key.encode('utf-8')
+                    f.write(_RECORD.pack(len(k), e.digest, e.files, e.size, e.backup_time))
+                    f.write(k)
+            os.replace(tmp, self.file)
+
+
+def _load(file):
+    entries = {}
+    if not os.path.isfile(file):
+        return entries
+    with open(file, 'rb') as f:
+        data = f.read()
+    if not data.startswith(_HEADER):
+        return entries
+    offset = len(_HEADER)
+    while offset + _RECORD.size <= len(data):
+        key_len, digest, files, size, backup_time = _RECORD.unpack_from(data, offset)
+        offset = offset + _RECORD.size
+        key = data[offset:offset + key_len].decode('utf-8')
+        offset = offset + key_len
+        entries[key] = ChangeEntry(digest, files, size, backup_time)
+    return entries
+
+
+def target_key(paths, exclude_args):
+    """Index key of a backup target; changes to its excludes give a different key and force a backup."""
+    return hashlib.sha1('\0'.join(paths + ['--'] + exclude_args).encode('utf-8')).hexdigest()
+
+
+def scan(paths, matcher=None, directories_only=False):
+    """
+    Walk paths (without crossing file systems, like restic --one-file-system, and skipping what matcher
+    excludes) and return (digest, file count, total bytes) over every entry's path, type, size, mtime and inode
+    (path, type and inode for directories).  With directories_only, only directories are stat'ed: files
+    contribute their names, which catches files being added, removed or renamed but not files modified in place,
+    and total bytes is 0.
+    """
+    h = hashlib.blake2b(digest_size=32)
+    files = 0
+    size = 0
+    for root in paths:
+        if matcher is not None and matcher.excluded(root):
+            continue
+        try:
+            st = os.lstat(root)
+        except OSError as e:
+            h.update(f"{root}\0error\0{e.errno}\n".encode('utf-8', errors='surrogateescape'))
+            continue
+        h.update(_stat_line(root, st))
+        if not stat.S_ISDIR(st.st_mode):
+            files = files + 1
+            size = size + st.st_size
+            continue
+        root_dev = st.st_dev
+        pending = [root]
+        while len(pending) > 0:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda x: x.name)
+            except OSError as e:
+                h.update(f"{directory}\0error\0{e.errno}\n".encode('utf-8', errors='surrogateescape'))
+                continue
+            for entry in entries:
+                if matcher is not None and matcher.excluded_entry(entry.path):
+                    continue
+                try:
+                    # the entry type comes with the directory listing, so only what is hashed is stat'ed
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if directories_only and not is_dir:
+                        h.update(f"{entry.path}\n".encode('utf-8', errors='surrogateescape'))
+                        files = files + 1
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                h.update(_stat_line(entry.path, st))
+                if is_dir:
+                    if st.st_dev == root_dev:
+                        pending.append(entry.path)
+                else:
+                    files = files + 1
+                    size = size + st.st_size
+    return h.digest(), files, size
+
+
+def _stat_line(path, st):
+    if stat.S_ISDIR(st.st_mode):
+        # a directory's entries are hashed themselves; its mtime would also change with excluded entries
+        return f"{path}\0{st.st_mode}\0{st.st_ino}\n".encode('utf-8', errors='surrogateescape')
+    return f"{path}\0{st.st_mode}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}\n" \
+        .encode('utf-8', errors='surrogateescape')
+
+
+def is_unchanged(entry, digest, max_staleness_days, now=None):
+    if entry is None or entry.digest != digest:
+        return False
+    now = time.time() if now is None else now
+    return now - entry.backup_time < max_staleness_days * 60 * 60 * 24
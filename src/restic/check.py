@@ -0,0 +1,18 @@
+def next_slice(state, slices):
+    """
+    The --read-data-subset slice n (of slices) the next check reads, from the check state ('last_slice' of
+    'slices').  Slices rotate 1..slices; when check-read-data-cycle changed, the next slice continues at the same
+    fraction of the repository rather than starting over.
+    """
+    last = state.get('last_slice')
+    previous = state.get('slices')
+    if not isinstance(last, int) or not isinstance(previous, int) or not 1 <= last <= previous:
+        return 1
+    if previous == slices:
+        return last % slices + 1
+    return last * slices // previous % slices + 1
+
+
+def bytes_read_estimate(total_size, slices):
+    """Pack data one slice reads, from the repository size (restic stats --mode raw-data total_size)."""
+    return total_size // slices
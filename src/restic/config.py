@@ -1,6 +1,12 @@
+import collections
+import copy
+import hashlib
 import json
 import os
+import pickle
+import re
 import sys
+import threading
 
 
 # --------------------------------------------------------------------
@@ -11,10 +17,13 @@ import sys
 
 
 class Configuration:
-    __valid_props = ["backup-paths", "backup-commands", "environment",
-                     "forget-policy", "log-directory", "log-retention-days",
-                     "note", "password", "prune-policy", "repository",
-                     "restic-path"]
+    __valid_props = ["backup-commands", "backup-grouping", "backup-paths", "bandwidth-schedule", "cache-cleanup-days",
+                     "cache-dir", "change-detection", "change-detection-max-staleness-days", "check-read-data-cycle",
+                     "compress-logs", "daemon-schedule", "environment", "exclude-sets", "forget-grouping",
+                     "forget-policy", "log-directory", "log-max-total-mb", "log-retention-days", "max-parallel-backups",
+                     "max-parallel-restores", "metrics-textfile", "note", "password", "pin-parent-snapshots",
+                     "prune-policy", "prune-schedule", "repository", "restic-path", "restic-timeouts",
+                     "resume-window-hours", "retry", "retry-lock", "ssh-multiplexing", "state-directory"]
 
     def __init__(self, d, src_dir):
         self.src_dir = src_dir
@@ -34,49 +43,189 @@ class Configuration:
         check(len(self.log_directory) > 0, "value for 'log-directory' cannot be empty")
         # log-retention-days
         self.log_retention_days = d.get('log-retention-days', 365 * 2)
+        # log-max-total-mb: optional cap on the size of the log directory, oldest logs are deleted first
+        self.log_max_total_mb = d.get('log-max-total-mb')
+        check(self.log_max_total_mb is None or (isinstance(self.log_max_total_mb, (int, float)) and
+                                                self.log_max_total_mb > 0), "log-max-total-mb must be a number > 0")
+        # compress-logs: gzip finished logs
+        self.compress_logs = d.get('compress-logs', True)
+        check(isinstance(self.compress_logs, bool), "expected compress-logs to be true or false")
         # forget-policy: optional at this level
         self.forget_policy = d.get('forget-policy')
         if self.forget_policy is not None and len(self.forget_policy) == 0:
             self.forget_policy = None
+        # forget-grouping
+        self.forget_grouping = d.get('forget-grouping', 'path')
+        check(self.forget_grouping in ['path', 'policy'], "forget-grouping must be one of: 'path', 'policy'")
         # prune-policy
         self.prune_policy = d.get('prune-policy', 0)
         check(0 <= self.prune_policy <= 1, "prune-policy must be [0,1] probability of running prune")
+        # prune-schedule: optional, replaces the prune-policy coin flip
+        self.prune_schedule = PruneSchedule(d['prune-schedule']) if 'prune-schedule' in d else None
+        # change-detection: skip backup paths that did not change since their last successful backup
+        self.change_detection = d.get('change-detection', False)
+        check(_valid_change_detection(self.change_detection),
+              "expected change-detection to be true, false or \"directories\"")
+        self.change_detection_max_staleness_days = d.get('change-detection-max-staleness-days', 7)
+        check(isinstance(self.change_detection_max_staleness_days, (int, float)),
+              "expected change-detection-max-staleness-days to be a number")
+        # pin-parent-snapshots: pass the previous snapshot of each target as --parent
+        self.pin_parent_snapshots = d.get('pin-parent-snapshots', True)
+        check(isinstance(self.pin_parent_snapshots, bool), "expected pin-parent-snapshots to be true or false")
+        # check-read-data-cycle: optional, verify 1/N of the pack data on every check
+        self.check_read_data_cycle = d.get('check-read-data-cycle')
+        check(self.check_read_data_cycle is None or (isinstance(self.check_read_data_cycle, int) and
+                                                     self.check_read_data_cycle >= 1),
+              "check-read-data-cycle must be an integer >= 1")
+        # cache-dir: optional restic cache shared by every run on this host (restic keeps one sub-directory per
+        # repository in it), so a container or user with an empty HOME does not download the index again
+        self.cache_dir = d.get('cache-dir')
+        check(self.cache_dir is None or (isinstance(self.cache_dir, str) and len(self.cache_dir.strip()) > 0),
+              "expected a non-empty value for cache-dir")
+        # cache-cleanup-days: how often restic removes caches of repositories not used for 30 days
+        self.cache_cleanup_days = d.get('cache-cleanup-days', 7)
+        check(isinstance(self.cache_cleanup_days, (int, float)) and self.cache_cleanup_days > 0,
+              "cache-cleanup-days must be a number > 0")
+        # resume-window-hours: a backup-prune run that failed is resumed, skipping completed steps, by runs starting
+        # within this many hours of it; 0 always starts from the beginning.  Below a day, so the next daily run
+        # never skips backups that completed the day before
+        self.resume_window_hours = d.get('resume-window-hours', 0)
+        check(isinstance(self.resume_window_hours, (int, float)) and 0 <= self.resume_window_hours < 24,
+              "resume-window-hours must be a number >= 0 and < 24")
+        # daemon-schedule: job intervals when running as a daemon
+        self.daemon_schedule = DaemonSchedule(d.get('daemon-schedule', {}))
+        # state-directory: local state (prune history etc), defaults to a 'state' directory next to the logs
+        self.state_directory = d.get('state-directory', os.path.join(os.path.dirname(self.log_directory), 'state'))
+        check(isinstance(self.state_directory, str) and len(self.state_directory.strip()) > 0,
+              "expected a non-empty value for state-directory")
         # backup commands
         self.backup_commands = []
         if 'backup-commands' in d:
             commands_ = d['backup-commands']
             self.backup_commands = list(map(lambda x: BackupCommand(x), commands_))
+        # exclude sets: named lists of exclude patterns shared between paths
+        self.exclude_sets = {}
+        sets_ = d.get('exclude-sets', {})
+        check(isinstance(sets_, dict), "exclude-sets must have names and lists of excludes")
+        for name, excludes in sets_.items():
+            check(isinstance(excludes, list), f"expected exclude-set '{name}' to be a list")
+            self.exclude_sets[name] = list(map(lambda x: Exclude(x), excludes))
         # backup paths
         self.backup_paths = []
         if 'backup-paths' in d:
             paths_ = d['backup-paths']
             self.backup_paths = list(map(lambda x: BackupPath(x), paths_))
             _check_for_duplicates(list(map(lambda x: x.path, self.backup_paths)), "duplicate path value")
+            for bp in self.backup_paths:
+                _compile_excludes(self, bp)
         check(len(self.backup_paths) + len(self.backup_commands) > 0, "no backup paths or commands defined")
+        # backup-grouping
+        self.backup_grouping = d.get('backup-grouping', 'none')
+        check(self.backup_grouping in ['none', 'auto'], "backup-grouping must be one of: 'none', 'auto'")
+        self.backup_groups = _group_backup_paths(self)
+        # max-parallel-backups
+        self.max_parallel_backups = d.get('max-parallel-backups', 1)
+        check(isinstance(self.max_parallel_backups, int) and self.max_parallel_backups >= 1,
+              "max-parallel-backups must be an integer >= 1")
+        # max-parallel-restores: restic processes used by restore-parallel
+        self.max_parallel_restores = d.get('max-parallel-restores', 4)
+        check(isinstance(self.max_parallel_restores, int) and self.max_parallel_restores >= 1,
+              "max-parallel-restores must be an integer >= 1")
         # restic-path
         self.restic_path = d.get('restic-path', 'restic')
         check(isinstance(self.restic_path, str), "expected restic-path to be a string")
         check(len(self.restic_path.strip()) > 0, "expected a non-empty value for restic-path")
+        # restic-timeouts: optional minutes per restic command, 'default' for all others
+        self.restic_timeouts = d.get('restic-timeouts', {})
+        check(isinstance(self.restic_timeouts, dict), "restic-timeouts must have commands and minutes")
+        for command, minutes in self.restic_timeouts.items():
+            check(isinstance(minutes, (int, float)) and minutes > 0,
+                  f"restic-timeouts '{command}' must be a number of minutes > 0")
+        # retry: retries of restic commands that failed on a lock, the network or a timeout
+        self.retry = RetryPolicy(d.get('retry', {}))
+        # retry-lock: optional, passed to restic as --retry-lock, e.g. '10m'
+        self.retry_lock = d.get('retry-lock')
+        check(self.retry_lock is None or (isinstance(self.retry_lock, str) and
+                                          re.fullmatch(r'(\d+[hms])+', self.retry_lock) is not None),
+              "retry-lock must be a duration like '30s', '10m' or '1h30m'")
+        # ssh-multiplexing: run the sftp connections of all restic commands over one ssh master connection
+        self.ssh_multiplexing = d.get('ssh-multiplexing', True)
+        check(isinstance(self.ssh_multiplexing, bool), "expected ssh-multiplexing to be true or false")
+        # bandwidth-schedule: optional --limit-upload/--limit-download by time of day, first matching window wins
+        schedule_ = d.get('bandwidth-schedule', [])
+        check(isinstance(schedule_, list), "expected bandwidth-schedule to be a list")
+        self.bandwidth_schedule = list(map(lambda x: BandwidthWindow(x), schedule_))
+        # metrics-textfile: optional prometheus node-exporter textfile
+        self.metrics_textfile = d.get('metrics-textfile')
+        check(self.metrics_textfile is None or isinstance(self.metrics_textfile, str),
+              "expected metrics-textfile to be a string")
+
+    def timeout_for(self, command):
+        """Timeout in seconds of a restic command, or None."""
+        minutes = self.restic_timeouts.get(command, self.restic_timeouts.get('default'))
+        return minutes * 60 if minutes is not None else None
 
     def has_environment(self):
         return self.environment is not None
 
+    def forget_policy_for(self, backup_path):
+        return self.forget_policy if not backup_path.has_forgets() else backup_path.forget_policy
+
+    def change_detection_for(self, backup_path):
+        return self.change_detection if backup_path.change_detection is None else backup_path.change_detection
+
+    def distinct_forget_policies(self):
+        """Effective forget policies of all backup commands and paths, without duplicates, in config order."""
+        policies = list(map(lambda x: self.forget_policy, self.backup_commands))
+        policies = policies + list(map(lambda x: self.forget_policy_for(x), self.backup_paths))
+        distinct = []
+        for policy in policies:
+            if policy is not None and policy not in distinct:
+                distinct.append(policy)
+        return distinct
+
     def restic_path_abs(self):
         return self._abs_path(self.restic_path)
 
     def log_directory_abs(self):
         return self._abs_path(self.log_directory)
 
+    def cache_dir_abs(self):
+        return self._abs_path(self.cache_dir) if self.cache_dir is not None else None
+
+    def state_directory_abs(self):
+        return self._abs_path(self.state_directory)
+
+    def excludes_file_abs(self, path):
+        return self._abs_path(path)
+
+    def metrics_textfile_abs(self):
+        return self._abs_path(self.metrics_textfile)
+
     def _abs_path(self, path):
         return path if os.path.isabs(path) else os.path.normpath(f"{self.src_dir}/{path}")
 
 
 class BackupPath:
-    __valid_props = ["excludes", "forget-policy", "note", "path"]
+    __valid_props = ["change-detection", "exclude-sets", "excludes", "excludes-file", "forget-policy", "group",
+                     "iexcludes", "ionice", "nice", "note", "path", "priority"]
 
     def __init__(self, d):
         _check_props(d, self.__valid_props)
         self.path = d['path']
+        self.priority = _read_priority(d)
+        self.change_detection = d.get('change-detection')
+        check(self.change_detection is None or _valid_change_detection(self.change_detection),
+              "expected change-detection to be true, false or \"directories\"")
+        self.group = d.get('group')
+        check(self.group is None or isinstance(self.group, str), "expected group to be a string")
+        # nice/ionice: scheduling and i/o priority of the restic process backing up the path
+        self.nice = d.get('nice')
+        check(self.nice is None or (isinstance(self.nice, int) and -20 <= self.nice <= 19),
+              "nice must be an integer from -20 to 19")
+        self.ionice = d.get('ionice')
+        check(self.ionice in [None, 'idle', 'best-effort', 'realtime'],
+              "ionice must be one of: 'idle', 'best-effort', 'realtime'")
         self.forget_policy = d.get('forget-policy')
         if self.forget_policy is not None and len(self.forget_policy) == 0:
             self.forget_policy = None
@@ -85,6 +234,16 @@ class BackupPath:
             _check_for_duplicates(list(map(lambda x: x.pattern, self.excludes)), "duplicate exclude path")
         else:
             self.excludes = None
+        self.iexcludes = list(map(lambda x: Exclude(x), d.get('iexcludes', [])))
+        _check_for_duplicates(list(map(lambda x: x.pattern, self.iexcludes)), "duplicate iexclude path")
+        self.exclude_set_names = d.get('exclude-sets', [])
+        check(isinstance(self.exclude_set_names, list), "expected exclude-sets of a path to be a list")
+        excludes_file = d.get('excludes-file', [])
+        self.excludes_files = [excludes_file] if isinstance(excludes_file, str) else excludes_file
+        check(isinstance(self.excludes_files, list), "expected excludes-file to be a string or a list")
+        # set by the configuration: de-duplicated patterns from 'excludes' and 'exclude-sets'
+        self.exclude_patterns = []
+        self.iexclude_patterns = []
 
     def has_excludes(self):
         return self.excludes is not None
@@ -93,13 +252,148 @@ class BackupPath:
         return self.forget_policy is not None
 
 
+class BackupGroup:
+    """
+    One or more backup paths that are backed up together in a single restic invocation.  All
+    paths in a group share the same effective forget-policy, excludes and change-detection setting.
+    """
+
+    def __init__(self, backup_paths):
+        self.backup_paths = backup_paths
+
+    def paths(self):
+        return list(map(lambda x: x.path, self.backup_paths))
+
+    def exclude_patterns(self):
+        return self.backup_paths[0].exclude_patterns
+
+    def iexclude_patterns(self):
+        return self.backup_paths[0].iexclude_patterns
+
+    def excludes_files(self):
+        return self.backup_paths[0].excludes_files
+
+    def priority(self):
+        return max(map(lambda x: x.priority, self.backup_paths))
+
+    def nice(self):
+        return self.backup_paths[0].nice
+
+    def ionice(self):
+        return self.backup_paths[0].ionice
+
+    def change_detection(self, config):
+        return config.change_detection_for(self.backup_paths[0])
+
+
+class PruneSchedule:
+    """
+    Decides when to forget/prune/check from repository growth and elapsed time instead of a coin flip.
+    """
+    __valid_props = ["bytes-added-threshold", "max-interval-days", "min-interval-days", "note", "stagger",
+                     "window"]
+
+    def __init__(self, d):
+        check(isinstance(d, dict), "expected prune-schedule to have keys and values")
+        _check_props(d, self.__valid_props)
+        self.min_interval_days = d.get('min-interval-days', 1)
+        self.max_interval_days = d.get('max-interval-days')
+        self.bytes_added_threshold = d.get('bytes-added-threshold')
+        self.stagger = d.get('stagger', True)
+        check(isinstance(self.min_interval_days, (int, float)) and self.min_interval_days >= 0,
+              "prune-schedule min-interval-days must be a number >= 0")
+        check(self.max_interval_days is None or (isinstance(self.max_interval_days, int) and
+                                                 self.max_interval_days >= 1),
+              "prune-schedule max-interval-days must be an integer >= 1")
+        check(self.bytes_added_threshold is None or isinstance(self.bytes_added_threshold, int),
+              "prune-schedule bytes-added-threshold must be an integer")
+        check(self.max_interval_days is not None or self.bytes_added_threshold is not None,
+              "prune-schedule needs max-interval-days and/or bytes-added-threshold")
+        self.window = None
+        if 'window' in d:
+            self.window = _parse_window(d['window'], "prune-schedule window")
+
+
+class BandwidthWindow:
+    """
+    Upload and download limits (KiB/s, as restic --limit-upload/--limit-download) during a time of day.
+    """
+    __valid_props = ["limit-download", "limit-upload", "note", "window"]
+
+    def __init__(self, d):
+        check(isinstance(d, dict), "expected bandwidth-schedule entries to have keys and values")
+        _check_props(d, self.__valid_props)
+        check('window' in d, "bandwidth-schedule entries need a window")
+        self.window = _parse_window(d['window'], "bandwidth-schedule window")
+        self.limit_upload = d.get('limit-upload')
+        self.limit_download = d.get('limit-download')
+        for name, value in [('limit-upload', self.limit_upload), ('limit-download', self.limit_download)]:
+            check(value is None or (isinstance(value, int) and value > 0),
+                  f"bandwidth-schedule {name} must be an integer > 0 (KiB/s)")
+
+
+class DaemonSchedule:
+    """
+    How often the daemon runs each job for a configuration; an interval of 0 disables the job.
+    """
+    __valid_props = ["backup-interval-hours", "check-interval-hours", "jitter-minutes", "note",
+                     "prune-interval-hours"]
+
+    def __init__(self, d):
+        check(isinstance(d, dict), "expected daemon-schedule to have keys and values")
+        _check_props(d, self.__valid_props)
+        self.backup_interval_hours = d.get('backup-interval-hours', 24)
+        self.prune_interval_hours = d.get('prune-interval-hours', 24)
+        self.check_interval_hours = d.get('check-interval-hours', 24 * 7)
+        self.jitter_minutes = d.get('jitter-minutes', 15)
+        for name in ['backup-interval-hours', 'prune-interval-hours', 'check-interval-hours', 'jitter-minutes']:
+            value = d.get(name, 0)
+            check(isinstance(value, (int, float)) and value >= 0, f"daemon-schedule {name} must be a number >= 0")
+
+    def intervals(self):
+        """Interval in seconds of each enabled job."""
+        hours = {'backup': self.backup_interval_hours, 'prune': self.prune_interval_hours,
+                 'check': self.check_interval_hours}
+        return dict(map(lambda x: (x[0], x[1] * 60 * 60), filter(lambda x: x[1] > 0, hours.items())))
+
+
+class RetryPolicy:
+    """
+    How often, and how long apart, a restic command that failed for a transient reason is retried.
+    """
+    __valid_props = ["attempts", "initial-delay-seconds", "max-delay-seconds", "note"]
+
+    def __init__(self, d):
+        check(isinstance(d, dict), "expected retry to have keys and values")
+        _check_props(d, self.__valid_props)
+        self.attempts = d.get('attempts', 3)
+        self.initial_delay_seconds = d.get('initial-delay-seconds', 30)
+        self.max_delay_seconds = d.get('max-delay-seconds', 600)
+        check(isinstance(self.attempts, int) and self.attempts >= 1, "retry attempts must be an integer >= 1")
+        check(isinstance(self.initial_delay_seconds, (int, float)) and self.initial_delay_seconds >= 0,
+              "retry initial-delay-seconds must be a number >= 0")
+        check(isinstance(self.max_delay_seconds, (int, float)) and self.max_delay_seconds >= 0,
+              "retry max-delay-seconds must be a number >= 0")
+
+
 class BackupCommand:
-    __valid_props = ["command", "note", "repo-path"]
+    __valid_props = ["buffer-mb", "command", "compression", "compression-level", "note", "priority", "repo-path",
+                     "spool-mb"]
 
     def __init__(self, d):
         _check_props(d, self.__valid_props)
         self.command = d['command']
         self.repo_path = d['repo-path']
+        self.priority = _read_priority(d)
+        self.compression = d.get('compression', 'none')
+        check(self.compression in ['none', 'gzip', 'zstd'], "compression must be one of: 'none', 'gzip', 'zstd'")
+        self.compression_level = d.get('compression-level')
+        check(self.compression_level is None or isinstance(self.compression_level, int),
+              "expected compression-level to be an integer")
+        self.buffer_mb = d.get('buffer-mb', 64)
+        check(isinstance(self.buffer_mb, int) and self.buffer_mb >= 1, "buffer-mb must be an integer >= 1")
+        self.spool_mb = d.get('spool-mb', 0)
+        check(isinstance(self.spool_mb, int) and self.spool_mb >= 0, "spool-mb must be an integer >= 0")
         check(isinstance(self.command, list), "expected command to be a list")
         check(isinstance(self.repo_path, str), "expected repo-path to be a string")
         check(len(self.command) > 0, "expected command list to have at least one element")
@@ -123,6 +417,10 @@ class Exclude:
             raise ValueError("unexpected type for exclude element: " + str(type(d)))
         check(len(self.pattern) > 0, "exclude pattern can not be empty")
 
+    def __reduce__(self):
+        # cached configurations rebuild excludes without validating them again; far faster with many excludes
+        return _validated_exclude, (self.pattern, self.note)
+
 
 # --------------------------------------------------------------------
 #
@@ -142,26 +440,119 @@ def print_config(config: Configuration):
     print(f"restic-path        = {config.restic_path}")
     print(f"log-directory      = {config.log_directory}")
     print(f"log-retention-days = {config.log_retention_days}")
+    print(f"log-max-total-mb   = {config.log_max_total_mb}")
+    print(f"compress-logs      = {config.compress_logs}")
+    print(f"metrics-textfile   = {config.metrics_textfile}")
     print(f"forget-policy      = {config.forget_policy}")
+    print(f"forget-grouping    = {config.forget_grouping}")
     print(f"prune-policy       = {config.prune_policy}")
+    if config.prune_schedule is not None:
+        ps = config.prune_schedule
+        print(f"prune-schedule     = min-interval-days={ps.min_interval_days} "
+              f"max-interval-days={ps.max_interval_days} bytes-added-threshold={ps.bytes_added_threshold} "
+              f"window={ps.window} stagger={ps.stagger}")
+    print(f"change-detection   = {config.change_detection} "
+          f"(max-staleness-days={config.change_detection_max_staleness_days})")
+    print(f"pin-parent-snapshots = {config.pin_parent_snapshots}")
+    print(f"check-read-data-cycle = {config.check_read_data_cycle}")
+    print(f"restic-timeouts    = {config.restic_timeouts}")
+    print(f"retry              = attempts={config.retry.attempts} "
+          f"initial-delay-seconds={config.retry.initial_delay_seconds} "
+          f"max-delay-seconds={config.retry.max_delay_seconds} retry-lock={config.retry_lock}")
+    print(f"ssh-multiplexing   = {config.ssh_multiplexing}")
+    print(f"state-directory    = {config.state_directory}")
+    print(f"resume-window-hours = {config.resume_window_hours}")
+    print(f"cache-dir          = {config.cache_dir} (cleanup-days={config.cache_cleanup_days})")
+    ds = config.daemon_schedule
+    print(f"daemon-schedule    = backup-interval-hours={ds.backup_interval_hours} "
+          f"prune-interval-hours={ds.prune_interval_hours} check-interval-hours={ds.check_interval_hours} "
+          f"jitter-minutes={ds.jitter_minutes}")
+    for w in config.bandwidth_schedule:
+        print(f"bandwidth-schedule = window={w.window} limit-upload={w.limit_upload} "
+              f"limit-download={w.limit_download}")
+    print(f"backup-grouping    = {config.backup_grouping}")
+    print(f"max-parallel-backups = {config.max_parallel_backups}")
+    print(f"max-parallel-restores = {config.max_parallel_restores}")
     for backup_command in config.backup_commands:
         print(f"\t{backup_command.command} > {backup_command.repo_path}")
+        if backup_command.compression != 'none':
+            print(f"\t\tcompression={backup_command.compression} level={backup_command.compression_level}")
     for backup_path in config.backup_paths:
         print(f"\tpath = {backup_path.path}")
+        if backup_path.group is not None:
+            print(f"\t\tgroup={backup_path.group}")
+        if backup_path.nice is not None or backup_path.ionice is not None:
+            print(f"\t\tnice={backup_path.nice} ionice={backup_path.ionice}")
         if backup_path.has_forgets():
             print(f"\t\tforget-policy={backup_path.forget_policy}")
         if backup_path.has_excludes():
             for e in backup_path.excludes:
                 print(f"\t\texclude = {e.pattern}")
+        for e in backup_path.iexcludes:
+            print(f"\t\tiexclude = {e.pattern}")
+        for name in backup_path.exclude_set_names:
+            print(f"\t\texclude-set = {name} ({len(config.exclude_sets[name])} patterns)")
+        for f in backup_path.excludes_files:
+            print(f"\t\texcludes-file = {f}")
     if config.has_environment():
         print("\tenvironment:")
         for key, value in config.environment.items():
             print(f"\t\t{key} = {value}")
 
 
-def read_config(file, src_dir):
-    config_dict = _read_config_json(file, src_dir)
-    return Configuration(config_dict, src_dir)
+def read_config(file, src_dir, cache_dir=None):
+    """
+    Read and validate a configuration.  With a cache_dir the validated configuration, without its password, is
+    kept there in binary form, keyed on the file's content, and loaded from it while the file (and this code)
+    are unchanged.  The password is always read from the file itself.
+    """
+    read_bytes = _read_config_bytes(file, src_dir)
+    key = _cache_key(read_bytes, file, src_dir) if cache_dir is not None else None
+    config = _read_cached_config(cache_dir, file, key) if key is not None else None
+    if config is not None:
+        config.password = json.loads(read_bytes.decode('utf-8'))['password'].strip()
+    else:
+        config = Configuration(json.loads(read_bytes.decode('utf-8')), src_dir)
+        config.config_file = file
+        if key is not None:
+            _write_cached_config(cache_dir, file, key, config)
+    return config
+
+
+def default_cache_dir():
+    """Per-user directory of the configuration cache."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'restic-configured')
+
+
+def policy_tag(policy):
+    """Snapshot tag identifying a forget policy, used to select snapshots in forget-grouping 'policy'."""
+    digest = hashlib.sha1(' '.join(policy).encode('utf-8')).hexdigest()
+    return f"forget-policy-{digest[:12]}"
+
+
+def retired_policy_tags(snapshots, targets, host):
+    """
+    Snapshots of host that no current policy tag selects, per target: those whose policy tag no target uses any
+    more (e.g. after its forget-policy was edited) and those without a policy tag (e.g. taken before switching to
+    forget-grouping 'policy').  Other hosts' snapshots are left to them.  snapshots are dicts from restic
+    snapshots --json; targets maps (paths, current policy tag).  Returns a list of (paths, current tag, retired
+    tags, snapshot IDs) for targets with such snapshots.
+    """
+    current = set(map(lambda x: x[1], targets))
+    orphans = {}
+    for snapshot in filter(lambda x: x.get('hostname') == host and 'id' in x, snapshots):
+        policy_tags = set(filter(lambda x: x.startswith('forget-policy-'), snapshot.get('tags') or []))
+        if len(policy_tags & current) == 0:
+            tags, ids = orphans.setdefault(tuple(sorted(snapshot.get('paths') or [])), (set(), []))
+            tags.update(policy_tags)
+            ids.append(snapshot['id'])
+    found = []
+    for paths, tag in targets:
+        tags, ids = orphans.get(tuple(sorted(paths)), (set(), []))
+        if len(ids) > 0:
+            found.append((paths, tag, sorted(tags), ids))
+    return found
 
 
 def check(condition, message):
@@ -174,15 +565,68 @@ def check(condition, message):
 #
 # --------------------------------------------------------------------
 
-def _read_config_json(file, relative_dir):
+def _read_config_bytes(file, relative_dir):
     f = file if os.path.isabs(file) else f"{relative_dir}/{file}"
     if not os.path.isfile(f):
         print("specified configuration files does not exist:" + f)
         sys.exit(-1)
     with open(f, 'rb') as f:
-        read_bytes = f.read()
-        json_string = read_bytes.decode('utf-8')
-        return json.loads(json_string)
+        return f.read()
+
+
+def _cache_key(read_bytes, file, src_dir):
+    """Changes with the configuration, how relative paths resolve and the code that validated it."""
+    code = os.stat(__file__)
+    h = hashlib.sha256(read_bytes)
+    h.update(f"\0{file}\0{src_dir}\0{code.st_mtime_ns}:{code.st_size}\0{sys.version_info[:2]}".encode('utf-8'))
+    return h.hexdigest()
+
+
+def _cache_file(cache_dir, file):
+    return os.path.join(cache_dir, f"{hashlib.sha1(os.path.abspath(file).encode('utf-8')).hexdigest()[:16]}.pickle")
+
+
+def _private_cache_dir(cache_dir):
+    """Create cache_dir; True if only the current user can write to it, so loading pickles from it is safe."""
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(cache_dir)
+    except OSError:
+        return False
+    return os.name == 'nt' or (st.st_uid == os.getuid() and st.st_mode & 0o022 == 0)
+
+
+def _read_cached_config(cache_dir, file, key):
+    f = _cache_file(cache_dir, file)
+    if not os.path.isfile(f) or not _private_cache_dir(cache_dir):
+        return None
+    try:
+        with open(f, 'rb') as fp:
+            cached_key, config = pickle.load(fp)
+    except (OSError, EOFError, ValueError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+    return config if cached_key == key else None
+
+
+def _write_cached_config(cache_dir, file, key, config):
+    if not _private_cache_dir(cache_dir):
+        return
+    f = _cache_file(cache_dir, file)
+    tmp = f"{f}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        # no second copy of the repository password on disk; the rest is still only for the owner to read
+        cached = copy.copy(config)
+        cached.password = None
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as fp:
+            pickle.dump((key, cached), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, f)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _valid_change_detection(value):
+    return isinstance(value, bool) or value == 'directories'
 
 
 def _check_props(d, props):
@@ -191,7 +635,73 @@ def _check_props(d, props):
             raise ValueError(f"invalid property: '{prop}'")
 
 
+def _group_backup_paths(config):
+    """
+    Paths with the same explicit 'group' are always backed up together.  With backup-grouping 'auto'
+    the remaining paths are grouped by (effective forget-policy, excludes) so that forget can still
+    select each group's snapshots with --path.
+    """
+    groups = {}
+    for bp in config.backup_paths:
+        policy = config.forget_policy_for(bp)
+        key = (tuple(policy) if policy is not None else None, tuple(bp.exclude_patterns),
+               tuple(bp.iexclude_patterns), tuple(bp.excludes_files), config.change_detection_for(bp), bp.nice,
+               bp.ionice)
+        if bp.group is not None:
+            group_key = ('group', bp.group)
+        elif config.backup_grouping == 'auto':
+            group_key = ('auto', key)
+        else:
+            group_key = ('path', bp.path)
+        if group_key not in groups:
+            groups[group_key] = (key, [])
+        group_compat_key, members = groups[group_key]
+        check(group_compat_key == key,
+              f"paths in group '{bp.group}' must have the same forget-policy and excludes, nice and ionice: "
+              f"'{bp.path}'")
+        members.append(bp)
+    return list(map(lambda x: BackupGroup(x[1]), groups.values()))
+
+
+def _compile_excludes(config, bp):
+    patterns = list(map(lambda x: x.pattern, bp.excludes)) if bp.has_excludes() else []
+    for name in bp.exclude_set_names:
+        check(name in config.exclude_sets, f"unknown exclude-set: '{name}'")
+        patterns = patterns + list(map(lambda x: x.pattern, config.exclude_sets[name]))
+    bp.exclude_patterns = list(dict.fromkeys(patterns))
+    bp.iexclude_patterns = list(map(lambda x: x.pattern, bp.iexcludes))
+
+
+def _parse_window(value, name):
+    """Parse 'HH:MM-HH:MM' into a pair of minutes since midnight; the window may wrap around midnight."""
+    check(isinstance(value, str), f"expected {name} to be a string 'HH:MM-HH:MM'")
+    try:
+        start, end = value.split('-')
+        minutes = []
+        for t in [start, end]:
+            hours, mins = t.strip().split(':')
+            check(0 <= int(hours) < 24 and 0 <= int(mins) < 60, f"invalid {name}: '{value}'")
+            minutes.append(int(hours) * 60 + int(mins))
+        return minutes[0], minutes[1]
+    except ValueError:
+        raise ValueError(f"invalid {name}: '{value}'")
+
+
+def _validated_exclude(pattern, note):
+    e = Exclude.__new__(Exclude)
+    e.pattern = pattern
+    e.note = note
+    return e
+
+
+def _read_priority(d):
+    priority = d.get('priority', 0)
+    check(isinstance(priority, (int, float)), "expected priority to be a number")
+    return priority
+
+
 def _check_for_duplicates(in_list, message):
+    counts = collections.Counter(in_list)
     for element in in_list:
-        if in_list.count(element) > 1:
+        if counts[element] > 1:
             raise ValueError(f"{message}: '{element}'")
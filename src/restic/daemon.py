@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import json
+import os
+import random
+import signal
+import time
+from restic.logging import banner
+from restic.state import read_state, write_state
+
+POLL_SECONDS = 5
+RETRY_SECONDS = 60 * 60
+STATUS_TIMEOUT_SECONDS = 10
+MAX_RESULTS = 50
+
+
+class _Entry:
+    """A configuration file kept loaded by the daemon."""
+
+    def __init__(self, file):
+        self.file = file
+        self.name = os.path.splitext(os.path.basename(file))[0]
+        self.mtime = None
+        self.config = None
+        self.error = None
+        self.next_run = {}
+
+
+class Daemon:
+    """
+    Keeps configurations loaded, reloading a file when it changes, and runs each configuration's jobs on the
+    intervals of its daemon-schedule.  Jobs run in worker threads, at most max_parallel at once and never two
+    on the same repository.  The current jobs, queue and last results are served as json over HTTP.
+
+    load_config(file) returns a configuration; run_job(file, config, kind) runs a job and returns True on
+    success.
+    """
+
+    def __init__(self, config_files, load_config, run_job, max_parallel=1, status_address=None):
+        self.entries = list(map(_Entry, config_files))
+        self.load_config = load_config
+        self.run_job = run_job
+        self.max_parallel = max_parallel
+        self.status_address = status_address
+        self.start_time = time.time()
+        self.running = {}
+        self.queued = []
+        self.results = collections.deque(maxlen=MAX_RESULTS)
+        self._tasks = set()
+        self._repository_locks = {}
+        self._stop = None
+        self._slots = None
+        self._executor = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_parallel)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not the main thread
+                pass
+        server = None
+        if self.status_address is not None:
+            host, port = self.status_address
+            server = await asyncio.start_server(self._serve_status, host, port)
+            port = server.sockets[0].getsockname()[1]
+            self.status_address = (host, port)
+            banner(f"daemon status: http://{host}:{port}/")
+        try:
+            while not self._stop.is_set():
+                self.reload()
+                self._start_due_jobs(time.time())
+                try:
+                    await asyncio.wait_for(self._stop.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            banner(f"daemon stopping, waiting for {len(self._tasks)} jobs")
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            if len(self._tasks) > 0:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._executor.shutdown()
+
+    def stop(self):
+        self._stop.set()
+
+    def reload(self):
+        """(Re)load configuration files that changed; a file that fails to load keeps its previous configuration."""
+        for e in self.entries:
+            try:
+                mtime = os.path.getmtime(e.file)
+            except OSError as ex:
+                e.error = str(ex)
+                continue
+            if mtime == e.mtime:
+                continue
+            e.mtime = mtime
+            try:
+                config = self.load_config(e.file)
+            except (Exception, SystemExit) as ex:
+                e.error = f"{type(ex).__name__}: {ex}"
+                banner(f"daemon: {e.file} NOT loaded: {e.error}")
+                continue
+            banner(f"daemon: {'reloaded' if e.config is not None else 'loaded'} {e.file}")
+            e.config = config
+            e.error = None
+            self._schedule(e, time.time())
+
+    def status(self):
+        scheduled = []
+        for e in self.entries:
+            for kind, t in e.next_run.items():
+                scheduled.append({'config': e.name, 'job': kind, 'next_run': t})
+        return {
+            'start_time': self.start_time,
+            'configs': list(map(lambda x: {'file': x.file, 'repository': x.config.repository if x.config else None,
+                                           'error': x.error}, self.entries)),
+            'running': list(map(lambda x: {'config': x[0][0], 'job': x[0][1], 'start_time': x[1]},
+                                self.running.items())),
+            'queue': list(map(lambda x: {'config': x[0], 'job': x[1]}, self.queued)),
+            'scheduled': sorted(scheduled, key=lambda x: x['next_run']),
+            'results': list(self.results),
+        }
+
+    def _schedule(self, e, now, kinds=None):
+        """Next run of each job: its interval after the last successful run, plus jitter."""
+        schedule = e.config.daemon_schedule
+        intervals = schedule.intervals()
+        state = read_state(e.config, 'daemon')
+        for kind in list(e.next_run.keys()):
+            if kind not in intervals:
+                del e.next_run[kind]
+        for kind, interval in intervals.items():
+            if kinds is not None and kind not in kinds:
+                continue
+            last = state.get(f"{e.name}:{kind}")
+            due = last + interval if last is not None else now
+            e.next_run[kind] = max(due, now) + random.uniform(0, schedule.jitter_minutes * 60)
+
+    def _start_due_jobs(self, now):
+        for e in self.entries:
+            if e.config is None:
+                continue
+            for kind, t in e.next_run.items():
+                key = (e.name, kind)
+                if t <= now and key not in self.running and key not in self.queued:
+                    self.queued.append(key)
+                    task = asyncio.ensure_future(self._run_job(e, kind))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, e, kind):
+        key = (e.name, kind)
+        config = e.config
+        lock = self._repository_locks.setdefault(config.repository, asyncio.Lock())
+        async with lock:
+            async with self._slots:
+                self.queued.remove(key)
+                self.running[key] = time.time()
+                start = time.perf_counter()
+                error = None
+                try:
+                    ctx = contextvars.copy_context()
+                    ok = await asyncio.get_running_loop().run_in_executor(self._executor, ctx.run, self.run_job,
+                                                                          e.file, config, kind)
+                    ok = ok is not False
+                except (Exception, SystemExit) as ex:
+                    ok = False
+                    error = f"{type(ex).__name__}: {ex}"
+                finally:
+                    del self.running[key]
+        seconds = time.perf_counter() - start
+        self.results.append({'config': e.name, 'job': kind, 'ok': ok, 'seconds': seconds,
+                             'end_time': time.time(), 'error': error})
+        now = time.time()
+        if ok:
+            state = read_state(config, 'daemon')
+            state[f"{e.name}:{kind}"] = now
+            write_state(config, 'daemon', state)
+            self._schedule(e, now, [kind])
+        elif kind in e.next_run:
+            e.next_run[kind] = now + RETRY_SECONDS + random.uniform(0, config.daemon_schedule.jitter_minutes * 60)
+        banner(f"daemon: {e.name} {kind} {'OK' if ok else 'FAILED'} in {seconds:,.0f} seconds")
+
+    async def _serve_status(self, reader, writer):
+        try:
+            await asyncio.wait_for(self._read_request(reader), STATUS_TIMEOUT_SECONDS)
+            body = json.dumps(self.status(), indent=2).encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n' +
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        while True:
+            line = await reader.readline()
+            if line in [b'', b'\n', b'\r\n']:
+                return
+
+
+def parse_address(address):
+    """'host:port' -> (host, port); None or '' disables the status endpoint."""
+    if address is None or address == '':
+        return None
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError(f"expected host:port, got '{address}'")
+    return host if host != '' else '127.0.0.1', int(port)
@@ -0,0 +1,50 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+_lock = threading.Lock()
+_files = {}
+_directory = None
+
+
+def exclude_file_args(patterns, option):
+    """
+    Restic arguments for a list of exclude patterns.  Patterns are written once per run to a temporary
+    exclude file passed with '--{option}-file'; identical pattern lists share one file.  Patterns that
+    restic would alter when reading them from a file ('$' is expanded from the environment, leading '#'
+    is a comment) are passed as '--{option} <pattern>' instead.
+    """
+    in_file = []
+    on_command_line = []
+    for p in patterns:
+        if '$' in p or p.startswith('#') or p != p.strip():
+            on_command_line = on_command_line + [f'--{option}', p]
+        else:
+            in_file.append(p)
+    if len(in_file) == 0:
+        return on_command_line
+    return [f'--{option}-file', _exclude_file(in_file)] + on_command_line
+
+
+def _exclude_file(patterns):
+    global _directory
+    text = ''.join(map(lambda x: f"{x}\n", patterns))
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    with _lock:
+        if key not in _files:
+            if _directory is None:
+                _directory = tempfile.mkdtemp(prefix='restic-excludes-')
+                atexit.register(_cleanup)
+            path = os.path.join(_directory, f"{key[:16]}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            _files[key] = path
+        return _files[key]
+
+
+def _cleanup():
+    if _directory is not None:
+        shutil.rmtree(_directory, ignore_errors=True)
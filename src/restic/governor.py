@@ -0,0 +1,85 @@
+import os
+import shutil
+import signal
+import threading
+import time
+from restic.prune import in_window
+
+SECS_PER_DAY = 60 * 60 * 24
+
+# ionice -c argument per class
+IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+
+# Outcome recorded for a restic call stopped to apply new bandwidth limits.
+RESTARTED = 'restarted'
+
+
+def bandwidth_limits(schedule, now):
+    """(limit-upload, limit-download) in KiB/s of the first window containing now, or (None, None)."""
+    for w in schedule:
+        if in_window(w.window, now):
+            return w.limit_upload, w.limit_download
+    return None, None
+
+
+def limit_args(schedule, now):
+    upload, download = bandwidth_limits(schedule, now)
+    upload_args = ['--limit-upload', str(upload)] if upload is not None else []
+    return upload_args + (['--limit-download', str(download)] if download is not None else [])
+
+
+def next_change(schedule, now):
+    """Seconds from now until the limits change at a window boundary, or None if they never change."""
+    current = bandwidth_limits(schedule, now)
+    t = time.localtime(now)
+    seconds_of_day = t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec
+    boundaries = set()
+    for w in schedule:
+        boundaries.update(w.window)
+    delays = sorted(map(lambda x: (x * 60 - seconds_of_day) % SECS_PER_DAY or SECS_PER_DAY, boundaries))
+    for delay in delays:
+        if bandwidth_limits(schedule, now + delay) != current:
+            return delay
+    return None
+
+
+def priority_prefix(nice, ionice):
+    """Command prefix running restic under nice and ionice, where those tools exist (ionice is Linux only)."""
+    prefix = []
+    if ionice is not None and shutil.which('ionice') is not None:
+        prefix = prefix + ['ionice', '-c', IONICE_CLASSES[ionice]]
+    if nice is not None and shutil.which('nice') is not None:
+        prefix = prefix + ['nice', '-n', str(nice)]
+    return prefix
+
+
+class BandwidthGovernor:
+    """
+    Interrupts a running restic process when its bandwidth window ends, so it can be started again with the
+    limits of the next window.
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.interrupted = False
+        self._timer = None
+
+    def watch(self, p):
+        """Start watching a process (an on_start callback)."""
+        self.interrupted = False
+        delay = next_change(self.schedule, time.time())
+        if delay is not None:
+            self._timer = threading.Timer(delay, self._interrupt, args=(p,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def done(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _interrupt(self, p):
+        if p.poll() is None:
+            self.interrupted = True
+            # restic stops cleanly on SIGINT, removing its lock
+            p.send_signal(signal.SIGINT if os.name != 'nt' else signal.SIGTERM)
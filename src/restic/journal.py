@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import time
+from restic.metrics import atomic_write
+
+
+class Journal:
+    """
+    Persisted progress of a run: the steps that completed and the decisions taken.  A run started again within
+    window_hours of the first attempt, while the journal is unfinished, skips the completed steps and takes the
+    same decisions.  Without a file nothing is persisted and nothing is resumed.
+    """
+
+    def __init__(self, file=None, command=None, window_hours=0, now=None):
+        self.file = file
+        now = time.time() if now is None else now
+        doc = _read(file) if file is not None else None
+        self.resumed = doc is not None and doc.get('command') == command and \
+            0 <= now - doc.get('start_time', 0) < window_hours * 3600
+        if self.resumed:
+            self.doc = doc
+        else:
+            self.doc = {'command': command, 'start_time': now, 'completed': {}, 'decisions': {}}
+        self._lock = threading.Lock()
+
+    def start_time(self):
+        return self.doc['start_time']
+
+    def completed(self):
+        return dict(self.doc['completed'])
+
+    def done(self, step):
+        with self._lock:
+            return step in self.doc['completed']
+
+    def complete(self, step):
+        with self._lock:
+            self.doc['completed'][step] = time.time()
+            self._save()
+
+    def decision(self, name, decide):
+        """The decision taken for name in this run, calling decide() the first time."""
+        with self._lock:
+            if name in self.doc['decisions']:
+                return self.doc['decisions'][name]
+        value = decide()
+        with self._lock:
+            self.doc['decisions'][name] = value
+            self._save()
+        return value
+
+    def finish(self):
+        """The run completed: the next one starts from the beginning."""
+        if self.file is not None and os.path.exists(self.file):
+            os.remove(self.file)
+
+    def _save(self):
+        if self.file is not None:
+            atomic_write(self.file, json.dumps(self.doc, indent=2, sort_keys=True))
+
+
+def _read(file):
+    try:
+        with open(file, 'rb') as f:
+            doc = json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    return doc if isinstance(doc, dict) and isinstance(doc.get('completed'), dict) and \
+        isinstance(doc.get('decisions'), dict) else None
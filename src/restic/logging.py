@@ -1,38 +1,135 @@
+import contextvars
 import datetime
 import os
 import sys
-import time
+import threading
+from restic.logs import maintain
+
+_output_lock = threading.Lock()
+_line_state = threading.local()
+_job_label = contextvars.ContextVar('job_label', default=None)
+_log_file = contextvars.ContextVar('log_file', default=None)
+_maintenance = contextvars.ContextVar('log_maintenance', default=None)
+# logs this process still writes to (absolute paths), never compressed or deleted by log maintenance
+_open_logs = set()
 
 
 def timestamp(): return datetime.datetime.now().replace(microsecond=0).isoformat('_')
 
 
-def _file_age_seconds(filepath):
-    return time.time() - os.path.getmtime(filepath)
+def redirect_stdout(config):
+    d = config.log_directory_abs()
+    if not os.path.isdir(config.log_directory_abs()):
+        os.makedirs(d)
+    log_file = f"{d}/{timestamp()}.log"
+    sys.stdout = open(log_file, 'w')
+    with _output_lock:
+        _open_logs.add(os.path.abspath(log_file))
+    _start_log_maintenance(config, log_file)
+    return log_file
 
 
-def _delete_old_logs(log_dir, log_retention_days):
-    secs_per_day = 60 * 60 * 24
-    max_age_seconds = secs_per_day * log_retention_days
-    for root, dirs, files in os.walk(log_dir):
-        for file in files:
-            log_file = os.path.join(root, file)
-            age_seconds = _file_age_seconds(log_file)
-            if age_seconds > max_age_seconds:
-                os.remove(log_file)
-                banner(f"deleting old log file: age={age_seconds}; log_file={log_file};")
+class _ContextStdout:
+    """sys.stdout replacement that writes to the log file of the current context, if it has one."""
 
+    def __init__(self, default):
+        self.default = default
 
-def redirect_stdout(config):
+    def write(self, text):
+        f = _log_file.get()
+        return (f if f is not None else self.default).write(text)
+
+    def flush(self):
+        f = _log_file.get()
+        (f if f is not None else self.default).flush()
+
+
+def redirect_context_stdout(config, name):
+    """
+    Like redirect_stdout, but only for the current context (and threads started from it with a copy of the
+    context), so several configurations can log to their own files from one process.  name is appended to
+    the log file name, as configurations may share a log directory.
+    """
     d = config.log_directory_abs()
-    if not os.path.isdir(config.log_directory_abs()):
+    if not os.path.isdir(d):
         os.makedirs(d)
-    sys.stdout = open(f"{d}/{timestamp()}.log", 'w')
-    _delete_old_logs(d, config.log_retention_days)
+    with _output_lock:
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+    log_file = f"{d}/{timestamp()}-{name}.log"
+    _log_file.set(open(log_file, 'w'))
+    with _output_lock:
+        _open_logs.add(os.path.abspath(log_file))
+    _start_log_maintenance(config, log_file)
+    return log_file
+
+
+def close_context_stdout():
+    t = _maintenance.get()
+    if t is not None:
+        _maintenance.set(None)
+        t.join()
+    f = _log_file.get()
+    if f is not None:
+        _log_file.set(None)
+        f.close()
+        with _output_lock:
+            _open_logs.discard(os.path.abspath(f.name))
+
+
+def _start_log_maintenance(config, log_file):
+    """Compress and expire old logs in the background, so the run does not wait for it."""
+    t = threading.Thread(target=contextvars.copy_context().run, name='log-maintenance',
+                         args=(_maintain_logs, config, log_file))
+    t.start()
+    _maintenance.set(t)
+
+
+def open_logs(log_dir):
+    """Names of the logs in log_dir this process still writes to, e.g. of other jobs in fleet or daemon mode."""
+    log_dir = os.path.abspath(log_dir)
+    with _output_lock:
+        return set(map(os.path.basename, filter(lambda x: os.path.dirname(x) == log_dir, _open_logs)))
+
+
+def _maintain_logs(config, log_file):
+    log_dir = os.path.dirname(log_file)
+    try:
+        messages = maintain(log_dir, config.log_retention_days, config.log_max_total_mb, config.compress_logs,
+                            open_logs(log_dir) | {os.path.basename(log_file)})
+    except OSError as e:
+        messages = [f"log maintenance FAILED: {e}"]
+    for message in messages:
+        banner(message)
+
+
+def job_label():
+    return _job_label.get()
+
+
+def set_job_label(label):
+    """Prefix all output written in the current context with '[label] '; None to disable."""
+    _job_label.set(label)
+    _line_state.at_line_start = True
+
+
+def write_output(text):
+    """Write text to stdout, prefixing each line with the current context's job label (if any)."""
+    label = _job_label.get()
+    if label is not None:
+        prefix = f"[{label}] "
+        lines = text.splitlines(keepends=True)
+        prefixed = []
+        for line in lines:
+            prefixed.append(prefix + line if getattr(_line_state, 'at_line_start', True) else line)
+            _line_state.at_line_start = line.endswith('\n')
+        text = ''.join(prefixed)
+    with _output_lock:
+        sys.stdout.write(text)
 
 
 def banner(message):
-    print(f'[{timestamp()}] *************** {message}')
+    write_output(f'[{timestamp()}] *************** {message}\n')
     sys.stdout.flush()
 
 
@@ -46,7 +143,7 @@ def format_command(command_part_array):
         if new_line:
             length = 0
             result = result + "\\\n\t"
-        should_quote_part = (' ' in part or last_part == '--exclude')
+        should_quote_part = (' ' in part or last_part in ['--exclude', '--iexclude'])
         result = result + (part if not should_quote_part else f'"{part}"')
         result = result + " "
         length = length + len(part)
@@ -0,0 +1,124 @@
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import stat
+import threading
+import time
+from restic.metrics import atomic_write
+
+# Index of the log directory: file name -> [time, size in bytes, mtime], so sweeps need no stat per file.
+INDEX_FILE = '.log-index.json'
+
+# Logs are compressed once they have not been written to for this long (they may belong to another process).
+COMPRESS_AFTER_SECONDS = 60 * 60
+
+SECS_PER_DAY = 60 * 60 * 24
+
+_TIMESTAMP = re.compile(r'^(\d{4}-\d\d-\d\d_\d\d:\d\d:\d\d)')
+
+
+def log_time(name):
+    """Time of a log from the timestamp its name starts with, or None."""
+    m = _TIMESTAMP.match(name)
+    if m is None:
+        return None
+    try:
+        return datetime.datetime.strptime(m.group(1), '%Y-%m-%d_%H:%M:%S').timestamp()
+    except ValueError:
+        return None
+
+
+def maintain(log_dir, retention_days, max_total_mb=None, compress=True, keep=(), now=None):
+    """
+    Compress finished logs, delete logs older than retention_days and then the oldest logs until the directory
+    holds at most max_total_mb.  Log age comes from the timestamp in the file name and sizes from the index,
+    so only new and still uncompressed files are stat'ed.  keep (file names, e.g. the logs this process still
+    writes to) are never touched.  Returns messages describing what was done.
+    """
+    now = time.time() if now is None else now
+    index_file = os.path.join(log_dir, INDEX_FILE)
+    index = _read_index(index_file)
+    names = set(filter(lambda x: x != INDEX_FILE and not x.endswith('.tmp'), os.listdir(log_dir)))
+    index = dict(filter(lambda x: x[0] in names, index.items()))
+    messages = []
+    for name in sorted(names):
+        if name in index and not name.endswith('.log'):
+            continue
+        try:
+            st = os.stat(os.path.join(log_dir, name))
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        t = log_time(name)
+        index[name] = [t if t is not None else st.st_mtime, st.st_size, st.st_mtime]
+
+    if compress:
+        for name in sorted(filter(lambda x: x.endswith('.log') and x not in keep, list(index.keys()))):
+            t, size, mtime = index[name]
+            if now - mtime < COMPRESS_AFTER_SECONDS:
+                continue
+            compressed = _compress(log_dir, name)
+            if compressed is not None:
+                del index[name]
+                index[f"{name}.gz"] = [t, compressed, mtime]
+                messages.append(f"compressed log file: {name} ({size:,} -> {compressed:,} bytes)")
+
+    max_age_seconds = SECS_PER_DAY * retention_days
+    for name, (t, size, mtime) in sorted(index.items(), key=lambda x: x[1][0]):
+        if now - t > max_age_seconds and name not in keep and _remove(log_dir, name):
+            del index[name]
+            messages.append(f"deleting old log file: age={now - t:,.0f}s; log_file={name};")
+
+    if max_total_mb is not None:
+        total = sum(map(lambda x: x[1], index.values()))
+        for name, (t, size, mtime) in sorted(index.items(), key=lambda x: x[1][0]):
+            if total <= max_total_mb * 1024 * 1024:
+                break
+            if name not in keep and _remove(log_dir, name):
+                del index[name]
+                total = total - size
+                messages.append(f"deleting log file over log-max-total-mb: log_file={name}; size={size:,};")
+
+    atomic_write(index_file, json.dumps(index, sort_keys=True))
+    return messages
+
+
+def _read_index(index_file):
+    try:
+        with open(index_file, 'rb') as f:
+            index = json.loads(f.read().decode('utf-8'))
+        return index if isinstance(index, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _compress(log_dir, name):
+    """gzip a log next to itself and remove the original; returns the compressed size, or None."""
+    src = os.path.join(log_dir, name)
+    tmp = f"{src}.gz.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(src, 'rb') as f_in, gzip.open(tmp, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, f"{src}.gz")
+        os.remove(src)
+        return os.path.getsize(f"{src}.gz")
+    except OSError:
+        # e.g. compressed by another process sharing the log directory
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+
+def _remove(log_dir, name):
+    try:
+        os.remove(os.path.join(log_dir, name))
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+# restic --json summary fields exported per backup target.
+BACKUP_SUMMARY_FIELDS = ["files_new", "files_changed", "files_unmodified",
+                         "dirs_new", "dirs_changed", "dirs_unmodified",
+                         "data_blobs", "tree_blobs", "data_added",
+                         "total_files_processed", "total_bytes_processed", "total_duration"]
+
+# restic stats --json fields exported for the repository.
+STATS_FIELDS = ["total_size", "total_file_count", "total_blob_count", "snapshots_count"]
+
+
+class RunRecord:
+    """
+    Machine-readable record of one run: phase timings, restic calls and the restic --json summaries.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+        self.command = None
+        self.repository = None
+        self.ok = None
+        self.phases = []
+        self.restic_calls = []
+        self.backup_summaries = {}
+        self.forget_summaries = []
+        self.stats = None
+        self.checks = []
+        self.cache_bytes = None
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds, ok=True):
+        with self._lock:
+            self.phases.append({'name': name, 'seconds': seconds, 'ok': ok})
+
+    def add_restic_call(self, command, target, seconds, return_code, attempt=1, outcome=None):
+        with self._lock:
+            self.restic_calls.append({'command': command, 'target': target, 'seconds': seconds,
+                                      'return_code': return_code, 'attempt': attempt, 'outcome': outcome})
+
+    def add_backup_summary(self, target, summary):
+        with self._lock:
+            self.backup_summaries[target] = summary
+
+    def add_forget_summary(self, summary):
+        with self._lock:
+            self.forget_summaries.append(summary)
+
+    def add_check(self, check):
+        with self._lock:
+            self.checks.append(check)
+
+    def set_stats(self, stats):
+        with self._lock:
+            self.stats = stats
+
+    def set_cache_bytes(self, cache_bytes):
+        with self._lock:
+            self.cache_bytes = cache_bytes
+
+    def finish(self, ok):
+        self.end_time = time.time()
+        self.ok = ok
+
+    def to_dict(self):
+        return {
+            'command': self.command,
+            'repository': self.repository,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'seconds': (self.end_time or time.time()) - self.start_time,
+            'ok': self.ok,
+            'phases': self.phases,
+            'restic_calls': self.restic_calls,
+            'backup_summaries': self.backup_summaries,
+            'forget_summaries': self.forget_summaries,
+            'stats': self.stats,
+            'checks': self.checks,
+            'cache_bytes': self.cache_bytes,
+        }
+
+
+_run = contextvars.ContextVar('run_record', default=RunRecord())
+
+
+def current_run():
+    return _run.get()
+
+
+def start_run():
+    """Start a new run record for the current context (e.g. one configuration in fleet mode)."""
+    run = RunRecord()
+    _run.set(run)
+    return run
+
+
+class _Phase:
+
+    def __init__(self):
+        self.ok = True
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a block and record it as a phase of the current run; set ok = False on the yielded phase if it failed."""
+    start = time.perf_counter()
+    p = _Phase()
+    completed = False
+    try:
+        yield p
+        completed = True
+    finally:
+        current_run().add_phase(name, time.perf_counter() - start, completed and p.ok is not False)
+
+
+def parse_json_line(line):
+    """Parse one line of restic --json output, returning None for anything that is not json."""
+    stripped = line.strip()
+    if not stripped.startswith(('{', '[')):
+        return None
+    try:
+        return json.loads(stripped)
+    except ValueError:
+        return None
+
+
+def write_run_record(path, run):
+    atomic_write(path, json.dumps(run.to_dict(), indent=2))
+
+
+def write_textfile(path, run):
+    """Write the run as a Prometheus node-exporter textfile."""
+    repo = {'repository': run.repository}
+    lines = []
+    _metric(lines, 'restic_run_timestamp_seconds', 'gauge', 'Start time of the last run.',
+            [(dict(repo, command=run.command), run.start_time)])
+    _metric(lines, 'restic_run_success', 'gauge', '1 if the last run succeeded.',
+            [(dict(repo, command=run.command), 1 if run.ok else 0)])
+    _metric(lines, 'restic_run_duration_seconds', 'gauge', 'Duration of the last run.',
+            [(dict(repo, command=run.command), (run.end_time or time.time()) - run.start_time)])
+    _metric(lines, 'restic_phase_duration_seconds', 'gauge', 'Duration of each phase of the last run.',
+            list(map(lambda x: (dict(repo, phase=x['name']), x['seconds']), run.phases)))
+    for field in BACKUP_SUMMARY_FIELDS:
+        samples = []
+        for target, summary in run.backup_summaries.items():
+            if field in summary:
+                samples.append((dict(repo, path=target), summary[field]))
+        _metric(lines, f'restic_backup_{field}', 'gauge', f'restic backup summary {field}.', samples)
+    for check in run.checks:
+        labels = dict(repo, slice=check['slice'], slices=check['slices'])
+        _metric(lines, 'restic_check_duration_seconds', 'gauge', 'Duration of the last check slice.',
+                [(labels, check['seconds'])])
+        _metric(lines, 'restic_check_read_bytes_estimate', 'gauge',
+                'Estimated pack data read by the last check slice.', [(labels, check['bytes_read_estimate'])])
+        _metric(lines, 'restic_check_success', 'gauge', '1 if the last check slice succeeded.',
+                [(labels, 1 if check['ok'] else 0)])
+    if run.stats is not None:
+        for field in STATS_FIELDS:
+            if field in run.stats:
+                _metric(lines, f'restic_repository_{field}', 'gauge', f'restic stats {field}.',
+                        [(repo, run.stats[field])])
+    if run.cache_bytes is not None:
+        _metric(lines, 'restic_cache_bytes', 'gauge', 'Size of the restic cache directory.',
+                [(repo, run.cache_bytes)])
+    atomic_write(path, ''.join(lines))
+
+
+def atomic_write(path, text):
+    """Write text to path so readers see either the old or the new file, never a partial one."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _metric(lines, name, metric_type, help_text, samples):
+    if len(samples) == 0:
+        return
+    lines.append(f"# HELP {name} {help_text}\n")
+    lines.append(f"# TYPE {name} {metric_type}\n")
+    for labels, value in samples:
+        label_text = ','.join(map(lambda x: f'{x[0]}="{_escape(x[1])}"', sorted(labels.items())))
+        lines.append(f"{name}{{{label_text}}} {value}\n")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,60 @@
+import hashlib
+import threading
+from restic.state import read_state, update_state
+
+
+class ParentCache:
+    """
+    Snapshot ID of the last backup of each target, passed to the next backup as '--parent' so restic
+    does not depend on host name and path matching to find it.  An entry is ignored once the target's
+    excludes change.  Saving merges this run's changes into the file, which other configurations of the same
+    repository may have saved meanwhile.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.parents = read_state(config, 'parents')
+        # target -> entry put in this run, or None if removed
+        self._changes = {}
+        self._lock = threading.Lock()
+
+    def get(self, target, excludes):
+        with self._lock:
+            entry = self.parents.get(target)
+            if entry is None or entry.get('excludes') != excludes_hash(excludes):
+                return None
+            return entry.get('snapshot_id')
+
+    def put(self, target, excludes, snapshot_id):
+        with self._lock:
+            self.parents[target] = {'snapshot_id': snapshot_id, 'excludes': excludes_hash(excludes)}
+            self._changes[target] = self.parents[target]
+
+    def remove(self, target):
+        with self._lock:
+            self.parents.pop(target, None)
+            self._changes[target] = None
+
+    def save(self):
+        with self._lock:
+            changes = dict(self._changes)
+
+        def merge(state):
+            for target, entry in changes.items():
+                if entry is None:
+                    state.pop(target, None)
+                else:
+                    state[target] = entry
+
+        update_state(self.config, 'parents', merge)
+
+
+def excludes_hash(excludes):
+    return hashlib.sha1('\0'.join(excludes).encode('utf-8')).hexdigest()
+
+
+def is_parent_error(output):
+    """True if restic failed because the --parent snapshot could not be found or loaded."""
+    text = output.lower()
+    return 'parent' in text and ('no matching id' in text or 'not found' in text or 'unable to load' in text
+                                 or 'failed to load' in text or 'error loading' in text)
@@ -0,0 +1,300 @@
+import glob
+import json
+import os
+import queue
+import re
+import stat
+import threading
+
+# Threads walking directories; the walk is bound by file system latency, not CPU.
+WALKERS = 16
+
+# Run records with backups read for historical throughput.
+HISTORY_RUNS = 20
+
+
+class ExcludeMatcher:
+    """
+    Approximation of restic's --exclude/--iexclude matching: '*', '?' and '[...]' within a path component,
+    '**' across components, absolute patterns anchored at the root and others matching at any depth.
+    """
+
+    def __init__(self, patterns, ipatterns=()):
+        self.regexes = list(filter(lambda x: x is not None,
+                                   [_combine(patterns, '(?:/.*)?', 0), _combine(ipatterns, '(?:/.*)?', re.IGNORECASE)]))
+        self.indexes = [_PatternIndex(patterns, False), _PatternIndex(ipatterns, True)]
+
+    def excluded(self, path):
+        return any(map(lambda x: x.match(path) is not None, self.regexes))
+
+    def excluded_entry(self, path):
+        """
+        Like excluded, for a path whose parent directory is known not to be excluded (a walk tests every directory
+        before entering it): only patterns matching the whole path, and of those only the ones whose last
+        component can match the path's name, need to be tried.
+        """
+        name = path[path.rfind('/') + 1:]
+        return any(map(lambda x: x.matches(path, name), self.indexes))
+
+
+class _PatternIndex:
+    """
+    Patterns by their last component: literal names, '*suffix' and 'prefix*' are looked up by the name of a
+    path, so a path is matched against the few patterns that can match it rather than against all of them.
+    """
+
+    def __init__(self, patterns, ignore_case):
+        self.ignore_case = ignore_case
+        flags = re.IGNORECASE if ignore_case else 0
+        names = {}
+        suffixes = {}
+        prefixes = {}
+        other = []
+        for pattern in patterns:
+            parts = list(filter(lambda x: x != '', pattern.strip('/').split('/')))
+            last = parts[-1] if len(parts) > 0 else '**'
+            if last != '**' and _literal(last):
+                names.setdefault(self._key(last), []).append(pattern)
+            elif last.startswith('*') and _literal(last[1:]) and len(last) > 1:
+                suffixes.setdefault(self._key(last[1:]), []).append(pattern)
+            elif last.endswith('*') and _literal(last[:-1]) and len(last) > 1:
+                prefixes.setdefault(self._key(last[:-1]), []).append(pattern)
+            else:
+                other.append(pattern)
+        self.names = dict(map(lambda x: (x[0], _combine(x[1], '', flags)), names.items()))
+        self.suffixes = dict(map(lambda x: (x[0], _combine(x[1], '', flags)), suffixes.items()))
+        self.prefixes = dict(map(lambda x: (x[0], _combine(x[1], '', flags)), prefixes.items()))
+        self.suffix_lengths = sorted(set(map(len, self.suffixes.keys())))
+        self.prefix_lengths = sorted(set(map(len, self.prefixes.keys())))
+        self.other = _combine(other, '', flags)
+
+    def _key(self, text):
+        return text.lower() if self.ignore_case else text
+
+    def matches(self, path, name):
+        name = self._key(name)
+        candidates = [self.names.get(name), self.other]
+        for n in self.suffix_lengths:
+            if n <= len(name):
+                candidates.append(self.suffixes.get(name[len(name) - n:]))
+        for n in self.prefix_lengths:
+            if n <= len(name):
+                candidates.append(self.prefixes.get(name[:n]))
+        return any(map(lambda x: x is not None and x.match(path) is not None, candidates))
+
+
+class WalkResult:
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.excluded = 0
+        self.errors = 0
+
+    def add(self, other):
+        self.files = self.files + other.files
+        self.bytes = self.bytes + other.bytes
+        self.excluded = self.excluded + other.excluded
+        self.errors = self.errors + other.errors
+
+
+def read_excludes_file(file):
+    """Patterns of an excludes file the way restic reads them: environment variables expanded, '#' comments."""
+    with open(file, encoding='utf-8') as f:
+        lines = map(lambda x: os.path.expandvars(x.strip()), f.readlines())
+    return list(filter(lambda x: x != '' and not x.startswith('#'), lines))
+
+
+def walk(paths, matcher, walkers=WALKERS):
+    """
+    Count the files and bytes restic would back up from paths, with several threads walking directories
+    concurrently.  Like restic --one-file-system, mount points below a path are not crossed.
+    """
+    work = queue.Queue()
+    results = []
+    lock = threading.Lock()
+    total = WalkResult()
+    for root in paths:
+        try:
+            st = os.lstat(root)
+        except OSError:
+            total.errors = total.errors + 1
+            continue
+        if matcher.excluded(root):
+            total.excluded = total.excluded + 1
+        elif stat.S_ISDIR(st.st_mode):
+            work.put((root, st.st_dev))
+        else:
+            total.files = total.files + 1
+            total.bytes = total.bytes + st.st_size
+
+    def walker():
+        result = WalkResult()
+        with lock:
+            results.append(result)
+        while True:
+            item = work.get()
+            if item is None:
+                work.task_done()
+                return
+            directory, dev = item
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            result.errors = result.errors + 1
+                            continue
+                        if matcher.excluded_entry(entry.path):
+                            result.excluded = result.excluded + 1
+                        elif stat.S_ISDIR(st.st_mode):
+                            if st.st_dev == dev:
+                                work.put((entry.path, dev))
+                        else:
+                            result.files = result.files + 1
+                            result.bytes = result.bytes + st.st_size
+            except OSError:
+                result.errors = result.errors + 1
+            work.task_done()
+
+    threads = list(map(lambda x: threading.Thread(target=walker, daemon=True), range(walkers)))
+    for t in threads:
+        t.start()
+    work.join()
+    for t in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    for r in results:
+        total.add(r)
+    return total
+
+
+def overlaps(targets):
+    """
+    Pairs (outer, inner) of backup targets where a path of inner lies below a path of outer and is not
+    excluded from it, so it is read twice.  targets is a list of (name, paths, matcher).
+    """
+    found = []
+    for outer_name, outer_paths, outer_matcher in targets:
+        for inner_name, inner_paths, inner_matcher in targets:
+            for outer in outer_paths:
+                for inner in inner_paths:
+                    if inner != outer and inner.startswith(outer.rstrip('/') + '/') and \
+                            not _excluded_below(outer, inner, outer_matcher):
+                        found.append((outer_name, inner_name, outer, inner))
+    return found
+
+
+class History:
+    """Throughput and data added per backup target from previous run records."""
+
+    def __init__(self, log_dir, runs=HISTORY_RUNS):
+        self.summaries = {}
+        self.bytes = 0
+        self.seconds = 0
+        records = []
+        for file in sorted(glob.glob(os.path.join(glob.escape(log_dir), '*.run.json')), reverse=True):
+            try:
+                with open(file, 'rb') as f:
+                    record = json.loads(f.read().decode('utf-8'))
+            except (OSError, ValueError):
+                continue
+            if isinstance(record, dict) and record.get('backup_summaries'):
+                records.insert(0, record)
+                if len(records) >= runs:
+                    break
+        for record in records:
+            for target, summary in record['backup_summaries'].items():
+                self.summaries.setdefault(target, []).append(summary)
+                self.bytes = self.bytes + summary.get('total_bytes_processed', 0)
+                self.seconds = self.seconds + summary.get('total_duration', 0)
+
+    def throughput(self):
+        """Bytes per second over all previous backups, or None."""
+        return self.bytes / self.seconds if self.seconds > 0 else None
+
+    def estimate(self, target, bytes_to_scan):
+        """(bytes uploaded, seconds) for a backup of target, from its own history or the overall throughput."""
+        summaries = self.summaries.get(target)
+        if summaries:
+            last = summaries[-1]
+            added = sorted(map(lambda x: x.get('data_added', 0), summaries))[len(summaries) // 2]
+            processed = last.get('total_bytes_processed', 0)
+            seconds = last.get('total_duration', 0)
+            if processed > 0:
+                seconds = seconds * bytes_to_scan / processed
+            return added, seconds
+        # never backed up: everything is new
+        rate = self.throughput()
+        return bytes_to_scan, bytes_to_scan / rate if rate is not None else None
+
+
+def _excluded_below(outer, inner, matcher):
+    path = inner
+    while len(path) > len(outer):
+        if matcher.excluded(path):
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def _combine(patterns, suffix, flags):
+    """One regular expression matching a path matched by any of patterns, followed by suffix; None without any."""
+    if len(patterns) == 0:
+        return None
+    translated = list(map(_translate, patterns))
+    anchored = list(map(lambda x: x[1], filter(lambda x: x[0], translated)))
+    floating = list(map(lambda x: x[1], filter(lambda x: not x[0], translated)))
+    alternatives = []
+    if len(anchored) > 0:
+        alternatives.append('/(?:' + '|'.join(anchored) + ')')
+    if len(floating) > 0:
+        alternatives.append('(?:.*/)?(?:' + '|'.join(floating) + ')')
+    return re.compile(f"^(?:{'|'.join(alternatives)}){suffix}$", flags)
+
+
+def _literal(component):
+    return not any(map(lambda x: x in component, '*?[\\'))
+
+
+def _translate(pattern):
+    """(absolute, regular expression for the path below the root or any directory) of a pattern."""
+    absolute = pattern.startswith('/')
+    parts = list(filter(lambda x: x != '', pattern.strip('/').split('/')))
+    regex = ''
+    for i, part in enumerate(parts):
+        if part == '**':
+            regex = regex + '(?:[^/]*(?:/[^/]*)*)?'
+        else:
+            regex = regex + _translate_component(part)
+        if i < len(parts) - 1:
+            regex = regex + '/?' if part == '**' else regex + '/'
+    return absolute, regex
+
+
+def _translate_component(part):
+    regex = ''
+    i = 0
+    while i < len(part):
+        c = part[i]
+        if c == '*':
+            regex = regex + '[^/]*'
+        elif c == '?':
+            regex = regex + '[^/]'
+        elif c == '[':
+            end = part.find(']', i + 1)
+            if end < 0:
+                regex = regex + re.escape(c)
+            else:
+                body = part[i + 1:end]
+                regex = regex + '[' + ('^' + body[1:] if body.startswith('!') else body) + ']'
+                i = end
+        elif c == '\\' and i + 1 < len(part):
+            i = i + 1
+            regex = regex + re.escape(part[i])
+        else:
+            regex = regex + re.escape(c)
+        i = i + 1
+    return regex
@@ -0,0 +1,120 @@
+import codecs
+import collections
+import subprocess
+import sys
+import threading
+import time
+from restic.logging import write_output
+
+# Upper bound on a single read from the child.  Very long lines (restic can print
+# huge json documents on a single line) are written through in pieces of this size.
+CHUNK_SIZE = 64 * 1024
+
+# Longest output line (in bytes) handed to a line handler, e.g. for parsing restic --json output.
+MAX_HANDLED_LINE = 16 * 1024 * 1024
+
+# Number of output lines kept in memory for error reporting.
+TAIL_LINES = 50
+
+# Maximum number of seconds output may sit in the stdout buffer before a flush.
+FLUSH_INTERVAL_SECONDS = 1.0
+
+# Seconds between terminating a process that timed out and killing it.
+KILL_GRACE_SECONDS = 30
+
+
+class ProcessResult:
+
+    def __init__(self, return_code, tail, timed_out=False):
+        self.return_code = return_code
+        self.tail = tail
+        self.timed_out = timed_out
+
+    def ok(self):
+        return self.return_code == 0
+
+
+def run_streaming(subprocess_args, env=None, stdin=None, pass_fds=(), line_handler=None, on_start=None,
+                  timeout=None):
+    """
+    Run a process, writing its combined stdout/stderr to sys.stdout as it is produced.
+
+    Memory use is constant: output is read in bounded chunks and only the last
+    TAIL_LINES lines are retained (for error reporting) in the returned ProcessResult.
+
+    If given, line_handler is called with every complete output line of at most
+    MAX_HANDLED_LINE bytes; when it returns False the line is not written to stdout.
+    Longer lines are written through without being handed to line_handler.
+
+    If given, on_start is called with the Popen object as soon as the process is started.
+
+    A process still running after timeout seconds is terminated (and killed KILL_GRACE_SECONDS later);
+    the result is then marked timed_out.
+    """
+    tail = collections.deque(maxlen=TAIL_LINES)
+    last_flush = time.monotonic()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = []
+    pending_size = 0
+    passthrough = line_handler is None
+
+    def emit(text):
+        write_output(text)
+        tail.append(text)
+
+    with subprocess.Popen(subprocess_args,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          env=env,
+                          stdin=stdin,
+                          pass_fds=pass_fds
+                          ) as p:
+        timer = None
+        timed_out = threading.Event()
+        if timeout is not None:
+            timer = threading.Timer(timeout, _stop, args=(p, timed_out))
+            timer.daemon = True
+            timer.start()
+        if on_start is not None:
+            on_start(p)
+        for chunk in iter(lambda: p.stdout.readline(CHUNK_SIZE), b''):
+            text = decoder.decode(chunk)
+            end_of_line = chunk.endswith(b'\n')
+            if passthrough:
+                emit(text)
+                passthrough = line_handler is None or not end_of_line
+            else:
+                pending.append(text)
+                pending_size = pending_size + len(chunk)
+                if end_of_line:
+                    line = ''.join(pending)
+                    if line_handler(line) is not False:
+                        emit(line)
+                    pending, pending_size = [], 0
+                elif pending_size > MAX_HANDLED_LINE:
+                    emit(''.join(pending))
+                    pending, pending_size, passthrough = [], 0, True
+            now = time.monotonic()
+            if now - last_flush >= FLUSH_INTERVAL_SECONDS:
+                sys.stdout.flush()
+                last_flush = now
+        if len(pending) > 0:
+            line = ''.join(pending)
+            if line_handler(line) is not False:
+                emit(line)
+        return_code = p.wait()
+        if timer is not None:
+            timer.cancel()
+    sys.stdout.flush()
+    if timed_out.is_set():
+        tail.append(f"timed out after {timeout:,.0f} seconds\n")
+    return ProcessResult(return_code, ''.join(tail), timed_out.is_set())
+
+
+def _stop(p, timed_out):
+    timed_out.set()
+    p.terminate()
+    try:
+        p.wait(KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        p.kill()
@@ -0,0 +1,73 @@
+import hashlib
+import random
+import time
+
+SECS_PER_DAY = 60 * 60 * 24
+
+# Days hosts are spread over when a prune-schedule has no max-interval-days.
+STAGGER_DAYS = 7
+
+
+def prune_wanted(config, state, now, host, interval=False):
+    """
+    Whether forget/prune run in this run of config: as its prune-schedule decides, else always on the daemon's
+    prune interval (interval), else by the prune-policy coin flip.  Returns (due, reason or None).
+    """
+    if config.prune_schedule is not None:
+        return prune_due(config.prune_schedule, state, now, host)
+    if interval:
+        return True, "daemon prune interval"
+    return config.prune_policy != 0 and random.random() <= config.prune_policy, None
+
+
+def prune_due(schedule, state, now, host):
+    """
+    Decide whether forget/prune/check should run now.  Returns (due, reason).
+
+    state is the persisted prune state: 'last_prune_time', 'size_at_last_prune' and 'last_total_size'
+    (restic stats --mode raw-data total_size).  Prune is due when none was recorded, the repository grew by at
+    least bytes-added-threshold since the last prune, or max-interval-days passed.  With stagger, hosts sharing a
+    repository run a due prune on different days: each host gets a fixed day of the stagger interval
+    (max-interval-days, or STAGGER_DAYS without it), derived from its host name, until the last prune is two
+    max-interval-days ago.  Nothing runs outside the window or within min-interval-days of the last prune.
+    """
+    if schedule.window is not None and not in_window(schedule.window, now):
+        return False, "outside prune window"
+    last_prune = state.get('last_prune_time')
+    if last_prune is None:
+        return _staggered(schedule, now, host, "no prune recorded", False)
+    elapsed_days = (now - last_prune) / SECS_PER_DAY
+    if elapsed_days < schedule.min_interval_days:
+        return False, f"last prune {elapsed_days:.1f} days ago, min-interval-days={schedule.min_interval_days}"
+    overdue = schedule.max_interval_days is not None and elapsed_days >= 2 * schedule.max_interval_days
+    if schedule.bytes_added_threshold is not None:
+        added = state.get('last_total_size', 0) - state.get('size_at_last_prune', 0)
+        if added >= schedule.bytes_added_threshold:
+            return _staggered(schedule, now, host, f"{added:,} bytes added since last prune", overdue)
+    if schedule.max_interval_days is not None and elapsed_days >= schedule.max_interval_days:
+        return _staggered(schedule, now, host, f"last prune {elapsed_days:.1f} days ago", overdue)
+    return False, f"last prune {elapsed_days:.1f} days ago, nothing to do"
+
+
+def _staggered(schedule, now, host, reason, overdue):
+    if not schedule.stagger or overdue:
+        return True, reason
+    interval = schedule.max_interval_days or STAGGER_DAYS
+    slot = host_slot(host, interval)
+    if int(now // SECS_PER_DAY) % interval == slot:
+        return True, f"{reason}, staggered day {slot} of {interval}"
+    return False, f"{reason}, waiting for staggered day {slot} of {interval}"
+
+
+def host_slot(host, interval):
+    """Deterministic day within an interval for a host."""
+    return int(hashlib.sha1(host.encode('utf-8')).hexdigest(), 16) % interval
+
+
+def in_window(window, now):
+    t = time.localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
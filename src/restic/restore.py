@@ -0,0 +1,161 @@
+import heapq
+import os
+import re
+import threading
+import time
+
+# Per-file cost, in bytes, when balancing shards: many small files take longer than their size suggests.
+FILE_COST_BYTES = 64 * 1024
+
+# Units per shard to aim for before packing, so large subtrees are split and shards come out even.
+UNITS_PER_SHARD = 8
+
+# A partly restored unit lists its missing files individually up to this many, otherwise it is restored whole.
+MAX_FILE_INCLUDES = 10000
+
+
+class RestoreUnit:
+    """A subtree (or single entry) restored as one --include, with the entries below it."""
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+        self.files = len(list(filter(lambda x: x.type == 'file', entries)))
+        self.bytes = sum(map(lambda x: x.size or 0, filter(lambda x: x.type == 'file', entries)))
+
+    def cost(self):
+        return self.bytes + self.files * FILE_COST_BYTES
+
+
+class Shard:
+
+    def __init__(self):
+        self.includes = []
+        self.files = 0
+        self.bytes = 0
+
+    def cost(self):
+        return self.bytes + self.files * FILE_COST_BYTES
+
+
+class RestorePlan:
+
+    def __init__(self, shards, skipped_files, skipped_bytes):
+        self.shards = shards
+        self.skipped_files = skipped_files
+        self.skipped_bytes = skipped_bytes
+        self.files = sum(map(lambda x: x.files, shards))
+        self.bytes = sum(map(lambda x: x.bytes, shards))
+
+
+def plan_restore(entries, root, target, shards):
+    """
+    Split the snapshot entries at or below root into at most shards restores of similar size.  Subtrees are
+    split until they are small enough to balance, and files already restored below target with the same size
+    and mtime are left out, so an interrupted restore resumes where it stopped.
+    """
+    root = root.rstrip('/') if root != '/' else ''
+    units = split_units(entries, root, shards * UNITS_PER_SHARD)
+    pending = []
+    skipped_files = 0
+    skipped_bytes = 0
+    for unit in units:
+        missing = list(filter(lambda x: not is_restored(x, target), unit.entries))
+        missing_ids = set(map(id, missing))
+        done = list(filter(lambda x: x.type == 'file' and id(x) not in missing_ids, unit.entries))
+        skipped_files = skipped_files + len(done)
+        skipped_bytes = skipped_bytes + sum(map(lambda x: x.size or 0, done))
+        if len(missing) == 0:
+            continue
+        if len(done) == 0 or len(missing) > MAX_FILE_INCLUDES:
+            pending.append(unit)
+        else:
+            pending.extend(map(lambda x: RestoreUnit(x.path, [x]), filter(lambda x: x.type != 'dir', missing)))
+            pending.extend(map(lambda x: RestoreUnit(x.path, [x]), filter(_is_empty_dir(unit.entries), missing)))
+    return RestorePlan(pack(pending, shards), skipped_files, skipped_bytes)
+
+
+def split_units(entries, root, min_units):
+    """
+    Group entries into subtrees directly below root, then replace the largest subtree by its children until
+    there are min_units (or nothing left to split).
+    """
+    below = list(filter(lambda x: x.path != root, entries))
+    units = _group(below if len(below) > 0 else entries, root)
+    final = []
+    while len(units) > 0 and len(units) + len(final) < min_units:
+        largest = max(units, key=lambda x: x.cost())
+        units.remove(largest)
+        children = _group(list(filter(lambda x: x.path != largest.path, largest.entries)), largest.path)
+        if len(children) == 0:
+            final.append(largest)
+        else:
+            units.extend(children)
+    return units + final
+
+
+def pack(units, shards):
+    """Pack units into at most shards shards, largest first onto the least loaded shard."""
+    heap = list(map(lambda x: (0, x, Shard()), range(min(shards, len(units)))))
+    for unit in sorted(units, key=lambda x: -x.cost()):
+        cost, i, shard = heapq.heappop(heap)
+        shard.includes.append(unit.path)
+        shard.files = shard.files + unit.files
+        shard.bytes = shard.bytes + unit.bytes
+        heapq.heappush(heap, (shard.cost(), i, shard))
+    return list(map(lambda x: x[2], sorted(heap, key=lambda x: x[1])))
+
+
+def is_restored(entry, target):
+    """True if entry exists below target; files must also have the same size and mtime."""
+    path = os.path.join(target, entry.path.lstrip('/'))
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if entry.type != 'file':
+        return True
+    return entry.mtime is not None and st.st_size == entry.size and abs(st.st_mtime - entry.mtime) < 0.001
+
+
+def include_pattern(path):
+    """restic --include pattern matching exactly path."""
+    return re.sub(r'([*?\[\\])', r'\\\1', path)
+
+
+class RestoreProgress:
+    """Thread-safe progress and throughput of the shards of a restore."""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.files = 0
+        self.bytes = 0
+        self.shards = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def shard_done(self, shard):
+        with self._lock:
+            self.shards = self.shards + 1
+            self.files = self.files + shard.files
+            self.bytes = self.bytes + shard.bytes
+            seconds = time.perf_counter() - self.start
+            rate = self.bytes / seconds / (1024 * 1024) if seconds > 0 else 0
+            percent = 100 * self.bytes / self.plan.bytes if self.plan.bytes > 0 else 100
+            return (f"{self.shards}/{len(self.plan.shards)} shards, {self.files:,}/{self.plan.files:,} files, "
+                    f"{self.bytes:,}/{self.plan.bytes:,} bytes ({percent:,.0f}%), {rate:,.1f} MB/s")
+
+
+def _group(entries, root):
+    groups = {}
+    for e in entries:
+        rest = e.path[len(root):].lstrip('/')
+        key = root + '/' + rest.split('/', 1)[0] if rest != '' else e.path
+        groups.setdefault(key, []).append(e)
+    return list(map(lambda x: RestoreUnit(x[0], x[1]), groups.items()))
+
+
+def _is_empty_dir(entries):
+    paths = set(map(lambda x: x.path, entries))
+    parents = set(map(lambda x: os.path.dirname(x), paths))
+    return lambda x: x.type == 'dir' and x.path not in parents
@@ -0,0 +1,86 @@
+import random
+import re
+import time
+from restic.governor import RESTARTED, limit_args
+from restic.logging import banner
+from restic.metrics import current_run
+
+# restic exit codes
+EXIT_OK = 0
+EXIT_PARTIAL = 3
+EXIT_LOCKED = 11
+
+OK = 'ok'
+PARTIAL = 'partial'
+LOCKED = 'locked'
+NETWORK = 'network'
+TIMEOUT = 'timeout'
+FATAL = 'fatal'
+
+# outcomes worth another attempt
+TRANSIENT = [LOCKED, NETWORK, TIMEOUT]
+
+_LOCKED = re.compile(r'repository is already locked|unable to create lock', re.IGNORECASE)
+_NETWORK = re.compile(r'connection (refused|reset|closed|timed out)|broken pipe|i/o timeout|no route to host|'
+                      r'network is unreachable|temporary failure in name resolution|no such host|'
+                      r'tls handshake timeout|ssh command exited|subprocess ssh:|'
+                      # only on a connection: a truncated pack or file also reads as an unexpected EOF
+                      r'(?:tcp|https?|sftp)\b[^\n]*: unexpected eof',
+                      re.IGNORECASE)
+
+
+def classify(result):
+    """
+    Outcome of a restic call: ok; partial (backup made a snapshot but could not read some files); locked
+    (another process holds the repository lock); network; timeout; or fatal.
+    """
+    if result.timed_out:
+        return TIMEOUT
+    if result.return_code == EXIT_OK:
+        return OK
+    if result.return_code == EXIT_PARTIAL:
+        return PARTIAL
+    if result.return_code == EXIT_LOCKED or _LOCKED.search(result.tail):
+        return LOCKED
+    if _NETWORK.search(result.tail):
+        return NETWORK
+    return FATAL
+
+
+def backoff_seconds(policy, attempt, rand=random.random):
+    """Delay before the attempt after attempt (1, 2, ...): exponential, capped, with jitter."""
+    delay = min(policy.max_delay_seconds, policy.initial_delay_seconds * 2 ** (attempt - 1))
+    return delay / 2 + rand() * delay / 2
+
+
+def run_with_retries(policy, command, run_once, target=None, retryable=True, governor=None, sleep=time.sleep):
+    """
+    Call run_once() (returning a ProcessResult) until it succeeds.  An attempt that failed on a lock, the network
+    or a timeout is tried again with backoff, up to policy.attempts unless not retryable (restic reads stdin,
+    which can not be read again); one stopped by the governor at the end of its bandwidth window starts again
+    without counting as an attempt.  Every attempt is recorded in the run.  Returns the last result.
+    """
+    attempts = policy.attempts if retryable else 1
+    attempt = 0
+    while True:
+        attempt = attempt + 1
+        start = time.perf_counter()
+        result = run_once()
+        if governor is not None:
+            governor.done()
+        outcome = RESTARTED if governor is not None and governor.interrupted else classify(result)
+        current_run().add_restic_call(command, target, time.perf_counter() - start, result.return_code, attempt,
+                                      outcome)
+        if outcome == OK:
+            return result
+        if outcome == RESTARTED:
+            banner(f"{command} stopped at the end of its bandwidth window, restarting with "
+                   f"{' '.join(limit_args(governor.schedule, time.time())) or 'no limits'}")
+            attempt = attempt - 1
+            continue
+        banner(f"{command} FAILED ({outcome}): exit code {result.return_code}")
+        if outcome not in TRANSIENT or attempt >= attempts:
+            return result
+        delay = backoff_seconds(policy, attempt)
+        banner(f"retrying {command} in {delay:,.0f} seconds (attempt {attempt + 1} of {attempts})")
+        sleep(delay)
@@ -0,0 +1,133 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import threading
+import time
+from restic.logging import job_label, set_job_label
+
+_registry_lock = threading.Lock()
+_repository_locks = {}
+_done_operations = contextvars.ContextVar('done_operations', default=None)
+
+
+class Job:
+
+    def __init__(self, label, run, priority=0):
+        self.label = label
+        self.run = run
+        self.priority = priority
+
+
+class JobResult:
+
+    def __init__(self, label, ok, seconds, error=None):
+        self.label = label
+        self.ok = ok
+        self.seconds = seconds
+        self.error = error
+
+
+def run_jobs(jobs, max_parallel):
+    """
+    Run jobs, highest priority first, with at most max_parallel running at once.
+
+    A job's run() returns True on success.  When more than one job may run at once each job's
+    output is prefixed with its label.  Results are returned in the order the jobs were started.
+    """
+    ordered = sorted(jobs, key=lambda x: -x.priority)
+    prefix_output = max_parallel > 1 and len(ordered) > 1
+    parent_label = job_label()
+
+    def run_one(job):
+        if prefix_output:
+            set_job_label(job.label if parent_label is None else f"{parent_label}/{job.label}")
+        start = time.perf_counter()
+        try:
+            ok = job.run()
+            return JobResult(job.label, ok is not False, time.perf_counter() - start)
+        except Exception as e:
+            return JobResult(job.label, False, time.perf_counter() - start, error=e)
+
+    # each job runs in its own copy of the caller's context: run record, log file and output label
+    contexts = list(map(lambda x: (x, contextvars.copy_context()), ordered))
+    if max_parallel <= 1:
+        return list(map(lambda x: x[1].run(run_one, x[0]), contexts))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        return list(executor.map(lambda x: x[1].run(run_one, x[0]), contexts))
+
+
+class RepositoryLock:
+    """
+    Process-wide counterpart of restic's repository locks: any number of shared holders (backup) or one
+    exclusive holder (forget, prune, check...), so configurations sharing a repository do not fail on
+    each other's locks.  Waiting exclusive holders go first, so a stream of backups can not starve a prune.
+    A thread holding the lock shared can take it shared again, e.g. to start a command feeding restic before
+    restic itself takes the lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+        self._held = threading.local()
+
+    @contextlib.contextmanager
+    def shared(self):
+        depth = getattr(self._held, 'shared', 0)
+        if depth == 0:
+            with self._cond:
+                while self._exclusive or self._exclusive_waiting > 0:
+                    self._cond.wait()
+                self._shared = self._shared + 1
+        self._held.shared = depth + 1
+        try:
+            yield
+        finally:
+            self._held.shared = depth
+            if depth == 0:
+                with self._cond:
+                    self._shared = self._shared - 1
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._exclusive_waiting = self._exclusive_waiting + 1
+            while self._exclusive or self._shared > 0:
+                self._cond.wait()
+            self._exclusive_waiting = self._exclusive_waiting - 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+def repository_lock(repository):
+    with _registry_lock:
+        if repository not in _repository_locks:
+            _repository_locks[repository] = RepositoryLock()
+        return _repository_locks[repository]
+
+
+def start_shared_operations():
+    """Start tracking operations that only need to run once per repository (see first_time)."""
+    _done_operations.set(set())
+
+
+def first_time(repository, operation):
+    """
+    False if operation already ran on the repository since start_shared_operations() was called in this
+    context, e.g. when several configurations of a fleet share a repository and only one needs to prune it.
+    """
+    done = _done_operations.get()
+    if done is None:
+        return True
+    with _registry_lock:
+        if (repository, operation) in done:
+            return False
+        done.add((repository, operation))
+        return True
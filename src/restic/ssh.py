@@ -0,0 +1,138 @@
+import atexit
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Seconds to wait for the master connection to authenticate.
+CONNECT_TIMEOUT_SECONDS = 30
+
+# A master without clients for this long exits by itself, e.g. if this process was killed before it could stop it;
+# a master that failed to start is not tried again for as long.
+PERSIST_SECONDS = 600
+
+_SFTP_URL = re.compile(r'^sftp://(?:(?P<user>[^@/]+)@)?(?P<host>\[[^\]]+]|[^:/]+)(?::(?P<port>\d+))?/')
+_SFTP_SHORT = re.compile(r'^sftp:(?:(?P<user>[^@:/]+)@)?(?P<host>\[[^\]]+]|[^:/]+):')
+
+_lock = threading.Lock()
+_masters = {}
+_directory = None
+_count = 0
+
+
+class SshTarget:
+
+    def __init__(self, user, host, port):
+        self.user = user
+        self.host = host.strip('[]')
+        self.port = port
+
+    def key(self):
+        return self.user, self.host, self.port
+
+    def args(self):
+        """ssh arguments selecting the host, the way restic passes them."""
+        port_args = ['-p', self.port] if self.port is not None else []
+        user_args = ['-l', self.user] if self.user is not None else []
+        return port_args + user_args + [self.host]
+
+
+class SshMaster:
+    """An ssh ControlMaster connection restic's sftp connections to one host are multiplexed over."""
+
+    def __init__(self, target, socket, env=None):
+        self.target = target
+        self.socket = socket
+        self.env = env
+        self.error = None
+        self.failed_at = None
+
+    def start(self):
+        """Connect and authenticate in the background; returns False (with error set) if that failed."""
+        command = ['ssh', '-o', 'ControlMaster=yes', '-o', f'ControlPath={self.socket}',
+                   '-o', f'ControlPersist={PERSIST_SECONDS}', '-o', 'BatchMode=yes',
+                   '-o', f'ConnectTimeout={CONNECT_TIMEOUT_SECONDS}', '-f', '-N'] + self.target.args()
+        # the backgrounded master keeps stderr open, so it goes to a file rather than a pipe
+        with tempfile.TemporaryFile() as err:
+            try:
+                result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=err,
+                                        env=self.env, timeout=CONNECT_TIMEOUT_SECONDS * 2)
+                ok = result.returncode == 0 and self.running()
+                err.seek(0)
+                self.error = None if ok else err.read().decode('utf-8', errors='replace').strip() or \
+                    f"ssh exit code {result.returncode}"
+                return ok
+            except (OSError, subprocess.TimeoutExpired) as e:
+                self.error = str(e)
+                return False
+
+    def running(self):
+        return os.path.exists(self.socket)
+
+    def sftp_command(self):
+        """Value for restic's -o sftp.command: ssh through the master, connecting directly if it is gone."""
+        return shlex.join(['ssh', '-o', 'ControlMaster=no', '-o', f'ControlPath={self.socket}'] +
+                          self.target.args() + ['-s', 'sftp'])
+
+    def stop(self):
+        if not self.running():
+            return
+        subprocess.run(['ssh', '-o', f'ControlPath={self.socket}', '-O', 'exit'] + self.target.args(),
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       env=self.env, timeout=CONNECT_TIMEOUT_SECONDS)
+
+
+def sftp_target(repository):
+    """The ssh user, host and port of an sftp: repository url, or None for other repositories."""
+    m = _SFTP_URL.match(repository) or _SFTP_SHORT.match(repository)
+    if m is None:
+        return None
+    return SshTarget(m.group('user'), m.group('host'), m.groupdict().get('port'))
+
+
+def sftp_master(repository, env=None):
+    """
+    The running master connection for the host of an sftp: repository, started on first use and shared by all
+    configurations of this process; None for other repositories or if it could not be started (restic then
+    connects as usual).  Returns (master, message), message describing a master just started or failed.
+    """
+    global _directory, _count
+    target = sftp_target(repository)
+    if target is None or os.name == 'nt' or shutil.which('ssh') is None:
+        return None, None
+    with _lock:
+        master = _masters.get(target.key())
+        if master is not None and master.error is None and master.running():
+            return master, None
+        if master is not None and master.error is not None and time.time() - master.failed_at < PERSIST_SECONDS:
+            return None, None
+        if _directory is None:
+            # socket paths are limited to ~100 characters, so the directory is kept short
+            _directory = tempfile.mkdtemp(prefix='restic-ssh-', dir='/tmp' if os.path.isdir('/tmp') else None)
+            atexit.register(stop_masters)
+        _count = _count + 1
+        master = SshMaster(target, os.path.join(_directory, f"{_count}.sock"), env)
+        _masters[target.key()] = master
+        if not master.start():
+            master.failed_at = time.time()
+            return None, f"ssh master connection to {target.host} FAILED, connecting per command: {master.error}"
+        return master, f"ssh master connection to {target.host} started"
+
+
+def stop_masters():
+    """Close the master connections and remove their sockets."""
+    global _directory
+    with _lock:
+        for master in _masters.values():
+            try:
+                master.stop()
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        _masters.clear()
+        if _directory is not None:
+            shutil.rmtree(_directory, ignore_errors=True)
+            _directory = None
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import threading
+from restic.metrics import atomic_write
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def repository_key(repository):
+    """Short, file-name safe key for a repository url."""
+    return hashlib.sha1(repository.encode('utf-8')).hexdigest()[:12]
+
+
+def state_file(config, name, extension='json'):
+    return os.path.join(config.state_directory_abs(), f"{name}-{repository_key(config.repository)}.{extension}")
+
+
+def read_state(config, name):
+    """Read a state document; a missing or unreadable file is an empty state."""
+    f = state_file(config, name)
+    if not os.path.isfile(f):
+        return {}
+    try:
+        with open(f, 'rb') as fp:
+            state = json.loads(fp.read().decode('utf-8'))
+        return state if isinstance(state, dict) else {}
+    except ValueError:
+        return {}
+
+
+def write_state(config, name, state):
+    atomic_write(state_file(config, name), json.dumps(state, indent=2, sort_keys=True))
+
+
+def state_lock(file):
+    """
+    Process-wide lock of a state file: configurations sharing a repository share its state files, so their
+    read-modify-write cycles must not interleave.
+    """
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(file), threading.Lock())
+
+
+def update_state(config, name, update):
+    """Read a state document, apply update(state) to it and write it back; returns the new state."""
+    with state_lock(state_file(config, name)):
+        state = read_state(config, name)
+        update(state)
+        write_state(config, name, state)
+        return state
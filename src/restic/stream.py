@@ -0,0 +1,216 @@
+import collections
+import contextvars
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from restic.logging import banner, write_output
+
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds restic gets to exit after SIGTERM before it is killed; its input stays open until then.
+TERMINATE_SECONDS = 30
+
+
+class SpillBuffer:
+    """
+    FIFO of byte chunks between a producer and a consumer.  Up to memory_limit bytes are held in memory;
+    beyond that up to spool_limit bytes are spooled to a temporary file, after which put() blocks.
+    """
+
+    def __init__(self, memory_limit, spool_limit=0, spool_dir=None):
+        self.memory_limit = memory_limit
+        self.spool_limit = spool_limit
+        self.spool_dir = spool_dir
+        self.spooled_bytes = 0
+        self._chunks = collections.deque()
+        self._memory = 0
+        self._file = None
+        self._write_pos = 0
+        self._read_pos = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, data):
+        with self._cond:
+            while True:
+                if self._file is None and self._memory + len(data) <= max(self.memory_limit, len(data)):
+                    self._chunks.append(data)
+                    self._memory = self._memory + len(data)
+                    break
+                if self._write_pos - self._read_pos + len(data) <= self.spool_limit:
+                    if self._file is None:
+                        self._file = tempfile.TemporaryFile(dir=self.spool_dir)
+                    self._file.seek(self._write_pos)
+                    self._file.write(data)
+                    self._write_pos = self._write_pos + len(data)
+                    self.spooled_bytes = self.spooled_bytes + len(data)
+                    break
+                self._cond.wait()
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self):
+        """Next chunk, or None once the buffer is closed and empty."""
+        with self._cond:
+            while len(self._chunks) == 0 and self._read_pos == self._write_pos and not self._closed:
+                self._cond.wait()
+            data = None
+            if len(self._chunks) > 0:
+                data = self._chunks.popleft()
+                self._memory = self._memory - len(data)
+            elif self._read_pos < self._write_pos:
+                self._file.seek(self._read_pos)
+                data = self._file.read(min(CHUNK_SIZE, self._write_pos - self._read_pos))
+                self._read_pos = self._read_pos + len(data)
+                if self._read_pos == self._write_pos:
+                    self._file.close()
+                    self._file = None
+                    self._read_pos = self._write_pos = 0
+            self._cond.notify_all()
+            return data
+
+
+class CommandStream:
+    """
+    Streams a backup command's stdout into restic's stdin: optional compression, a bounded buffer so the
+    command is not throttled by a slow repository, byte counts and throughput, and the command's stderr
+    in the log.  If the command exits non-zero restic is terminated (killed if it does not exit) before it
+    sees end of input, so no snapshot is written from truncated output.
+    """
+
+    def __init__(self, bc):
+        self.bc = bc
+        self.compressor = _compressor(bc.compression, bc.compression_level)
+        self.buffer = SpillBuffer(bc.buffer_mb * 1024 * 1024, bc.spool_mb * 1024 * 1024)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.producer = None
+        self.restic = None
+        self.error = None
+        self._read_fd = None
+        self._write_fd = None
+        self._threads = []
+        self._start_time = None
+
+    def start(self):
+        """Start the command; returns the file descriptor to use as restic's stdin."""
+        self._start_time = time.perf_counter()
+        self._read_fd, self._write_fd = os.pipe()
+        self.producer = subprocess.Popen(self.bc.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._start_thread(self._read_producer)
+        self._start_thread(self._log_stderr)
+        return self._read_fd
+
+    def attach(self, restic):
+        """Called once restic is running."""
+        self.restic = restic
+        os.close(self._read_fd)
+        self._read_fd = None
+        self._start_thread(self._write_restic)
+
+    def finish(self):
+        """Wait for the stream to end; returns True if the command succeeded and all of its output was sent."""
+        if self._read_fd is not None:
+            # restic never started: unblock and stop the command
+            os.close(self._read_fd)
+            self._read_fd = None
+            self.producer.kill()
+            self._start_thread(self._write_restic)
+        for t in self._threads:
+            t.join()
+        self.producer.stdout.close()
+        self.producer.stderr.close()
+        seconds = time.perf_counter() - self._start_time
+        rate = self.bytes_in / seconds / (1024 * 1024) if seconds > 0 else 0
+        banner(f"command stream: {self.bytes_in:,} bytes read, {self.bytes_out:,} bytes sent "
+               f"({self.bc.compression}), {self.buffer.spooled_bytes:,} bytes spooled, "
+               f"{seconds:,.1f} seconds, {rate:,.1f} MB/s")
+        if self.error is not None:
+            banner(f"command stream FAILED: {self.error}")
+        return self.error is None
+
+    def _start_thread(self, target):
+        t = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _read_producer(self):
+        try:
+            for chunk in iter(lambda: self.producer.stdout.read1(CHUNK_SIZE), b''):
+                self.bytes_in = self.bytes_in + len(chunk)
+                self._put(self.compressor.compress(chunk))
+            self._put(self.compressor.flush())
+        finally:
+            self.buffer.close()
+
+    def _put(self, data):
+        if len(data) > 0:
+            self.buffer.put(data)
+
+    def _log_stderr(self):
+        for line in iter(self.producer.stderr.readline, b''):
+            write_output(f"[{self.bc.repo_path} stderr] {line.decode('utf-8', errors='replace')}")
+
+    def _write_restic(self):
+        broken = False
+        try:
+            for data in iter(self.buffer.get, None):
+                if not broken:
+                    try:
+                        _write_all(self._write_fd, data)
+                        self.bytes_out = self.bytes_out + len(data)
+                    except OSError as e:
+                        # restic went away: stop the command, keep draining so the reader can finish
+                        broken = True
+                        self.error = f"restic stopped reading input: {e}"
+                        self.producer.kill()
+            return_code = self.producer.wait()
+            if return_code != 0 and self.error is None:
+                self.error = f"command exited with code {return_code}"
+            if self.error is not None and self.restic is not None:
+                self._stop_restic()
+        finally:
+            os.close(self._write_fd)
+
+    def _stop_restic(self):
+        # closing the pipe first could let restic read a clean end of input and commit a truncated snapshot
+        self.restic.terminate()
+        try:
+            self.restic.wait(TERMINATE_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.restic.kill()
+            self.restic.wait()
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while len(view) > 0:
+        view = view[os.write(fd, view):]
+
+
+class _Passthrough:
+
+    def compress(self, data): return data
+
+    def flush(self): return b''
+
+
+def _compressor(compression, level):
+    if compression == 'none':
+        return _Passthrough()
+    if compression == 'gzip':
+        return zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("compression 'zstd' requires the 'zstandard' python package")
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+    raise ValueError(f"unknown compression: '{compression}'")
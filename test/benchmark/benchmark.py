@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# ==============================================================================
+# Benchmarks for the wrapper's own overhead: backup.py is run against
+# fake-restic.py on synthetic configurations and wall time, peak RSS and the
+# number of restic processes spawned are reported.
+#
+# USAGE:
+#
+# ./benchmark.py                     all scenarios
+# ./benchmark.py backup-500 ls-1gb   selected scenarios
+# ./benchmark.py --list              list scenarios
+# ==============================================================================
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+backup_script = os.path.normpath(f"{bench_dir}/../../src/backup.py")
+fake_restic = f"{bench_dir}/fake-restic.py"
+
+MB = 1024 * 1024
+
+
+class Scenario:
+
+    def __init__(self, name, paths, sub_command, latency=0.0, output_bytes=0, lock_hold=0.0, config=None):
+        self.name = name
+        self.paths = paths
+        self.sub_command = sub_command
+        self.latency = latency
+        self.output_bytes = output_bytes
+        self.lock_hold = lock_hold
+        self.config = config if config is not None else {}
+
+
+SCENARIOS = [
+    Scenario('backup-1', 1, ['backup']),
+    Scenario('backup-50', 50, ['backup']),
+    Scenario('backup-500', 500, ['backup']),
+    Scenario('forget-1', 1, ['forget']),
+    Scenario('forget-50', 50, ['forget']),
+    Scenario('forget-500', 500, ['forget']),
+    Scenario('backup-prune-1', 1, ['backup-prune'], config={'prune-policy': 1}),
+    Scenario('backup-prune-50', 50, ['backup-prune'], config={'prune-policy': 1}),
+    Scenario('backup-prune-500', 500, ['backup-prune'], config={'prune-policy': 1}),
+    Scenario('backup-50-latency', 50, ['backup'], latency=0.05),
+    Scenario('backup-50-parallel', 50, ['backup'], latency=0.05, config={'max-parallel-backups': 8}),
+    Scenario('backup-prune-50-locks', 50, ['backup-prune'], lock_hold=0.2, config={'prune-policy': 1}),
+    Scenario('backup-1-100mb', 1, ['backup'], output_bytes=100 * MB),
+    Scenario('ls-1gb', 1, ['ls', 'latest'], output_bytes=1024 * MB),
+    Scenario('ls-4gb', 1, ['ls', 'latest'], output_bytes=4096 * MB),
+]
+
+
+class Result:
+
+    def __init__(self, scenario, seconds, peak_rss_kb, spawns, return_code):
+        self.scenario = scenario
+        self.seconds = seconds
+        self.peak_rss_kb = peak_rss_kb
+        self.spawns = spawns
+        self.return_code = return_code
+
+
+def write_config(work_dir, scenario):
+    config = {
+        "repository": "sftp:restic@benchmark.example.com:restic-repos/benchmark",
+        "password": "benchmark-password",
+        "log-directory": f"{work_dir}/logs",
+        "restic-path": fake_restic,
+        "forget-policy": ["--keep-daily", "7"],
+        # the repository host does not exist, so do not let ssh try to open a master connection to it
+        "ssh-multiplexing": False,
+        "environment": {
+            "PATH": os.environ.get('PATH', ''),
+            "FAKE_RESTIC_SPAWN_LOG": f"{work_dir}/spawns.log",
+            "FAKE_RESTIC_LATENCY": str(scenario.latency),
+            "FAKE_RESTIC_OUTPUT_BYTES": str(scenario.output_bytes),
+            "FAKE_RESTIC_LOCK_FILE": f"{work_dir}/repo.lock",
+            "FAKE_RESTIC_LOCK_HOLD": str(scenario.lock_hold),
+        },
+        "backup-paths": list(map(lambda x: {"path": f"/benchmark/path-{x:04}", "excludes": ["*.tmp"]},
+                                 range(scenario.paths)))
+    }
+    config.update(scenario.config)
+    config_file = f"{work_dir}/benchmark.json"
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=2)
+    return config_file
+
+
+def run_scenario(scenario):
+    with tempfile.TemporaryDirectory(prefix='restic-benchmark-') as work_dir:
+        config_file = write_config(work_dir, scenario)
+        start = time.perf_counter()
+        p = subprocess.Popen([sys.executable, backup_script, '--log', config_file] + scenario.sub_command,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # ru_maxrss of the waited process: backup.py, or the largest of its (waited) children.
+        _, status, rusage = os.wait4(p.pid, 0)
+        seconds = time.perf_counter() - start
+        p.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+        spawn_log = f"{work_dir}/spawns.log"
+        spawns = 0
+        if os.path.isfile(spawn_log):
+            with open(spawn_log) as f:
+                spawns = len(f.readlines())
+        return Result(scenario, seconds, rusage.ru_maxrss, spawns, p.returncode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backup.py against a fake restic.')
+    parser.add_argument("scenarios", help="Scenario names (default: all).", nargs='*')
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    if args.list:
+        for s in SCENARIOS:
+            print(s.name)
+        return
+
+    selected = SCENARIOS if len(args.scenarios) == 0 else list(filter(lambda x: x.name in args.scenarios, SCENARIOS))
+    print(f"{'scenario':24} {'seconds':>10} {'peak-rss-mb':>12} {'spawns':>8} {'exit':>5}")
+    for scenario in selected:
+        r = run_scenario(scenario)
+        print(f"{scenario.name:24} {r.seconds:10.2f} {r.peak_rss_kb / 1024:12.1f} {r.spawns:8} {r.return_code:5}")
+        sys.stdout.flush()
+
+
+main()
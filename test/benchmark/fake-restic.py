@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# ==============================================================================
+# Stand-in for the restic executable, used by the benchmarks.
+#
+# Behaviour is controlled with environment variables (set via the "environment"
+# property of the generated configuration):
+#
+# FAKE_RESTIC_SPAWN_LOG    : file to which one line is appended per invocation
+# FAKE_RESTIC_LATENCY      : seconds to sleep before doing anything
+# FAKE_RESTIC_OUTPUT_BYTES : bytes of output to print for backup and ls
+# FAKE_RESTIC_LOCK_FILE    : lock file shared by all invocations; exclusive commands
+#                            (forget, prune, check) hold an exclusive lock on it
+# FAKE_RESTIC_LOCK_HOLD    : seconds an exclusive lock is held
+# ==============================================================================
+import fcntl
+import json
+import os
+import sys
+import time
+
+EXCLUSIVE_COMMANDS = ['forget', 'prune', 'check', 'unlock', 'init']
+LINE = ("-rw-r--r--  1000  1000  4096 2020-01-01 00:00:00 /some/fairly/long/path/to/a/file/in/the/snapshot.txt\n"
+        * 16)
+
+
+def arg_value(name):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else None
+
+
+def command():
+    skip_next = False
+    for a in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+        elif a in ['--repo', '--password-file', '--password-command', '--cache-dir', '-o']:
+            skip_next = True
+        elif not a.startswith('-'):
+            return a
+    return None
+
+
+def write_output(n_bytes):
+    out = sys.stdout.buffer
+    line = LINE.encode('utf-8')
+    while n_bytes > 0:
+        out.write(line[:n_bytes])
+        n_bytes = n_bytes - len(line)
+
+
+def main():
+    cmd = command()
+    spawn_log = os.environ.get('FAKE_RESTIC_SPAWN_LOG')
+    if spawn_log:
+        with open(spawn_log, 'a') as f:
+            f.write(f"{cmd}\n")
+
+    password_file = arg_value('--password-file')
+    if password_file is not None:
+        with open(password_file) as f:
+            f.read()
+
+    time.sleep(float(os.environ.get('FAKE_RESTIC_LATENCY', '0')))
+
+    lock_file = os.environ.get('FAKE_RESTIC_LOCK_FILE')
+    if lock_file:
+        lock = open(lock_file, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX if cmd in EXCLUSIVE_COMMANDS else fcntl.LOCK_SH)
+        if cmd in EXCLUSIVE_COMMANDS:
+            time.sleep(float(os.environ.get('FAKE_RESTIC_LOCK_HOLD', '0')))
+
+    if '--stdin' in sys.argv:
+        for _ in iter(lambda: sys.stdin.buffer.read(65536), b''):
+            pass
+
+    output_bytes = int(os.environ.get('FAKE_RESTIC_OUTPUT_BYTES', '0'))
+    json_output = '--json' in sys.argv
+    if cmd in ['backup', 'ls']:
+        write_output(output_bytes)
+    if cmd == 'backup' and json_output:
+        print(json.dumps({"message_type": "summary", "files_new": 1, "data_added": 0,
+                          "total_bytes_processed": output_bytes, "total_duration": 0.01, "snapshot_id": "0" * 64}))
+    elif cmd == 'stats' and json_output:
+        print(json.dumps({"total_size": 0, "total_file_count": 0, "snapshots_count": 0}))
+    elif cmd == 'forget' and json_output:
+        print(json.dumps([]))
+    elif cmd == 'snapshots' and json_output:
+        print(json.dumps([]))
+
+
+main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from restic.cache import SECS_PER_DAY, cache_usage, cleanup_due
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_cache_usage(self):
+        with tempfile.TemporaryDirectory() as d:
+            for repo, sizes in [('a' * 64, [10, 20]), ('b' * 64, [5])]:
+                os.makedirs(os.path.join(d, repo, 'index'))
+                for n, size in enumerate(sizes):
+                    with open(os.path.join(d, repo, 'index', str(n)), 'w') as f:
+                        f.write('x' * size)
+            with open(os.path.join(d, 'CACHEDIR.TAG'), 'w') as f:
+                f.write('Signature: 8a477f597d28d172789f06886806bc55')
+            usage = cache_usage(d)
+            self.assertEqual(35, usage.bytes)
+            self.assertEqual(3, usage.files)
+            self.assertEqual({'a' * 64: 30, 'b' * 64: 5}, usage.repositories)
+            self.assertEqual(0, cache_usage(os.path.join(d, 'missing')).bytes)
+
+    def test_cleanup_due(self):
+        now = 1000 * SECS_PER_DAY
+        self.assertTrue(cleanup_due({}, now, 7))
+        self.assertFalse(cleanup_due({'last_cleanup_time': now - 6 * SECS_PER_DAY}, now, 7))
+        self.assertTrue(cleanup_due({'last_cleanup_time': now - 7 * SECS_PER_DAY}, now, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+from restic.catalog import Catalog, parse_time
+
+
+def listing(snapshot_id, paths):
+    lines = [json.dumps({'id': snapshot_id, 'struct_type': 'snapshot', 'paths': ['/etc']}) + '\n']
+    for path in paths:
+        lines.append(json.dumps({'name': os.path.basename(path), 'type': 'file', 'path': path, 'size': len(path),
+                                 'mtime': '2024-01-02T03:04:05.123456789+01:00', 'struct_type': 'node'}) + '\n')
+    return lines
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(f"{self.tmp.name}/state/catalog.sqlite")
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp.cleanup()
+
+    def load(self, snapshot_id, time, paths, hostname='host-a'):
+        loader = self.catalog.loader({'id': snapshot_id, 'short_id': snapshot_id[:8], 'time': time,
+                                      'hostname': hostname})
+        for line in listing(snapshot_id, paths):
+            self.assertFalse(loader.handle(line))
+        return loader
+
+    def test_find_and_newest_containing(self):
+        self.load('a' * 64, '2024-01-01T00:00:00Z', ['/etc/hosts', '/etc/ssh/sshd_config']).finish()
+        self.load('b' * 64, '2024-01-02T00:00:00Z', ['/etc/hosts']).finish()
+        self.assertEqual({'a' * 64, 'b' * 64}, self.catalog.snapshot_ids())
+        found = self.catalog.find('hosts')
+        self.assertEqual(['bbbbbbbb', 'aaaaaaaa'], list(map(lambda x: x.snapshot_id, found)))
+        self.assertEqual(len('/etc/hosts'), found[0].size)
+        self.assertEqual(['/etc/ssh/sshd_config'], list(map(lambda x: x.path, self.catalog.find('/etc/ssh/*'))))
+        self.assertEqual('b' * 64, self.catalog.newest_containing('/etc/hosts'))
+        self.assertEqual('a' * 64, self.catalog.newest_containing('/etc/ssh/sshd_config'))
+        self.assertIsNone(self.catalog.newest_containing('/etc/passwd'))
+
+    def test_other_hosts_are_ignored(self):
+        self.load('a' * 64, '2024-01-01T00:00:00Z', ['/etc/hosts']).finish()
+        self.load('b' * 64, '2024-01-02T00:00:00Z', ['/etc/hosts'], 'host-b').finish()
+        self.assertEqual('a' * 64, self.catalog.newest_containing('/etc/hosts', 'host-a'))
+        self.assertEqual('b' * 64, self.catalog.newest_containing('/etc/hosts', 'host-b'))
+        self.assertIsNone(self.catalog.newest_containing('/etc/hosts', 'host-c'))
+        self.assertEqual('a' * 64, self.catalog.resolve_snapshot('latest', 'host-a'))
+        self.assertEqual('b' * 64, self.catalog.resolve_snapshot('latest'))
+
+    def test_latest_is_scoped_to_root(self):
+        self.load('a' * 64, '2024-01-01T00:00:00Z', ['/etc', '/etc/hosts']).finish()
+        self.load('b' * 64, '2024-01-02T00:00:00Z', ['/srv', '/srv/app/data']).finish()
+        self.load('c' * 64, '2024-01-03T00:00:00Z', ['/etc', '/etc/hosts'], 'host-b').finish()
+        self.assertEqual('a' * 64, self.catalog.resolve_snapshot('latest', 'host-a', '/etc'))
+        self.assertEqual('a' * 64, self.catalog.resolve_snapshot('latest', 'host-a', '/etc/'))
+        self.assertEqual('b' * 64, self.catalog.resolve_snapshot('latest', 'host-a', '/srv/app'))
+        self.assertEqual('b' * 64, self.catalog.resolve_snapshot('latest', 'host-a', '/'))
+        self.assertIsNone(self.catalog.resolve_snapshot('latest', 'host-a', '/home'))
+        self.assertIsNone(self.catalog.resolve_snapshot('latest', 'host-a', '/et'))
+        self.assertEqual('a' * 64, self.catalog.resolve_snapshot('aaaa'))
+
+    def test_incomplete_and_removed_snapshots_are_not_found(self):
+        self.load('a' * 64, '2024-01-01T00:00:00Z', ['/etc/hosts']).finish()
+        self.load('b' * 64, '2024-01-02T00:00:00Z', ['/etc/hosts'])
+        self.assertEqual('a' * 64, self.catalog.newest_containing('/etc/hosts'))
+        self.load('c' * 64, '2024-01-03T00:00:00Z', ['/etc/hosts']).abort()
+        self.assertEqual({'a' * 64}, self.catalog.snapshot_ids())
+        self.assertEqual(1, self.catalog.remove_snapshots(['a' * 64]))
+        self.assertEqual([], self.catalog.find('*'))
+
+    def test_parse_time(self):
+        self.assertEqual(1704161045.123456, parse_time('2024-01-02T03:04:05.123456789+01:00'))
+        self.assertEqual(1704161045.0, parse_time('2024-01-02T02:04:05Z'))
+        self.assertIsNone(parse_time('yesterday'))
+        self.assertIsNone(parse_time(None))
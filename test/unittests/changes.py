@@ -0,0 +1,91 @@
+import os
+import tempfile
+import time
+import unittest
+
+from restic.changes import ChangeEntry, ChangeIndex, is_unchanged, scan, target_key
+from restic.plan import ExcludeMatcher
+
+
+class ChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = f"{self.tmp.name}/data"
+        os.makedirs(f"{self.root}/sub")
+        with open(f"{self.root}/sub/a.txt", 'w') as f:
+            f.write("aaa")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_scan_counts_files_and_bytes(self):
+        digest, files, size = scan([self.root])
+        self.assertEqual(32, len(digest))
+        self.assertEqual(1, files)
+        self.assertEqual(3, size)
+        self.assertEqual(digest, scan([self.root])[0])
+
+    def test_scan_detects_changes(self):
+        before = scan([self.root])[0]
+        with open(f"{self.root}/sub/b.txt", 'w') as f:
+            f.write("b")
+        after_add = scan([self.root])[0]
+        self.assertNotEqual(before, after_add)
+        st = os.stat(f"{self.root}/sub/a.txt")
+        os.utime(f"{self.root}/sub/a.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(after_add, scan([self.root])[0])
+
+    def test_scan_ignores_excluded_entries(self):
+        matcher = ExcludeMatcher(['cache', '*.tmp'])
+        before = scan([self.root], matcher)
+        os.makedirs(f"{self.root}/sub/cache")
+        for name in ['sub/cache/x', 'sub/c.tmp']:
+            with open(f"{self.root}/{name}", 'w') as f:
+                f.write("churn")
+        self.assertEqual(before, scan([self.root], matcher))
+        self.assertNotEqual(before[0], scan([self.root])[0])
+
+    def test_scan_directories_only(self):
+        digest, files, size = scan([self.root], directories_only=True)
+        self.assertEqual((1, 0), (files, size))
+        with open(f"{self.root}/sub/a.txt", 'a') as f:
+            f.write("more")
+        self.assertEqual(digest, scan([self.root], directories_only=True)[0])
+        with open(f"{self.root}/sub/b.txt", 'w') as f:
+            f.write("b")
+        self.assertNotEqual(digest, scan([self.root], directories_only=True)[0])
+
+    def test_index_round_trip(self):
+        f = f"{self.tmp.name}/state/changes.bin"
+        index = ChangeIndex(f)
+        index.put('key-1', ChangeEntry(b'\1' * 32, 10, 2048, 1700000000.5))
+        index.save()
+        entry = ChangeIndex(f).get('key-1')
+        self.assertEqual(b'\1' * 32, entry.digest)
+        self.assertEqual(10, entry.files)
+        self.assertEqual(2048, entry.size)
+        self.assertEqual(1700000000.5, entry.backup_time)
+
+    def test_index_saves_merge(self):
+        f = f"{self.tmp.name}/state/changes.bin"
+        first = ChangeIndex(f)
+        second = ChangeIndex(f)
+        first.put('key-1', ChangeEntry(b'\1' * 32, 1, 1, 1.0))
+        second.put('key-2', ChangeEntry(b'\2' * 32, 2, 2, 2.0))
+        first.save()
+        second.save()
+        saved = ChangeIndex(f)
+        self.assertEqual(b'\1' * 32, saved.get('key-1').digest)
+        self.assertEqual(b'\2' * 32, saved.get('key-2').digest)
+
+    def test_is_unchanged(self):
+        now = time.time()
+        entry = ChangeEntry(b'd' * 32, 1, 1, now - 60)
+        self.assertTrue(is_unchanged(entry, b'd' * 32, 7, now))
+        self.assertFalse(is_unchanged(entry, b'x' * 32, 7, now))
+        self.assertFalse(is_unchanged(None, b'd' * 32, 7, now))
+        self.assertFalse(is_unchanged(ChangeEntry(b'd' * 32, 1, 1, now - 8 * 86400), b'd' * 32, 7, now))
+
+    def test_target_key_changes_with_excludes(self):
+        self.assertNotEqual(target_key(['/etc'], ['*.gz']), target_key(['/etc'], ['*.tmp']))
@@ -0,0 +1,33 @@
+import unittest
+
+from restic.check import bytes_read_estimate, next_slice
+
+
+class CheckTest(unittest.TestCase):
+
+    def test_first_check(self):
+        self.assertEqual(1, next_slice({}, 30))
+        self.assertEqual(1, next_slice({'last_slice': 'x', 'slices': 30}, 30))
+
+    def test_rotation_wraps_around(self):
+        state = {}
+        seen = []
+        for _ in range(7):
+            n = next_slice(state, 3)
+            seen.append(n)
+            state = {'last_slice': n, 'slices': 3}
+        self.assertEqual([1, 2, 3, 1, 2, 3, 1], seen)
+
+    def test_changed_cycle_continues_at_same_fraction(self):
+        self.assertEqual(6, next_slice({'last_slice': 15, 'slices': 30}, 10))
+        self.assertEqual(31, next_slice({'last_slice': 15, 'slices': 30}, 60))
+        self.assertEqual(1, next_slice({'last_slice': 30, 'slices': 30}, 7))
+        self.assertEqual(1, next_slice({'last_slice': 31, 'slices': 30}, 7))
+
+    def test_bytes_read_estimate(self):
+        self.assertEqual(100, bytes_read_estimate(3000, 30))
+        self.assertEqual(0, bytes_read_estimate(0, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
+import json
 import os
+import shutil
+import tempfile
 import unittest
 
-from restic.config import read_config
+from restic.config import read_config, policy_tag, retired_policy_tags
 
 src_dir = os.path.dirname(os.path.abspath(__file__))
 test_file_dir = f"{src_dir}/configs"
@@ -179,3 +182,248 @@ class ConfigTest(unittest.TestCase):
     def test_invalid_restic_path_type(self):
         with self.assertRaisesRegex(ValueError, "expected restic-path to be a string"):
             read_config(f'{test_file_dir}/unit-test-028.json', None)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def test_default_backup_grouping_one_group_per_path(self):
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertEqual('none', c.backup_grouping)
+        self.assertEqual(6, len(c.backup_groups))
+        self.assertEqual(['/Users/keith/software'], c.backup_groups[0].paths())
+
+    def test_auto_backup_grouping(self):
+        c = read_config(f'{test_file_dir}/unit-test-031.json', None)
+        self.assertEqual('auto', c.backup_grouping)
+        groups = list(map(lambda x: x.paths(), c.backup_groups))
+        self.assertEqual([['/etc', '/var/spool'], ['/home', '/opt'], ['/srv'], ['/root', '/usr/local']], groups)
+        self.assertEqual(['*.gz'], c.backup_groups[1].exclude_patterns())
+        self.assertEqual(["--keep-daily", "2"], c.forget_policy_for(c.backup_groups[2].backup_paths[0]))
+
+    def test_invalid_incompatible_explicit_group(self):
+        with self.assertRaisesRegex(ValueError, "paths in group 'admin' must have the same forget-policy and excludes"):
+            read_config(f'{test_file_dir}/unit-test-032.json', None)
+
+    def test_invalid_backup_grouping(self):
+        with self.assertRaisesRegex(ValueError, "backup-grouping must be one of"):
+            read_config(f'{test_file_dir}/unit-test-033.json', None)
+
+    def test_max_parallel_backups_and_priority(self):
+        c = read_config(f'{test_file_dir}/unit-test-034.json', None)
+        self.assertEqual(4, c.max_parallel_backups)
+        self.assertEqual(5, c.backup_commands[0].priority)
+        self.assertEqual(0, c.backup_paths[0].priority)
+        self.assertEqual(10, c.backup_groups[1].priority())
+
+    def test_default_max_parallel_backups(self):
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertEqual(1, c.max_parallel_backups)
+
+    def test_invalid_max_parallel_backups(self):
+        with self.assertRaisesRegex(ValueError, "max-parallel-backups must be an integer >= 1"):
+            read_config(f'{test_file_dir}/unit-test-035.json', None)
+
+    def test_forget_grouping_policy(self):
+        c = read_config(f'{test_file_dir}/unit-test-036.json', None)
+        self.assertEqual('policy', c.forget_grouping)
+        self.assertEqual([["--keep-daily", "7"], ["--keep-daily", "2"]], c.distinct_forget_policies())
+
+    def test_default_forget_grouping(self):
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertEqual('path', c.forget_grouping)
+
+    def test_retired_policy_tags(self):
+        old = policy_tag(["--keep-daily", "7"])
+        new = policy_tag(["--keep-daily", "14"])
+        other = policy_tag(["--keep-weekly", "4"])
+        snapshots = [{'id': '1', 'hostname': 'a', 'paths': ['/etc'], 'tags': [old]},
+                     {'id': '2', 'hostname': 'a', 'paths': ['/etc'], 'tags': [new]},
+                     {'id': '3', 'hostname': 'a', 'paths': ['/srv', '/home'], 'tags': [old, 'manual']},
+                     {'id': '4', 'hostname': 'a', 'paths': ['/var'], 'tags': [other]},
+                     {'id': '5', 'hostname': 'a', 'paths': ['/opt']},
+                     {'id': '6', 'hostname': 'a', 'paths': ['/etc'], 'tags': ['manual']}]
+        targets = [(['/etc'], new), (['/home', '/srv'], new), (['/var'], other), (['/opt'], other)]
+        self.assertEqual([(['/etc'], new, [old], ['1', '6']), (['/home', '/srv'], new, [old], ['3']),
+                          (['/opt'], other, [], ['5'])],
+                         retired_policy_tags(snapshots, targets, 'a'))
+        self.assertEqual([], retired_policy_tags(snapshots[1:2], targets, 'a'))
+
+    def test_retired_policy_tags_of_other_hosts(self):
+        mine = policy_tag(["--keep-daily", "14"])
+        theirs = policy_tag(["--keep-daily", "30"])
+        snapshots = [{'id': '1', 'hostname': 'a', 'paths': ['/etc'], 'tags': [mine]},
+                     {'id': '2', 'hostname': 'b', 'paths': ['/etc'], 'tags': [theirs]},
+                     {'id': '3', 'hostname': 'b', 'paths': ['/etc']}]
+        self.assertEqual([], retired_policy_tags(snapshots, [(['/etc'], mine)], 'a'))
+        self.assertEqual([(['/etc'], theirs, [], ['3'])], retired_policy_tags(snapshots, [(['/etc'], theirs)], 'b'))
+
+    def test_policy_tag(self):
+        tag = policy_tag(["--keep-daily", "7"])
+        self.assertRegex(tag, '^forget-policy-[0-9a-f]{12}$')
+        self.assertEqual(tag, policy_tag(["--keep-daily", "7"]))
+        self.assertNotEqual(tag, policy_tag(["--keep-daily", "2"]))
+
+    def test_exclude_sets_are_compiled_and_deduplicated(self):
+        c = read_config(f'{test_file_dir}/unit-test-037.json', None)
+        home = c.backup_paths[0]
+        self.assertEqual(['*.tmp', '**/cache', '**/.cache', '*.gz'], home.exclude_patterns)
+        self.assertEqual(['*.ISO'], c.backup_paths[1].iexclude_patterns)
+        self.assertEqual(['../excludes/opt.txt'], c.backup_paths[2].excludes_files)
+        groups = list(map(lambda x: x.paths(), c.backup_groups))
+        self.assertEqual([['/home', '/var'], ['/srv'], ['/opt']], groups)
+
+    def test_invalid_unknown_exclude_set(self):
+        with self.assertRaisesRegex(ValueError, "unknown exclude-set: 'nope'"):
+            read_config(f'{test_file_dir}/unit-test-038.json', None)
+
+    def test_prune_schedule(self):
+        c = read_config(f'{test_file_dir}/unit-test-039.json', None)
+        ps = c.prune_schedule
+        self.assertEqual(2, ps.min_interval_days)
+        self.assertEqual(7, ps.max_interval_days)
+        self.assertEqual(1000000, ps.bytes_added_threshold)
+        self.assertEqual((22 * 60 + 30, 4 * 60), ps.window)
+        self.assertTrue(ps.stagger)
+        self.assertEqual(30, c.check_read_data_cycle)
+
+    def test_default_prune_schedule_and_state_directory(self):
+        c = read_config(f'{test_file_dir}/unit-test-001.json', test_file_dir)
+        self.assertIsNone(c.prune_schedule)
+        self.assertIsNone(c.check_read_data_cycle)
+        self.assertEqual(os.path.normpath(f'{test_file_dir}/../logs/state'), c.state_directory_abs())
+
+    def test_invalid_prune_schedule_window(self):
+        with self.assertRaisesRegex(ValueError, "invalid prune-schedule window: '25:00-04:00'"):
+            read_config(f'{test_file_dir}/unit-test-040.json', None)
+
+    def test_change_detection(self):
+        c = read_config(f'{test_file_dir}/unit-test-041.json', None)
+        self.assertTrue(c.change_detection)
+        self.assertEqual(3, c.change_detection_max_staleness_days)
+        self.assertTrue(c.change_detection_for(c.backup_paths[0]))
+        self.assertFalse(c.change_detection_for(c.backup_paths[2]))
+        self.assertEqual([['/etc', '/var/spool'], ['/home']], list(map(lambda x: x.paths(), c.backup_groups)))
+
+    def test_backup_command_stream_options(self):
+        c = read_config(f'{test_file_dir}/unit-test-042.json', None)
+        bc = c.backup_commands[0]
+        self.assertEqual('gzip', bc.compression)
+        self.assertEqual(3, bc.compression_level)
+        self.assertEqual(256, bc.buffer_mb)
+        self.assertEqual(4096, bc.spool_mb)
+        bc = c.backup_commands[1]
+        self.assertEqual('none', bc.compression)
+        self.assertIsNone(bc.compression_level)
+        self.assertEqual(64, bc.buffer_mb)
+        self.assertEqual(0, bc.spool_mb)
+
+    def test_invalid_backup_command_compression(self):
+        with self.assertRaisesRegex(ValueError, "compression must be one of"):
+            read_config(f'{test_file_dir}/unit-test-043.json', None)
+
+    def test_daemon_schedule(self):
+        c = read_config(f'{test_file_dir}/unit-test-044.json', None)
+        self.assertEqual({'backup': 6 * 3600, 'check': 7 * 24 * 3600}, c.daemon_schedule.intervals())
+        self.assertEqual(5, c.daemon_schedule.jitter_minutes)
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertEqual({'backup': 24 * 3600, 'prune': 24 * 3600, 'check': 7 * 24 * 3600},
+                         c.daemon_schedule.intervals())
+
+    def test_invalid_daemon_schedule(self):
+        with self.assertRaisesRegex(ValueError, "daemon-schedule backup-interval-hours must be a number >= 0"):
+            read_config(f'{test_file_dir}/unit-test-045.json', None)
+
+    def test_timeouts_and_retry(self):
+        c = read_config(f'{test_file_dir}/unit-test-046.json', None)
+        self.assertEqual(720 * 60, c.timeout_for('backup'))
+        self.assertEqual(60 * 60, c.timeout_for('check'))
+        self.assertEqual(5, c.retry.attempts)
+        self.assertEqual('1h30m', c.retry_lock)
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertIsNone(c.timeout_for('backup'))
+        self.assertEqual(3, c.retry.attempts)
+        self.assertIsNone(c.retry_lock)
+
+    def test_invalid_retry_lock(self):
+        with self.assertRaisesRegex(ValueError, "retry-lock must be a duration"):
+            read_config(f'{test_file_dir}/unit-test-047.json', None)
+
+    def test_bandwidth_schedule_and_priorities(self):
+        c = read_config(f'{test_file_dir}/unit-test-049.json', None)
+        self.assertEqual([(8 * 60, 18 * 60), (18 * 60, 23 * 60)], list(map(lambda x: x.window, c.bandwidth_schedule)))
+        self.assertEqual(1024, c.bandwidth_schedule[0].limit_upload)
+        self.assertIsNone(c.bandwidth_schedule[1].limit_download)
+        self.assertEqual(10, c.backup_groups[0].nice())
+        self.assertEqual('idle', c.backup_groups[0].ionice())
+        self.assertIsNone(c.backup_groups[1].nice())
+
+    def test_invalid_ionice(self):
+        with self.assertRaisesRegex(ValueError, "ionice must be one of"):
+            read_config(f'{test_file_dir}/unit-test-050.json', None)
+
+    def test_config_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            file = os.path.join(d, 'config.json')
+            shutil.copy(f'{test_file_dir}/unit-test-001.json', file)
+            cache_dir = os.path.join(d, 'cache')
+            c = read_config(file, None, cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            with open(os.path.join(cache_dir, os.listdir(cache_dir)[0]), 'rb') as f:
+                self.assertNotIn(c.password.encode('utf-8'), f.read())
+            cached = read_config(file, None, cache_dir)
+            self.assertEqual(c.password, cached.password)
+            self.assertEqual(c.repository, cached.repository)
+            self.assertEqual(list(map(lambda x: x.pattern, c.backup_paths[0].excludes)),
+                             list(map(lambda x: x.pattern, cached.backup_paths[0].excludes)))
+            self.assertEqual(list(map(lambda x: x.paths(), c.backup_groups)),
+                             list(map(lambda x: x.paths(), cached.backup_groups)))
+            self.assertEqual(file, cached.config_file)
+            # a changed file is validated again
+            with open(file) as f:
+                d_ = json.load(f)
+            d_['repository'] = 'sftp:restic@example.com:changed'
+            with open(file, 'w') as f:
+                json.dump(d_, f)
+            self.assertEqual('sftp:restic@example.com:changed', read_config(file, None, cache_dir).repository)
+            d_['bad-prop'] = 1
+            with open(file, 'w') as f:
+                json.dump(d_, f)
+            with self.assertRaisesRegex(ValueError, "invalid property: 'bad-prop'"):
+                read_config(file, None, cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+    def test_duplicates_in_many_excludes(self):
+        with tempfile.TemporaryDirectory() as d:
+            file = os.path.join(d, 'config.json')
+            with open(f'{test_file_dir}/unit-test-001.json') as f:
+                d_ = json.load(f)
+            d_['backup-paths'] = [{'path': '/srv', 'excludes': list(map(lambda x: f'/srv/{x}/*.tmp', range(20000)))}]
+            d_['backup-paths'][0]['excludes'].append('/srv/19999/*.tmp')
+            with open(file, 'w') as f:
+                json.dump(d_, f)
+            with self.assertRaisesRegex(ValueError, "duplicate exclude path: '/srv/19999/\\*.tmp'"):
+                read_config(file, None)
+
+    def test_resume_window(self):
+        self.assertEqual(0, read_config(f'{test_file_dir}/unit-test-001.json', None).resume_window_hours)
+        with tempfile.TemporaryDirectory() as d:
+            file = os.path.join(d, 'config.json')
+            with open(f'{test_file_dir}/unit-test-001.json') as f:
+                d_ = json.load(f)
+            for hours in [-1, 24, 36]:
+                d_['resume-window-hours'] = hours
+                with open(file, 'w') as f:
+                    json.dump(d_, f)
+                with self.assertRaisesRegex(ValueError, "resume-window-hours must be a number >= 0 and < 24"):
+                    read_config(file, None)
+            d_['resume-window-hours'] = 23.5
+            with open(file, 'w') as f:
+                json.dump(d_, f)
+            self.assertEqual(23.5, read_config(file, None).resume_window_hours)
+
+    def test_cache_dir(self):
+        c = read_config(f'{test_file_dir}/unit-test-048.json', '/srv/backup')
+        self.assertEqual('/srv/cache', c.cache_dir_abs())
+        self.assertEqual(14, c.cache_cleanup_days)
+        c = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.assertIsNone(c.cache_dir_abs())
+        self.assertEqual(7, c.cache_cleanup_days)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from restic.config import read_config
+from restic.daemon import Daemon, parse_address
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+test_file_dir = f"{src_dir}/configs"
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load_config(self, file):
+        config = read_config(file, None)
+        config.state_directory = self.tmp.name
+        config.daemon_schedule.jitter_minutes = 0
+        return config
+
+    def test_jobs_on_a_repository_do_not_overlap(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0, 'ran': []}
+
+        def run_job(file, config, kind):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+                state['ran'].append(kind)
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+            return True
+
+        daemon = Daemon([f'{test_file_dir}/unit-test-001.json'], self.load_config, run_job, max_parallel=4)
+
+        async def run():
+            task = asyncio.ensure_future(daemon.run())
+            while len(daemon.results) < 3:
+                await asyncio.sleep(0.01)
+            daemon.stop()
+            await task
+
+        asyncio.run(run())
+        self.assertEqual(1, state['max'])
+        self.assertEqual(['backup', 'check', 'prune'], sorted(state['ran']))
+        # the next runs are an interval after the successful ones
+        self.assertGreater(daemon.entries[0].next_run['backup'], time.time() + 23 * 3600)
+
+    def test_failed_job_is_retried_sooner_and_reported(self):
+        def run_job(file, config, kind):
+            if kind == 'backup':
+                raise RuntimeError("boom")
+            return True
+
+        daemon = Daemon([f'{test_file_dir}/unit-test-044.json'], self.load_config, run_job, max_parallel=1,
+                        status_address=('127.0.0.1', 0))
+
+        async def run():
+            task = asyncio.ensure_future(daemon.run())
+            while len(daemon.results) < 2:
+                await asyncio.sleep(0.01)
+            host, port = daemon.status_address
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'GET / HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            daemon.stop()
+            await task
+            return response
+
+        response = asyncio.run(run())
+        self.assertTrue(response.startswith(b'HTTP/1.0 200 OK'))
+        status = json.loads(response.split(b'\r\n\r\n', 1)[1])
+        results = dict(map(lambda x: (x['job'], x), status['results']))
+        self.assertFalse(results['backup']['ok'])
+        self.assertEqual("RuntimeError: boom", results['backup']['error'])
+        self.assertTrue(results['check']['ok'])
+        self.assertLess(daemon.entries[0].next_run['backup'], time.time() + 2 * 3600)
+        self.assertNotIn('prune', daemon.entries[0].next_run)
+
+    def test_parse_address(self):
+        self.assertEqual(('127.0.0.1', 8385), parse_address('127.0.0.1:8385'))
+        self.assertEqual(('127.0.0.1', 9000), parse_address(':9000'))
+        self.assertIsNone(parse_address(''))
+        with self.assertRaises(ValueError):
+            parse_address('localhost')
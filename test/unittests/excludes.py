@@ -0,0 +1,28 @@
+import unittest
+
+from restic.excludes import exclude_file_args
+
+
+class ExcludesTest(unittest.TestCase):
+
+    def test_patterns_are_written_to_an_exclude_file(self):
+        a = exclude_file_args(['*.gz', '**/cache'], 'exclude')
+        self.assertEqual('--exclude-file', a[0])
+        self.assertEqual(2, len(a))
+        with open(a[1]) as f:
+            self.assertEqual("*.gz\n**/cache\n", f.read())
+
+    def test_identical_pattern_lists_share_a_file(self):
+        a = exclude_file_args(['*.iso'], 'iexclude')
+        b = exclude_file_args(['*.iso'], 'iexclude')
+        c = exclude_file_args(['*.img'], 'iexclude')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a[1], c[1])
+        self.assertEqual('--iexclude-file', a[0])
+
+    def test_patterns_restic_would_alter_stay_on_command_line(self):
+        a = exclude_file_args(['*.gz', '$HOME/x', '#notes'], 'exclude')
+        self.assertEqual(['--exclude', '$HOME/x', '--exclude', '#notes'], a[2:])
+
+    def test_no_patterns(self):
+        self.assertEqual([], exclude_file_args([], 'exclude'))
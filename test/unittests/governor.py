@@ -0,0 +1,43 @@
+import time
+import unittest
+
+from restic.config import BandwidthWindow
+from restic.governor import bandwidth_limits, limit_args, next_change, priority_prefix
+
+
+def local_time(hour, minute, second=0):
+    return time.mktime((2024, 6, 3, hour, minute, second, 0, 0, -1))
+
+
+SCHEDULE = [BandwidthWindow({'window': '08:00-18:00', 'limit-upload': 1024, 'limit-download': 4096}),
+            BandwidthWindow({'window': '18:00-23:00', 'limit-upload': 8192}),
+            BandwidthWindow({'window': '07:00-19:00', 'limit-upload': 1})]
+
+
+class GovernorTest(unittest.TestCase):
+
+    def test_bandwidth_limits(self):
+        self.assertEqual((1024, 4096), bandwidth_limits(SCHEDULE, local_time(12, 0)))
+        self.assertEqual((8192, None), bandwidth_limits(SCHEDULE, local_time(18, 30)))
+        self.assertEqual((1, None), bandwidth_limits(SCHEDULE, local_time(7, 30)))
+        self.assertEqual((None, None), bandwidth_limits(SCHEDULE, local_time(3, 0)))
+        self.assertEqual(['--limit-upload', '1024', '--limit-download', '4096'], limit_args(SCHEDULE, local_time(9, 0)))
+        self.assertEqual([], limit_args([], local_time(9, 0)))
+
+    def test_next_change(self):
+        self.assertEqual(4 * 3600, next_change(SCHEDULE, local_time(3, 0)))
+        self.assertEqual(30 * 60 - 10, next_change(SCHEDULE, local_time(17, 30, 10)))
+        self.assertEqual(60 * 60, next_change(SCHEDULE, local_time(22, 0)))
+        always = [BandwidthWindow({'window': '00:00-00:00', 'limit-upload': 10})]
+        self.assertEqual((None, None), bandwidth_limits(always, local_time(12, 0)))
+        self.assertIsNone(next_change([], local_time(12, 0)))
+
+    def test_priority_prefix(self):
+        self.assertEqual([], priority_prefix(None, None))
+        prefix = priority_prefix(10, 'idle')
+        self.assertEqual(['nice', '-n', '10'], prefix[-3:])
+        self.assertIn(prefix[:3], [['nice', '-n', '10'], ['ionice', '-c', '3']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from restic.journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'journal.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume_within_window(self):
+        j = Journal(self.file, 'backup-prune', 6, now=1000)
+        self.assertFalse(j.resumed)
+        j.complete('backup:/etc')
+        self.assertTrue(j.decision('prune', lambda: True))
+        j = Journal(self.file, 'backup-prune', 6, now=1000 + 5 * 3600)
+        self.assertTrue(j.resumed)
+        self.assertEqual(1000, j.start_time())
+        self.assertTrue(j.done('backup:/etc'))
+        self.assertFalse(j.done('prune'))
+        self.assertTrue(j.decision('prune', lambda: False))
+
+    def test_start_over(self):
+        j = Journal(self.file, 'backup-prune', 6, now=1000)
+        j.complete('forget')
+        self.assertFalse(Journal(self.file, 'backup-prune', 6, now=1000 + 7 * 3600).resumed)
+        self.assertFalse(Journal(self.file, 'backup', 6, now=1000).resumed)
+        self.assertFalse(Journal(self.file, 'backup-prune', 0, now=1000).resumed)
+        j.finish()
+        self.assertFalse(os.path.exists(self.file))
+        self.assertFalse(Journal(self.file, 'backup-prune', 6, now=1000).resumed)
+
+    def test_without_file(self):
+        j = Journal()
+        j.complete('stats')
+        self.assertTrue(j.done('stats'))
+        self.assertEqual([], os.listdir(self.tmp.name))
+        j.finish()
+
+    def test_unreadable_journal(self):
+        with open(self.file, 'w') as f:
+            f.write('{"completed": [')
+        self.assertFalse(Journal(self.file, 'backup-prune', 6).resumed)
+
+
+if __name__ == '__main__':
+    unittest.main()
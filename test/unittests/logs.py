@@ -0,0 +1,104 @@
+import contextvars
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from restic.logging import close_context_stdout, open_logs, redirect_context_stdout
+from restic.logs import INDEX_FILE, log_time, maintain, COMPRESS_AFTER_SECONDS, SECS_PER_DAY
+
+
+class _Config:
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.log_retention_days = 30
+        self.log_max_total_mb = None
+        self.compress_logs = True
+
+    def log_directory_abs(self):
+        return self.log_dir
+
+
+class LogsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.now = log_time('2024-06-01_12:00:00')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, size=1000, age_seconds=2 * COMPRESS_AFTER_SECONDS):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+        os.utime(path, (self.now - age_seconds, self.now - age_seconds))
+
+    def test_finished_logs_are_compressed(self):
+        self.write('2024-05-31_12:00:00.log')
+        self.write('2024-06-01_11:59:00-linux.log', age_seconds=60)
+        self.write('2024-06-01_12:00:00.log')
+        messages = maintain(self.dir, 30, keep={'2024-06-01_12:00:00.log'}, now=self.now)
+        self.assertEqual(1, len(messages))
+        self.assertEqual(['2024-05-31_12:00:00.log.gz', '2024-06-01_11:59:00-linux.log', '2024-06-01_12:00:00.log'],
+                         sorted(filter(lambda x: x != INDEX_FILE, os.listdir(self.dir))))
+        with gzip.open(os.path.join(self.dir, '2024-05-31_12:00:00.log.gz'), 'rt') as f:
+            self.assertEqual('x' * 1000, f.read())
+
+    def test_logs_kept_open_are_not_touched(self):
+        self.write('2024-04-01_12:00:00-quiet.log')
+        self.write('2024-05-31_12:00:00-prune.log')
+        maintain(self.dir, 30, max_total_mb=0, keep={'2024-04-01_12:00:00-quiet.log', '2024-05-31_12:00:00-prune.log'},
+                 now=self.now)
+        self.assertEqual(['2024-04-01_12:00:00-quiet.log', '2024-05-31_12:00:00-prune.log'],
+                         sorted(filter(lambda x: x != INDEX_FILE, os.listdir(self.dir))))
+
+    def test_open_logs_registry(self):
+        config = _Config(self.dir)
+        stdout = sys.stdout
+
+        def job(name):
+            log_file = redirect_context_stdout(config, name)
+            self.assertIn(os.path.basename(log_file), open_logs(self.dir))
+            close_context_stdout()
+            self.assertNotIn(os.path.basename(log_file), open_logs(self.dir))
+
+        try:
+            contextvars.copy_context().run(job, 'backup')
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(set(), open_logs(os.path.join(self.dir, 'other')))
+
+    def test_expiry_uses_name_timestamps(self):
+        self.write('2024-04-01_12:00:00.log.gz', age_seconds=0)
+        self.write('2024-04-01_12:00:00.run.json', age_seconds=0)
+        self.write('2024-05-31_12:00:00.log.gz')
+        maintain(self.dir, 30, compress=False, now=self.now)
+        self.assertEqual(['2024-05-31_12:00:00.log.gz'], sorted(filter(lambda x: x != INDEX_FILE,
+                                                                       os.listdir(self.dir))))
+        with open(os.path.join(self.dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.assertEqual(['2024-05-31_12:00:00.log.gz'], list(index.keys()))
+        self.assertEqual(1000, index['2024-05-31_12:00:00.log.gz'][1])
+
+    def test_total_size_cap_deletes_oldest(self):
+        for day in range(1, 6):
+            self.write(f'2024-05-{day:02}_12:00:00.log.gz', size=400 * 1024)
+        maintain(self.dir, 365, max_total_mb=1, compress=False, now=self.now)
+        self.assertEqual(['2024-05-04_12:00:00.log.gz', '2024-05-05_12:00:00.log.gz'],
+                         sorted(filter(lambda x: x != INDEX_FILE, os.listdir(self.dir))))
+
+    def test_other_files_expire_by_mtime(self):
+        self.write('notes.txt', age_seconds=40 * SECS_PER_DAY)
+        self.write('keep.txt', age_seconds=0)
+        maintain(self.dir, 30, compress=False, now=self.now)
+        self.assertEqual(['keep.txt'], sorted(filter(lambda x: x != INDEX_FILE, os.listdir(self.dir))))
+
+    def test_log_time(self):
+        self.assertEqual(time.mktime((2024, 6, 1, 12, 0, 0, 0, 0, -1)), log_time('2024-06-01_12:00:00-linux.log'))
+        self.assertIsNone(log_time('notes.txt'))
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from restic.metrics import RunRecord, atomic_write, parse_json_line, write_run_record, write_textfile
+
+
+class MetricsTest(unittest.TestCase):
+
+    def _run(self):
+        run = RunRecord()
+        run.command = 'backup'
+        run.repository = 'sftp:user@host:"repo"'
+        run.add_phase('backup', 12.5)
+        run.add_backup_summary('/etc', {'message_type': 'summary', 'files_new': 3, 'data_added': 1024})
+        run.set_stats({'total_size': 4096, 'snapshots_count': 2})
+        run.finish(True)
+        return run
+
+    def test_parse_json_line(self):
+        self.assertEqual({'a': 1}, parse_json_line('{"a": 1}\n'))
+        self.assertEqual([1, 2], parse_json_line('[1, 2]'))
+        self.assertIsNone(parse_json_line('repository 1234 opened\n'))
+        self.assertIsNone(parse_json_line('{not json'))
+
+    def test_write_textfile(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = f"{d}/sub/restic.prom"
+            write_textfile(path, self._run())
+            with open(path) as f:
+                text = f.read()
+            self.assertEqual(['restic.prom'], os.listdir(f"{d}/sub"))
+        self.assertIn('# TYPE restic_backup_files_new gauge\n', text)
+        self.assertIn('restic_backup_files_new{path="/etc",repository="sftp:user@host:\\"repo\\""} 3\n', text)
+        self.assertIn('restic_phase_duration_seconds{phase="backup",', text)
+        self.assertIn('restic_repository_total_size{repository=', text)
+        self.assertIn('restic_run_success{command="backup",', text)
+
+    def test_atomic_write_from_threads(self):
+        with tempfile.TemporaryDirectory() as d:
+            errors = []
+
+            def writer(n):
+                try:
+                    for _ in range(50):
+                        atomic_write(f"{d}/state.json", str(n) * 10000)
+                except OSError as e:
+                    errors.append(e)
+
+            threads = list(map(lambda x: threading.Thread(target=writer, args=(x,)), range(8)))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual([], errors)
+            with open(f"{d}/state.json") as f:
+                self.assertEqual(1, len(set(f.read())))
+            self.assertEqual(['state.json'], os.listdir(d))
+
+    def test_write_run_record(self):
+        with tempfile.TemporaryDirectory() as d:
+            write_run_record(f"{d}/run.json", self._run())
+            with open(f"{d}/run.json") as f:
+                record = json.load(f)
+        self.assertTrue(record['ok'])
+        self.assertEqual(1024, record['backup_summaries']['/etc']['data_added'])
+        self.assertEqual('backup', record['phases'][0]['name'])
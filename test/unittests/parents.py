@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from restic.config import read_config
+from restic.parents import ParentCache, is_parent_error
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+test_file_dir = f"{src_dir}/configs"
+
+
+class ParentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        self.config.state_directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parent_is_persisted(self):
+        parents = ParentCache(self.config)
+        parents.put('/etc', ['*.gz'], 'abc123')
+        parents.save()
+        self.assertEqual('abc123', ParentCache(self.config).get('/etc', ['*.gz']))
+
+    def test_saves_of_configurations_sharing_a_repository_merge(self):
+        ParentCache(self.config).put('/old', [], 'old')
+        first = ParentCache(self.config)
+        second = ParentCache(self.config)
+        first.put('/etc', [], 'etc-1')
+        second.put('/srv', [], 'srv-1')
+        first.save()
+        second.remove('/etc')
+        second.save()
+        saved = ParentCache(self.config)
+        self.assertEqual('srv-1', saved.get('/srv', []))
+        self.assertIsNone(saved.get('/etc', []))
+        first.save()
+        self.assertEqual('etc-1', ParentCache(self.config).get('/etc', []))
+        self.assertEqual('srv-1', ParentCache(self.config).get('/srv', []))
+
+    def test_parent_is_invalidated_when_excludes_change(self):
+        parents = ParentCache(self.config)
+        parents.put('/etc', ['*.gz'], 'abc123')
+        self.assertIsNone(parents.get('/etc', ['*.gz', '*.tmp']))
+        self.assertIsNone(parents.get('/var', ['*.gz']))
+
+    def test_is_parent_error(self):
+        self.assertTrue(is_parent_error("Fatal: unable to load parent snapshot 1234: no matching ID found\n"))
+        self.assertFalse(is_parent_error("Fatal: unable to open config file: Stat: connection lost\n"))
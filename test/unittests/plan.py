@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+
+from restic.plan import ExcludeMatcher, History, overlaps, read_excludes_file, walk
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, size):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+    def test_exclude_patterns(self):
+        matcher = ExcludeMatcher(['*.tmp', '/var/cache', 'node_modules', '/home/**/.cache', 'log[0-9]'], ['*.BAK'])
+        self.assertTrue(matcher.excluded('/home/user/a.tmp'))
+        self.assertTrue(matcher.excluded('/var/cache'))
+        self.assertTrue(matcher.excluded('/var/cache/apt/x.deb'))
+        self.assertFalse(matcher.excluded('/srv/var/cache'))
+        self.assertTrue(matcher.excluded('/srv/app/node_modules'))
+        self.assertTrue(matcher.excluded('/home/user/.cache'))
+        self.assertTrue(matcher.excluded('/home/user/deep/.cache'))
+        self.assertTrue(matcher.excluded('/srv/log1'))
+        self.assertFalse(matcher.excluded('/srv/logs'))
+        self.assertTrue(matcher.excluded('/srv/old.bak'))
+        self.assertFalse(matcher.excluded('/srv/a.tmpx'))
+
+    def test_excluded_entry_agrees_with_excluded(self):
+        patterns = ['*.tmp', '/var/cache', 'node_modules', '/home/**/.cache', 'log[0-9]', 'build*', '/srv/**',
+                    'a/b', '**/deep/*.o', '\\*literal']
+        matcher = ExcludeMatcher(patterns, ['*.BAK', 'Thumbs.db'])
+        paths = ['/home/user/a.tmp', '/var/cache', '/var/cached', '/srv/app/node_modules', '/home/user/.cache',
+                 '/home/x/y/.cache', '/srv', '/srv/x', '/log1', '/logs', '/old.bak', '/x/THUMBS.DB', '/x/builds',
+                 '/x/rebuild', '/x/a/b', '/a/b', '/x/deep/m.o', '/x/deep/m.c', '/x/*literal', '/x/aliteral']
+        for path in paths:
+            self.assertEqual(matcher.excluded(path), matcher.excluded_entry(path), path)
+
+    def test_many_patterns(self):
+        matcher = ExcludeMatcher(list(map(lambda x: f"*.ext{x}", range(1000))) +
+                                 list(map(lambda x: f"/home/user{x}/cache", range(1000))))
+        self.assertTrue(matcher.excluded_entry('/srv/file.ext999'))
+        self.assertTrue(matcher.excluded_entry('/home/user7/cache'))
+        self.assertFalse(matcher.excluded_entry('/home/user7/cached'))
+        self.assertFalse(matcher.excluded_entry('/srv/file.ext1000'))
+
+    def test_read_excludes_file(self):
+        os.environ['PLAN_TEST_DIR'] = '/data'
+        file = os.path.join(self.dir, 'excludes.txt')
+        with open(file, 'w') as f:
+            f.write("# comment\n\n*.tmp\n$PLAN_TEST_DIR/cache\n")
+        self.assertEqual(read_excludes_file(file), ['*.tmp', '/data/cache'])
+
+    def test_walk(self):
+        self.write('a/one.txt', 10)
+        self.write('a/two.tmp', 20)
+        self.write('a/b/three.txt', 30)
+        self.write('a/cache/four.txt', 40)
+        for n in range(50):
+            self.write(f"a/many/d{n}/f.txt", 1)
+        result = walk([os.path.join(self.dir, 'a')], ExcludeMatcher(['*.tmp', 'cache']), walkers=4)
+        self.assertEqual(result.files, 52)
+        self.assertEqual(result.bytes, 90)
+        self.assertEqual(result.excluded, 2)
+        self.assertEqual(result.errors, 0)
+
+    def test_walk_missing_path(self):
+        result = walk([os.path.join(self.dir, 'missing')], ExcludeMatcher([]))
+        self.assertEqual(result.files, 0)
+        self.assertEqual(result.errors, 1)
+
+    def test_overlaps(self):
+        none = ExcludeMatcher([])
+        found = overlaps([('/root', ['/root'], none), ('/root/restic/logs', ['/root/restic/logs'], none),
+                          ('/rooted', ['/rooted'], none)])
+        self.assertEqual(found, [('/root', '/root/restic/logs', '/root', '/root/restic/logs')])
+        excluded = overlaps([('/root', ['/root'], ExcludeMatcher(['/root/restic'])),
+                             ('/root/restic/logs', ['/root/restic/logs'], none)])
+        self.assertEqual(excluded, [])
+
+    def test_history(self):
+        def record(name, summaries):
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write(json.dumps({'backup_summaries': summaries}))
+
+        record('2024-06-01_10:00:00.run.json', {'/etc': {'data_added': 100, 'total_bytes_processed': 1000,
+                                                         'total_duration': 10}})
+        record('2024-06-02_10:00:00.run.json', {'/etc': {'data_added': 300, 'total_bytes_processed': 2000,
+                                                         'total_duration': 10}})
+        record('2024-06-03_10:00:00.run.json', {})
+        history = History(self.dir)
+        self.assertEqual(history.throughput(), 150)
+        self.assertEqual(history.estimate('/etc', 4000), (300, 20))
+        self.assertEqual(history.estimate('/srv', 3000), (3000, 20))
+        self.assertIsNone(History(os.path.join(self.dir, 'empty')).throughput())
+
+
+if __name__ == '__main__':
+    unittest.main()
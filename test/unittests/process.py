@@ -0,0 +1,79 @@
+import io
+import sys
+import unittest
+from unittest import mock
+
+from restic import process
+from restic.process import run_streaming
+
+
+class ProcessTest(unittest.TestCase):
+
+    def test_output_is_streamed_to_stdout(self):
+        out = io.StringIO()
+        with mock.patch.object(sys, 'stdout', out):
+            r = run_streaming([sys.executable, '-c', 'print("line-1"); print("line-2")'])
+        self.assertTrue(r.ok())
+        self.assertEqual("line-1\nline-2\n", out.getvalue())
+
+    def test_stderr_is_combined(self):
+        out = io.StringIO()
+        with mock.patch.object(sys, 'stdout', out):
+            run_streaming([sys.executable, '-c', 'import sys; sys.stderr.write("oops\\n")'])
+        self.assertEqual("oops\n", out.getvalue())
+
+    def test_return_code_and_bounded_tail(self):
+        out = io.StringIO()
+        script = 'import sys\nfor i in range(1000): print(i)\nsys.exit(3)'
+        with mock.patch.object(sys, 'stdout', out):
+            r = run_streaming([sys.executable, '-c', script])
+        self.assertFalse(r.ok())
+        self.assertEqual(3, r.return_code)
+        lines = r.tail.splitlines()
+        self.assertEqual(process.TAIL_LINES, len(lines))
+        self.assertEqual('999', lines[-1])
+        self.assertEqual(1000, len(out.getvalue().splitlines()))
+
+    def test_long_lines_are_chunked(self):
+        out = io.StringIO()
+        size = process.CHUNK_SIZE * 3 + 7
+        with mock.patch.object(sys, 'stdout', out):
+            r = run_streaming([sys.executable, '-c', f'print("x" * {size})'])
+        self.assertEqual(size + 1, len(out.getvalue()))
+        self.assertTrue(len(r.tail) <= size + 1)
+
+    def test_line_handler_can_suppress_lines(self):
+        out = io.StringIO()
+        seen = []
+
+        def handler(line):
+            seen.append(line)
+            return not line.startswith('status')
+
+        script = 'print("status 1"); print("x" * 200000); print("status 2"); print("summary")'
+        with mock.patch.object(sys, 'stdout', out):
+            run_streaming([sys.executable, '-c', script], line_handler=handler)
+        self.assertEqual(['status 1\n', 'x' * 200000 + '\n', 'status 2\n', 'summary\n'], seen)
+        self.assertEqual('x' * 200000 + '\nsummary\n', out.getvalue())
+
+    def test_oversized_lines_bypass_line_handler(self):
+        out = io.StringIO()
+        seen = []
+        with mock.patch.object(process, 'MAX_HANDLED_LINE', 100000), mock.patch.object(sys, 'stdout', out):
+            run_streaming([sys.executable, '-c', 'print("y" * 300000); print("after")'],
+                          line_handler=lambda x: seen.append(x) is not None)
+        self.assertEqual(['after\n'], seen)
+        self.assertEqual('y' * 300000 + '\n', out.getvalue())
+
+    def test_timeout(self):
+        out = io.StringIO()
+        with mock.patch.object(sys, 'stdout', out):
+            r = run_streaming([sys.executable, '-c', 'import time; print("started", flush=True); time.sleep(30)'],
+                              timeout=0.5)
+        self.assertTrue(r.timed_out)
+        self.assertFalse(r.ok())
+        self.assertIn("timed out after", r.tail)
+        with mock.patch.object(sys, 'stdout', out):
+            r = run_streaming([sys.executable, '-c', 'pass'], timeout=30)
+        self.assertFalse(r.timed_out)
+        self.assertTrue(r.ok())
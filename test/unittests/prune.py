@@ -0,0 +1,87 @@
+import os
+import time
+import unittest
+
+from restic.config import read_config
+from restic.prune import prune_due, prune_wanted, host_slot, SECS_PER_DAY, STAGGER_DAYS
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+test_file_dir = f"{src_dir}/configs"
+
+
+class PruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = read_config(f'{test_file_dir}/unit-test-039.json', None).prune_schedule
+        self.schedule.window = None
+        self.now = 1700000000.0
+
+    def due_days(self, host, state_for, interval=7):
+        day = int(self.now // SECS_PER_DAY)
+        days = []
+        for offset in range(interval):
+            now = (day + offset) * SECS_PER_DAY + 3600
+            if prune_due(self.schedule, state_for(now), now, host)[0]:
+                days.append((day + offset) % interval)
+        return days
+
+    def test_first_prune(self):
+        self.schedule.stagger = False
+        self.assertTrue(prune_due(self.schedule, {}, self.now, 'host-a')[0])
+
+    def test_every_trigger_is_staggered_across_hosts(self):
+        hosts = list(map(lambda x: f"host-{x}", range(20)))
+        triggers = [lambda now: {},
+                    lambda now: {'last_prune_time': now - 3 * SECS_PER_DAY, 'last_total_size': 5000000,
+                                 'size_at_last_prune': 0},
+                    lambda now: {'last_prune_time': now - 8 * SECS_PER_DAY}]
+        for state_for in triggers:
+            days = list(map(lambda x: self.due_days(x, state_for), hosts))
+            self.assertEqual(list(map(lambda x: [host_slot(x, 7)], hosts)), days)
+            self.assertGreater(len(set(map(lambda x: x[0], days))), 1)
+
+    def test_stagger_without_max_interval(self):
+        self.schedule.max_interval_days = None
+        days = self.due_days('host-a', lambda now: {}, STAGGER_DAYS)
+        self.assertEqual([host_slot('host-a', STAGGER_DAYS)], days)
+
+    def test_min_interval(self):
+        state = {'last_prune_time': self.now - SECS_PER_DAY, 'last_total_size': 10 ** 9, 'size_at_last_prune': 0}
+        self.assertFalse(prune_due(self.schedule, state, self.now, 'host-a')[0])
+
+    def test_bytes_added_threshold(self):
+        self.schedule.stagger = False
+        state = {'last_prune_time': self.now - 3 * SECS_PER_DAY, 'last_total_size': 5000000,
+                 'size_at_last_prune': 3000000}
+        due, reason = prune_due(self.schedule, state, self.now, 'host-a')
+        self.assertTrue(due)
+        self.assertIn("2,000,000 bytes added", reason)
+        state['size_at_last_prune'] = 4500000
+        self.assertFalse(prune_due(self.schedule, state, self.now, 'host-a')[0])
+
+    def test_max_interval_overdue_ignores_stagger(self):
+        state = {'last_prune_time': self.now - 14 * SECS_PER_DAY}
+        self.assertTrue(prune_due(self.schedule, state, self.now, 'host-a')[0])
+
+    def test_daemon_interval_prunes_without_schedule(self):
+        config = read_config(f'{test_file_dir}/unit-test-001.json', None)
+        config.prune_policy = 0
+        self.assertFalse(prune_wanted(config, {}, self.now, 'host-a')[0])
+        self.assertEqual((True, "daemon prune interval"), prune_wanted(config, {}, self.now, 'host-a', True))
+        config.prune_policy = 1
+        self.assertTrue(prune_wanted(config, {}, self.now, 'host-a')[0])
+
+    def test_daemon_interval_keeps_prune_schedule(self):
+        config = read_config(f'{test_file_dir}/unit-test-039.json', None)
+        config.prune_schedule.window = None
+        state = {'last_prune_time': self.now - SECS_PER_DAY}
+        self.assertFalse(prune_wanted(config, state, self.now, 'host-a', True)[0])
+
+    def test_window(self):
+        self.schedule.stagger = False
+        t = time.localtime(self.now)
+        minute = t.tm_hour * 60 + t.tm_min
+        self.schedule.window = ((minute + 60) % 1440, (minute + 120) % 1440)
+        self.assertFalse(prune_due(self.schedule, {}, self.now, 'host-a')[0])
+        self.schedule.window = ((minute - 10) % 1440, (minute + 10) % 1440)
+        self.assertTrue(prune_due(self.schedule, {}, self.now, 'host-a')[0])
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from restic.catalog import CatalogEntry
+from restic.restore import include_pattern, is_restored, plan_restore, split_units
+
+
+def entry(path, entry_type='file', size=100, mtime=1700000000.25):
+    return CatalogEntry('aaaaaaaa', 1700000000.0, entry_type, size if entry_type == 'file' else 0, mtime, path)
+
+
+def tree():
+    entries = [entry('/data', 'dir'), entry('/data/small', 'dir'), entry('/data/small/a'),
+               entry('/data/big', 'dir'), entry('/data/empty', 'dir')]
+    for d in range(4):
+        entries.append(entry(f'/data/big/d{d}', 'dir'))
+        for f in range(10):
+            entries.append(entry(f'/data/big/d{d}/f{f}', size=10 ** 6))
+    return entries
+
+
+class RestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def restore(self, e):
+        path = os.path.join(self.tmp.name, e.path.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * e.size)
+        os.utime(path, (e.mtime, e.mtime))
+
+    def test_large_subtrees_are_split(self):
+        units = split_units(tree(), '/data', 6)
+        paths = sorted(map(lambda x: x.path, units))
+        self.assertEqual(['/data/big/d0', '/data/big/d1', '/data/big/d2', '/data/big/d3', '/data/empty',
+                          '/data/small'], paths)
+        self.assertEqual(41, sum(map(lambda x: x.files, units)))
+
+    def test_shards_are_balanced(self):
+        plan = plan_restore(tree(), '/data/', self.tmp.name, 2)
+        self.assertEqual(2, len(plan.shards))
+        self.assertEqual(41, plan.files)
+        self.assertEqual([20, 21], sorted(map(lambda x: x.files, plan.shards)))
+        self.assertEqual(0, plan.skipped_files)
+
+    def test_restored_files_are_skipped(self):
+        entries = tree()
+        for e in entries:
+            if e.path.startswith('/data/big/d0/') or e.path == '/data/big/d1/f0':
+                self.restore(e)
+        plan = plan_restore(entries, '/data', self.tmp.name, 1)
+        includes = plan.shards[0].includes
+        self.assertEqual([], list(filter(lambda x: x.startswith('/data/big/d0'), includes)))
+        self.assertNotIn('/data/big/d1/f0', includes)
+        self.assertIn('/data/big/d1/f1', includes)
+        self.assertIn('/data/big/d2', includes)
+        self.assertEqual(11, plan.skipped_files)
+        self.assertEqual(30, plan.files)
+
+    def test_is_restored_compares_size_and_mtime(self):
+        e = entry('/x/file')
+        self.assertFalse(is_restored(e, self.tmp.name))
+        self.restore(e)
+        self.assertTrue(is_restored(e, self.tmp.name))
+        self.assertFalse(is_restored(entry('/x/file', size=101), self.tmp.name))
+        self.assertFalse(is_restored(entry('/x/file', mtime=1700000001.25), self.tmp.name))
+
+    def test_include_pattern(self):
+        self.assertEqual('/data/a\\*b\\[1]', include_pattern('/data/a*b[1]'))
@@ -0,0 +1,98 @@
+import os
+import unittest
+
+from restic.config import read_config
+from restic.governor import RESTARTED
+from restic.metrics import start_run
+from restic.process import ProcessResult
+from restic.retry import classify, backoff_seconds, run_with_retries, FATAL, LOCKED, NETWORK, OK, PARTIAL, TIMEOUT
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+test_file_dir = f"{src_dir}/configs"
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_classify(self):
+        self.assertEqual(OK, classify(ProcessResult(0, "")))
+        self.assertEqual(PARTIAL, classify(ProcessResult(3, "Warning: at least one source file could not be read\n")))
+        self.assertEqual(LOCKED, classify(ProcessResult(11, "")))
+        self.assertEqual(LOCKED, classify(ProcessResult(1, "Fatal: unable to create lock in backend: repository is "
+                                                           "already locked exclusively by PID 42 on host\n")))
+        self.assertEqual(NETWORK, classify(ProcessResult(1, "Fatal: unable to open repository: ssh command exited: "
+                                                            "exit status 255\n")))
+        self.assertEqual(NETWORK, classify(ProcessResult(1, "Save(<data/1234>) returned error: connection reset by "
+                                                            "peer\n")))
+        self.assertEqual(TIMEOUT, classify(ProcessResult(-15, "timed out after 60 seconds\n", timed_out=True)))
+        self.assertEqual(FATAL, classify(ProcessResult(1, "Fatal: wrong password or no key found\n")))
+
+    def test_classify_unexpected_eof(self):
+        self.assertEqual(NETWORK, classify(ProcessResult(1, 'Load(<data/1234>, 0, 0) failed: Get "https://s3.host/'
+                                                            'repo/data/12/1234": unexpected EOF\n')))
+        self.assertEqual(NETWORK, classify(ProcessResult(1, "read tcp 10.0.0.1:4711->10.0.0.2:443: unexpected EOF\n")))
+        self.assertEqual(FATAL, classify(ProcessResult(1, "Fatal: ReadFull(<data/1234>): unexpected EOF\n")))
+        self.assertEqual(FATAL, classify(ProcessResult(1, "error: pack 1234: load blob: unexpected EOF\n")))
+
+    def test_backoff(self):
+        policy = read_config(f'{test_file_dir}/unit-test-046.json', None).retry
+        self.assertEqual(5, backoff_seconds(policy, 1, lambda: 0))
+        self.assertEqual(10, backoff_seconds(policy, 1, lambda: 1))
+        self.assertEqual(40, backoff_seconds(policy, 3, lambda: 1))
+        self.assertEqual(60, backoff_seconds(policy, 10, lambda: 1))
+
+
+class _Governor:
+
+    def __init__(self, interruptions):
+        self.interruptions = interruptions
+        self.interrupted = False
+        self.schedule = []
+
+    def done(self):
+        self.interrupted = self.interruptions > 0
+        self.interruptions = self.interruptions - 1
+
+
+class RunWithRetriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = read_config(f'{test_file_dir}/unit-test-046.json', None).retry
+        self.run = start_run()
+        self.sleeps = []
+
+    def attempts(self, results, retryable=True, governor=None):
+        results = list(results)
+        result = run_with_retries(self.policy, 'backup', lambda: results.pop(0), '/etc', retryable, governor,
+                                  self.sleeps.append)
+        return result, list(map(lambda x: (x['attempt'], x['outcome']), self.run.restic_calls))
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        result, calls = self.attempts([ProcessResult(11, ""), ProcessResult(1, "connection refused\n"),
+                                       ProcessResult(0, "")])
+        self.assertEqual(0, result.return_code)
+        self.assertEqual([(1, LOCKED), (2, NETWORK), (3, OK)], calls)
+        self.assertEqual(2, len(self.sleeps))
+        self.assertTrue(5 <= self.sleeps[0] <= 10 and 10 <= self.sleeps[1] <= 20)
+
+    def test_attempts_are_limited(self):
+        result, calls = self.attempts([ProcessResult(11, "")] * 6)
+        self.assertEqual(11, result.return_code)
+        self.assertEqual(5, len(calls))
+        self.assertEqual(4, len(self.sleeps))
+
+    def test_fatal_and_partial_are_not_retried(self):
+        self.assertEqual([(1, FATAL)], self.attempts([ProcessResult(1, "Fatal: wrong password\n")])[1])
+        self.assertEqual([], self.sleeps)
+        self.run = start_run()
+        self.assertEqual([(1, PARTIAL)], self.attempts([ProcessResult(3, "")])[1])
+
+    def test_stdin_is_not_retried(self):
+        result, calls = self.attempts([ProcessResult(11, ""), ProcessResult(0, "")], retryable=False)
+        self.assertEqual(11, result.return_code)
+        self.assertEqual([(1, LOCKED)], calls)
+        self.assertEqual([], self.sleeps)
+
+    def test_restart_does_not_count_as_attempt(self):
+        result, calls = self.attempts([ProcessResult(-15, ""), ProcessResult(0, "")], governor=_Governor(1))
+        self.assertEqual([(1, RESTARTED), (1, OK)], calls)
+        self.assertEqual([], self.sleeps)
@@ -0,0 +1,114 @@
+import contextvars
+import io
+import sys
+import threading
+import unittest
+from unittest import mock
+
+from restic.logging import write_output
+from restic.scheduler import Job, RepositoryLock, first_time, run_jobs, start_shared_operations
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_jobs_run_in_priority_order(self):
+        ran = []
+        jobs = [Job('a', lambda: ran.append('a')),
+                Job('b', lambda: ran.append('b'), priority=10),
+                Job('c', lambda: ran.append('c'), priority=5)]
+        results = run_jobs(jobs, 1)
+        self.assertEqual(['b', 'c', 'a'], ran)
+        self.assertEqual(['b', 'c', 'a'], list(map(lambda x: x.label, results)))
+
+    def test_failures_are_aggregated(self):
+        def boom():
+            raise RuntimeError("boom")
+
+        results = run_jobs([Job('ok', lambda: True), Job('false', lambda: False), Job('raise', boom)], 2)
+        self.assertEqual([True, False, False], list(map(lambda x: x.ok, results)))
+        self.assertEqual("boom", str(results[2].error))
+
+    def test_parallel_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def work():
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            threading.Event().wait(0.05)
+            with lock:
+                state['running'] -= 1
+
+        run_jobs(list(map(lambda x: Job(str(x), work), range(8))), 3)
+        self.assertEqual(3, state['max'])
+
+    def test_parallel_output_is_prefixed(self):
+        out = io.StringIO()
+        with mock.patch.object(sys, 'stdout', out):
+            run_jobs([Job('one', lambda: write_output("a\nb\n")), Job('two', lambda: write_output("c\n"))], 2)
+        lines = sorted(out.getvalue().splitlines())
+        self.assertEqual(['[one] a', '[one] b', '[two] c'], lines)
+
+    def test_nested_jobs_prefix_with_parent_label(self):
+        out = io.StringIO()
+
+        def inner():
+            return run_jobs([Job('x', lambda: write_output("1\n")), Job('y', lambda: write_output("2\n"))], 2)
+
+        with mock.patch.object(sys, 'stdout', out):
+            run_jobs([Job('fleet-a', inner), Job('fleet-b', lambda: write_output("3\n"))], 2)
+        lines = sorted(out.getvalue().splitlines())
+        self.assertEqual(['[fleet-a/x] 1', '[fleet-a/y] 2', '[fleet-b] 3'], lines)
+
+    def test_exclusive_waits_for_shared(self):
+        lock = RepositoryLock()
+        events = []
+        shared_entered = threading.Event()
+
+        def backup():
+            with lock.shared():
+                shared_entered.set()
+                threading.Event().wait(0.05)
+                events.append('backup done')
+
+        def prune():
+            shared_entered.wait()
+            with lock.exclusive():
+                events.append('prune')
+
+        run_jobs([Job('backup', backup), Job('prune', prune)], 2)
+        self.assertEqual(['backup done', 'prune'], events)
+
+    def test_shared_is_reentrant_with_exclusive_waiting(self):
+        lock = RepositoryLock()
+        events = []
+        shared_entered = threading.Event()
+        prune_waiting = threading.Event()
+
+        def backup():
+            with lock.shared():
+                shared_entered.set()
+                prune_waiting.wait()
+                threading.Event().wait(0.05)
+                with lock.shared():
+                    events.append('backup')
+
+        def prune():
+            shared_entered.wait()
+            prune_waiting.set()
+            with lock.exclusive():
+                events.append('prune')
+
+        run_jobs([Job('backup', backup), Job('prune', prune)], 2)
+        self.assertEqual(['backup', 'prune'], events)
+
+    def test_first_time(self):
+        def fleet():
+            start_shared_operations()
+            return [first_time('repo', 'prune'), first_time('repo', 'prune'), first_time('other', 'prune')]
+
+        self.assertEqual([True, False, True], contextvars.copy_context().run(fleet))
+        # outside of a fleet run every operation runs
+        self.assertTrue(first_time('repo', 'prune'))
+        self.assertTrue(first_time('repo', 'prune'))
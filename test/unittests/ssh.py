@@ -0,0 +1,33 @@
+import unittest
+
+from restic.ssh import SshMaster, sftp_master, sftp_target
+
+
+class SshTest(unittest.TestCase):
+
+    def test_sftp_target(self):
+        t = sftp_target('sftp:restic@restic.example.com:restic-repos/test')
+        self.assertEqual(('restic', 'restic.example.com', None), t.key())
+        self.assertEqual(['-l', 'restic', 'restic.example.com'], t.args())
+        t = sftp_target('sftp://backup@host.example.com:2222//srv/restic')
+        self.assertEqual(('backup', 'host.example.com', '2222'), t.key())
+        self.assertEqual(['-p', '2222', '-l', 'backup', 'host.example.com'], t.args())
+        t = sftp_target('sftp:host:/srv/restic')
+        self.assertEqual((None, 'host', None), t.key())
+        t = sftp_target('sftp:[::1]:/srv/restic')
+        self.assertEqual((None, '::1', None), t.key())
+        self.assertIsNone(sftp_target('s3:s3.amazonaws.com/bucket'))
+        self.assertIsNone(sftp_target('/srv/restic'))
+
+    def test_sftp_command(self):
+        master = SshMaster(sftp_target('sftp://u@h:22/repo'), '/tmp/restic-ssh-x/1.sock')
+        self.assertEqual('ssh -o ControlMaster=no -o ControlPath=/tmp/restic-ssh-x/1.sock -p 22 -l u h -s sftp',
+                         master.sftp_command())
+
+    def test_no_master_for_other_repositories(self):
+        self.assertEqual((None, None), sftp_master('/srv/restic'))
+        self.assertEqual((None, None), sftp_master('rest:https://host:8000/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+import restic.stream
+from restic.stream import CommandStream, SpillBuffer, _compressor
+
+# stands in for restic: reads its input to the end, then "commits a snapshot" by writing it to argv[1]
+_CONSUMER = """
+import signal, sys
+if sys.argv[2] == 'ignore-term':
+    signal.signal(signal.SIGTERM, lambda *x: None)
+data = sys.stdin.buffer.read()
+with open(sys.argv[1], 'wb') as f:
+    f.write(data)
+"""
+
+
+class _BackupCommand:
+
+    def __init__(self, command):
+        self.command = command
+        self.repo_path = '/stream'
+        self.compression = 'none'
+        self.compression_level = None
+        self.buffer_mb = 1
+        self.spool_mb = 0
+
+
+class StreamTest(unittest.TestCase):
+
+    def test_spill_buffer_keeps_order_across_memory_and_spool(self):
+        b = SpillBuffer(memory_limit=10, spool_limit=1000)
+        chunks = list(map(lambda x: bytes([x]) * 4, range(20)))
+        for c in chunks:
+            b.put(c)
+        b.close()
+        self.assertEqual(b''.join(chunks), b''.join(iter(b.get, None)))
+        self.assertEqual(80 - 8, b.spooled_bytes)
+
+    def test_spill_buffer_blocks_when_full(self):
+        b = SpillBuffer(memory_limit=4, spool_limit=4)
+        b.put(b'aaaa')
+        b.put(b'bbbb')
+        done = threading.Event()
+
+        def producer():
+            b.put(b'cccc')
+            b.close()
+            done.set()
+
+        threading.Thread(target=producer, daemon=True).start()
+        self.assertFalse(done.wait(0.1))
+        self.assertEqual(b'aaaa', b.get())
+        self.assertEqual(b'bbbb', b.get())
+        self.assertTrue(done.wait(1))
+        self.assertEqual(b'cccc', b.get())
+        self.assertIsNone(b.get())
+
+    def test_gzip_compressor(self):
+        c = _compressor('gzip', 9)
+        data = b'hello world ' * 1000
+        compressed = c.compress(data) + c.flush()
+        self.assertEqual(data, gzip.decompress(compressed))
+
+    def test_passthrough_compressor(self):
+        c = _compressor('none', None)
+        self.assertEqual(b'abc', c.compress(b'abc') + c.flush())
+
+    def stream(self, command, term):
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = os.path.join(d, 'snapshot')
+            stream = CommandStream(_BackupCommand(command))
+            stdin = stream.start()
+            restic = subprocess.Popen([sys.executable, '-c', _CONSUMER, snapshot, term], stdin=stdin)
+            stream.attach(restic)
+            ok = stream.finish()
+            restic.wait()
+            if not os.path.exists(snapshot):
+                return ok, restic.returncode, None
+            with open(snapshot, 'rb') as f:
+                return ok, restic.returncode, f.read()
+
+    def test_command_stream(self):
+        self.assertEqual((True, 0, b'data\n'), self.stream(['sh', '-c', 'echo data'], 'default'))
+
+    def test_failing_command_aborts_restic(self):
+        ok, code, snapshot = self.stream(['sh', '-c', 'echo data; exit 3'], 'default')
+        self.assertFalse(ok)
+        self.assertNotEqual(0, code)
+        self.assertIsNone(snapshot)
+
+    def test_restic_ignoring_term_is_killed_before_end_of_input(self):
+        timeout = restic.stream.TERMINATE_SECONDS
+        restic.stream.TERMINATE_SECONDS = 0.5
+        try:
+            ok, code, snapshot = self.stream(['sh', '-c', 'echo data; exit 3'], 'ignore-term')
+        finally:
+            restic.stream.TERMINATE_SECONDS = timeout
+        self.assertFalse(ok)
+        self.assertNotEqual(0, code)
+        self.assertIsNone(snapshot)